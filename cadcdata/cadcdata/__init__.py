@@ -45,3 +45,5 @@ inter processes communication to determine the result of running the command.
 
 from .core import *   # noqa
 from .storageinv import *   # noqa
+from .asyncstorageinv import *   # noqa
+from .manifest import *   # noqa
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#
+# ***********************************************************************
+
+"""
+asyncio Storage Inventory client. The requests are sent from the event loop
+by a cadcutils.net.AsyncBaseDataClient (requires httpx:
+`pip install cadcdata[async]`). Only the capabilities lookups, the URI scheme
+map, the MIME type detection and the local file I/O run in worker threads.
+"""
+
+import functools
+import logging
+import os
+import time
+from urllib.parse import urlparse
+
+from cadcutils import net, exceptions
+from cadcutils.net import asyncws
+
+from cadcdata.storageinv import StorageInventoryClient, FileInfo, \
+    DEFAULT_RESOURCE_ID, FILES_STANDARD_ID, LOCATE_STANDARD_ID, \
+    MAX_TRANSIENT_TRIES, SUPPORTED_SERVER_VERSIONS, validate_uri, \
+    validate_get_uri, _cutout_params, _mime_headers, _file_info
+
+__all__ = ['AsyncStorageInventoryClient']
+
+logger = logging.getLogger(__name__)
+
+
+async def _run_blocking(func, *args, **kwargs):
+    import asyncio  # not loaded for the sync clients
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(func, *args, **kwargs))
+
+
+def _fix_uri(func):
+    # coroutine version of storageinv._fix_uri: tries the possible URIs of
+    # an id without a scheme
+    @functools.wraps(func)
+    async def wrapper(self, id, *args, **kwargs):
+        fixed = await self._get_uris(id)
+        for uri in fixed:
+            try:
+                return await func(self, uri, *args, **kwargs)
+            except exceptions.NotFoundException:
+                if id != uri:
+                    logger.debug(uri + ' not found.')
+        if len(fixed) > 1:
+            logger.debug('Not found any of the possible URIs: {}'.format(
+                ' '.join(fixed)))
+        raise exceptions.NotFoundException(id)
+    return wrapper
+
+
+class AsyncStorageInventoryClient(object):
+    """
+    Storage Inventory client with coroutine versions of the
+    StorageInventoryClient commands. It shares the transfer cache, endpoint
+    ranker and circuit breaker of the StorageInventoryClient (`client`) that
+    it is built on.
+
+    Example:
+        client = await AsyncStorageInventoryClient.create(subject)
+        async with client:
+            file_infos = await asyncio.gather(
+                *[client.cadcinfo(id) for id in ids], return_exceptions=True)
+    """
+
+    def __init__(self, subject=net.Subject(), resource_id=DEFAULT_RESOURCE_ID,
+                 host=None, insecure=False, pool_maxsize=None,
+                 transport=None):
+        """
+        Instance of an AsyncStorageInventoryClient. Note that the constructor
+        accesses the network for the authentication with user/password (see
+        `create`).
+        :param subject: the subject(user) performing the action
+        :type subject: cadcutils.net.Subject
+        :param resource_id: The identifier of the service resource
+                            (e.g 'ivo://cadc.nrc.ca/data')
+        :param host: Host server for the caom2repo service
+        :param insecure Allow insecure server connections over SSL
+        :param pool_maxsize: maximum number of connections kept alive. The
+        requests in excess wait for a connection when POOL_BLOCK is set.
+        :param transport: httpx transport of the requests (see
+        cadcutils.net.AsyncRetrySession)
+        """
+        self.client = StorageInventoryClient(
+            subject, resource_id, host=host, insecure=insecure,
+            pool_maxsize=pool_maxsize)
+        self._cadc_client = asyncws.AsyncBaseDataClient(
+            resource_id, subject, self.client._cadc_client.agent,
+            retry=True, host=host, insecure=insecure,
+            server_versions=SUPPORTED_SERVER_VERSIONS,
+            pool_maxsize=pool_maxsize, transport=transport)
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        """
+        Creates a client without blocking the event loop.
+        :param args: positional arguments of the constructor
+        :param kwargs: keyword arguments of the constructor
+        :return: the client
+        """
+        return await _run_blocking(cls, *args, **kwargs)
+
+    async def aclose(self):
+        """
+        Closes the connections of the client
+        """
+        await self._cadc_client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    @_fix_uri
+    async def cadcinfo(self, id):
+        """
+        Coroutine version of StorageInventoryClient.cadcinfo
+        """
+        validate_uri(id)
+        resource = (FILES_STANDARD_ID, id)
+        logger.debug('HEAD {}'.format(resource))
+        try:
+            response = await self._cadc_client.head(resource,
+                                                    follow_redirects=True)
+        except exceptions.NotFoundException as e:
+            raise exceptions.NotFoundException(id, e)
+        return _file_info(id, response.headers)
+
+    @_fix_uri
+    async def cadcget(self, id, dest=None, fhead=False, process_bytes=None):
+        """
+        Coroutine version of StorageInventoryClient.cadcget. Note that
+        `process_bytes` is called in the event loop and must not block.
+        """
+        validate_get_uri(id)
+        logger.debug('cadcget GET {} -> {}'.format(id, dest))
+        id, params = _cutout_params(id)
+        urls = await self._get_transfer_urls(id, params=params)
+        if len(urls) == 0:
+            raise exceptions.HttpException('No URLs available to access data')
+        last_exception = None
+        if fhead:
+            if params and ('SUB' in params):
+                raise AttributeError(
+                    'Cannot perform fhead and cutout at the same time')
+            else:
+                params['META'] = 'true'
+        for url in urls:
+            logger.debug('GET from URL {}'.format(url))
+            try:
+                start = time.time()
+                name, md5sum, size = await self._cadc_client.download_file(
+                    url=url, dest=dest, params=params,
+                    process_bytes=process_bytes)
+                if self.client.endpoint_ranker is not None:
+                    self.client.endpoint_ranker.record_success(
+                        url, size, time.time() - start)
+                return FileInfo(id, size=size, name=name, md5sum=md5sum)
+            except Exception as e:
+                self.client._endpoint_failed(url, e)
+                if isinstance(e, exceptions.TransferException) and \
+                        hasattr(dest, 'write'):
+                    # content has already been written to the stream
+                    raise e
+                # try a different URL
+                logger.debug(
+                    'WARN: Cannot retrieve data from {}. Exception: {}'.
+                    format(url, e))
+                last_exception = e
+                if isinstance(e, exceptions.TransferException) and \
+                        urls.count(url) < MAX_TRANSIENT_TRIES:
+                    # this is a transient exception - append url to try later
+                    logger.debug('Transient error, retry later: {} - {}'.
+                                 format(url, str(e)))
+                    urls.append(url)
+                if urls:
+                    logger.debug('Try the next URL')
+        if last_exception:
+            raise last_exception
+        else:
+            raise exceptions.HttpException(
+                'BUG: Unable to download data to any of the available URLs')
+
+    async def cadcput(self, id, src, replace=False, file_type=None,
+                      file_encoding=None, md5_checksum=None):
+        """
+        Coroutine version of StorageInventoryClient.cadcput for files smaller
+        than cadcutils.net.ws.FILE_SEGMENT_THRESHOLD.
+        """
+        validate_uri(id)
+        if self._cadc_client.subject.anon:
+            raise exceptions.UnauthorizedException(
+                'Must be authenticated to put data')
+
+        headers, mtype, mencoding = await _run_blocking(
+            _mime_headers, src, file_type, file_encoding)
+        if md5_checksum:
+            net.add_md5_header(headers, md5_checksum=md5_checksum)
+
+        operation = 'put'
+        if md5_checksum:
+            try:
+                file_info = await self.cadcinfo(id)
+            except exceptions.NotFoundException:
+                file_info = None
+
+            if file_info and (file_info.md5sum == md5_checksum):
+                if (file_info.file_type != headers['Content-Type']) or \
+                   (file_info.encoding != headers['Content-Encoding']):
+                    operation = 'post'
+                else:
+                    logger.info('Source {} already in the storage '
+                                'inventory'.format(src))
+                    return file_info
+
+        urls = await self._get_transfer_urls(id, is_get=False)
+        if len(urls) == 0:
+            raise exceptions.HttpException('No URLs available to put data to')
+
+        last_exception = None
+        for url in urls:
+            last_exception = None  # reset the last exception
+            if operation == 'post':
+                logger.debug('POST to URL {}'.format(url))
+                start = time.time()
+                await self._cadc_client.post(url, headers=headers)
+                duration = time.time() - start
+                logger.info('Updated metadata for identifier {} in {} ms'.
+                            format(id, duration))
+                return file_info
+            logger.debug('PUT to URL {}'.format(url))
+            try:
+                size = os.stat(src).st_size
+                start = time.time()
+                uploaded = await self._cadc_client.upload_file(
+                    url=url, src=src, md5_checksum=md5_checksum,
+                    headers=headers)
+                duration = time.time() - start
+                self.client._invalidate_transfer_urls(id)
+                if self.client.endpoint_ranker is not None:
+                    self.client.endpoint_ranker.record_success(
+                        url, size, duration)
+                return FileInfo(
+                    id, size=size, name=os.path.basename(src),
+                    md5sum=uploaded[1], file_type=mtype, encoding=mencoding)
+            except Exception as e:
+                last_exception = e
+                self.client._endpoint_failed(url, e)
+                if isinstance(e, exceptions.TransferException) and \
+                        urls.count(url) < MAX_TRANSIENT_TRIES:
+                    # this is a transient exception - append url to try later
+                    urls.append(url)
+                # try a different URL
+                logger.debug('WARN: Cannot {} data to {}. Exception: {}'.
+                             format(operation, url, e))
+                if urls:
+                    logger.debug('Try the next URL')
+                continue
+        if last_exception:
+            raise last_exception
+        else:
+            raise exceptions.HttpException(
+                'Unable to {} data from any of the available '
+                'URLs'.format(operation))
+
+    async def cadcremove(self, id):
+        """
+        Coroutine version of StorageInventoryClient.cadcremove
+        """
+        validate_uri(id)
+        if self._cadc_client.subject.anon:
+            raise exceptions.UnauthorizedException(
+                'Must be authenticated to remove data')
+
+        # check file is there
+        await self.cadcinfo(id)
+        urls = await self._get_transfer_urls(id, is_get=False)
+        if len(urls) == 0:
+            raise exceptions.NotFoundException(
+                'File not found: {}'.format(id))
+
+        error_msg = ''
+        for url in urls:
+            logger.debug(
+                'REMOVE file with identifier {} from URL {}'.format(id, url))
+            try:
+                start = time.time()
+                await self._cadc_client.delete(url)
+                duration = time.time() - start
+                self.client._invalidate_transfer_urls(id)
+                logger.info('{} removed in {} ms'.format(id, duration))
+                return
+            except Exception as e:
+                self.client._endpoint_failed(url, e)
+                logger.debug('WARN: Cannot remove data from {}. Exception: {}'.
+                             format(url, e))
+                error_msg += str(e) + '\n'
+                if urls:
+                    # try a different URL
+                    logger.debug('Try the next URL')
+                continue
+        # no successful DELETE so far. Double check the existence of file
+        # in global
+        try:
+            await self.cadcinfo(id)
+        except exceptions.NotFoundException:
+            logger.debug('{} not in global anymore. File removed')
+            raise exceptions.NotFoundException(id)
+        raise exceptions.HttpException(error_msg)
+
+    async def _get_service_url(self, standard_id):
+        # URL of a capability of the service or None when not supported
+        try:
+            return await self._cadc_client.get_url((standard_id, None))
+        except KeyError:
+            return None
+
+    async def _get_transfer_urls(self, id, params=None, is_get=True):
+        transfer_url = await self._get_service_url(LOCATE_STANDARD_ID)
+        if not transfer_url:
+            # this is site location
+            return ['{}/{}'.format(
+                await self._get_service_url(FILES_STANDARD_ID), id)]
+        trans = asyncws.AsyncTransfer(self._cadc_client._get_session(),
+                                      cache=self.client.transfer_cache)
+        urls = await trans.transfer(
+            endpoint_url=transfer_url, uri=id,
+            direction='pullFromVoSpace' if is_get else 'pushToVoSpace',
+            cutout=params)
+        return self.client._rank_urls(urls)
+
+    async def _get_uris(self, target):
+        if urlparse(target).scheme:
+            return [target]
+        # the URI scheme map is read from the service or a cache file
+        return await _run_blocking(self.client._get_uris, target)
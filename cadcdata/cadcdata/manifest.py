@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#
+# ***********************************************************************
+
+"""
+Manifest of bulk transfers. The manifest is an append-only journal of JSON
+lines that records the state (pending, done or failed) of the transfer of
+each file together with its size and md5 checksum. When a bulk transfer
+is run again with the same manifest, the files that the manifest confirms
+as transferred are skipped without any network call and only the pending
+or failed ones are transferred.
+
+A file is confirmed when its last record is done and:
+    - put: the source file has the recorded path, size and modification time
+    - get: the destination file exists in the destination directory of the
+      transfer and has the recorded size
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+__all__ = ['TransferManifest']
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class TransferManifest(object):
+    """
+    Manifest of bulk transfers. Records are flushed to disk as they are
+    written so that they survive a crash of the process. Instances can be
+    shared between threads.
+
+    Example:
+        with TransferManifest('put.manifest') as manifest:
+            client.bulk_put(files, manifest=manifest, max_workers=8)
+    """
+
+    def __init__(self, location):
+        """
+        :param location: file of the manifest. It is created if it does not
+        exist, otherwise its records are loaded.
+        """
+        self.location = location
+        self._entries = {}  # (op, id) -> last record
+        self._lock = threading.Lock()
+        line = ''
+        if os.path.isfile(location):
+            with open(location) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self._entries[(record['op'], record['id'])] = record
+                    except (ValueError, KeyError, TypeError):
+                        # most likely the last line written by a process
+                        # that crashed
+                        logger.debug('Ignore manifest line: {}'.format(line))
+        self._file = open(location, 'a')
+        if line and not line.endswith('\n'):
+            # terminate the truncated line so that it does not swallow the
+            # next record
+            self._file.write('\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get(self, op, id):
+        """
+        :param op: type of transfer (put or get)
+        :param id: identifier of the file
+        :return: last record of the file or None
+        """
+        with self._lock:
+            record = self._entries.get((op, id))
+            return None if record is None else dict(record)
+
+    def record(self, op, id, state, **fields):
+        """
+        Appends a record
+        :param op: type of transfer (put or get)
+        :param id: identifier of the file
+        :param state: pending, done or failed
+        :param fields: other fields of the record (path, size, md5, mtime,
+        error)
+        """
+        record = dict(fields, op=op, id=id, state=state, time=time.time())
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._entries[(op, id)] = record
+
+    def is_confirmed(self, op, id, src=None, dest=None):
+        """
+        Checks whether the manifest confirms the transfer of a file (see the
+        module documentation). Only local files are checked.
+        :param op: type of transfer (put or get)
+        :param id: identifier of the file
+        :param src: source file of a put
+        :param dest: destination directory of a get (default is the current
+        directory)
+        :return: True if the file does not need to be transferred again
+        """
+        record = self.get(op, id)
+        if record is None or record['state'] != DONE:
+            return False
+        try:
+            if op == 'put':
+                stat_info = os.stat(src)
+                return os.path.realpath(src) == record.get('path') and \
+                    stat_info.st_size == record.get('size') and \
+                    stat_info.st_mtime == record.get('mtime')
+            path = record['path']
+            return os.path.dirname(path) == \
+                os.path.realpath(dest or os.curdir) and \
+                os.path.getsize(path) == record.get('size')
+        except (OSError, KeyError, TypeError):
+            return False
+
+    def summary(self):
+        """
+        :return: dictionary of the number of files in each state
+        """
+        with self._lock:
+            states = [r['state'] for r in self._entries.values()]
+        return {state: states.count(state) for state in set(states)}
@@ -70,16 +70,21 @@ import os
 import os.path
 import sys
 import time
-from clint.textui import progress
 import datetime
 import traceback
 from urllib.parse import urlparse, urlencode
 import argparse
+import collections
+import concurrent.futures
+import contextlib
+
+import requests
 
 from cadcutils import net, util, exceptions
 from cadcutils.util import date2ivoa
 
 from cadcdata import version
+from cadcdata.manifest import TransferManifest, PENDING, DONE, FAILED
 
 CADC_AC_SERVICE = 'ivo://cadc.nrc.ca/gms'
 CADC_LOGIN_CAPABILITY = 'ivo://ivoa.net/std/UMS#login-0.1'
@@ -90,19 +95,30 @@ SUPPORTED_SERVER_VERSIONS = {'storage-inventory/raven': '1.0',
                              'storage-inventory/minoc': '1.0'}
 
 MAGIC_WARN = None
-try:
-    import magic
-except ImportError as e:
-    if 'libmagic' in str(e):
-        MAGIC_WARN = ('Can not determine the MIME info. Please install '
-                      'libmagic system library or explicitly specify MIME '
-                      'type and encoding for each file.')
-    else:
-        raise e
+_magic = None
 
 
-# make the stream bar show up on stdout
-progress.STREAM = sys.stdout
+def _load_magic():
+    """
+    Imports python-magic (and the libmagic library) on first use only since
+    it is slow to load and not needed by most of the commands.
+    :return: the magic module or None when libmagic is not available, in
+    which case MAGIC_WARN is set
+    """
+    global _magic, MAGIC_WARN
+    if _magic is None and MAGIC_WARN is None:
+        try:
+            import magic
+            _magic = magic
+        except ImportError as e:
+            if 'libmagic' in str(e):
+                MAGIC_WARN = ('Can not determine the MIME info. Please install '
+                              'libmagic system library or explicitly specify '
+                              'MIME type and encoding for each file.')
+            else:
+                raise e
+    return None if MAGIC_WARN else _magic
+
 
 __all__ = ['StorageInventoryClient', 'FileInfo', 'cadcput_cli', 'cadcget_cli',
            'cadcinfo_cli', 'cadcremove_cli']
@@ -127,6 +143,16 @@ logger = logging.getLogger(__name__)
 # maximum number of times to try an URL with transient error
 MAX_TRANSIENT_TRIES = 3
 
+# default number of concurrent HEAD requests in cadcinfo_many
+INFO_WORKERS = 10
+
+# time (sec) that bulk_get keeps the transfers it negotiates ahead of the
+# downloads when the transfer cache is not enabled
+BULK_NEGOTIATION_TTL = 600
+
+# number of concurrent transfer negotiations ahead of the bulk_get downloads
+NEGOTIATION_WORKERS = 10
+
 
 # TODO This is a dataclass for when Py3.7 becomes the minimum supported version
 class FileInfo:
@@ -160,6 +186,29 @@ class FileInfo:
                                self.md5sum))
 
 
+def _is_endpoint_error(error):
+    # True for the errors of a transfer that are caused by the endpoint
+    # rather than by the request or the local system: transport errors,
+    # server (5xx) errors and TransferException
+    if isinstance(error, exceptions.TransferException):
+        return True
+    if isinstance(error, (exceptions.NotFoundException,
+                          exceptions.UnauthorizedException,
+                          exceptions.ForbiddenException,
+                          exceptions.BadRequestException,
+                          exceptions.PreconditionFailedException,
+                          exceptions.AlreadyExistsException,
+                          exceptions.ByteLimitException)):
+        return False
+    if isinstance(error, exceptions.HttpException):
+        response = getattr(error.orig_exception, 'response', None)
+        if response is None:
+            # no response from the server
+            return True
+        return response.status_code >= 500
+    return isinstance(error, requests.RequestException)
+
+
 def handle_error(exception, exit_after=True):
     """
     Prints error message and exit (by default)
@@ -267,13 +316,78 @@ def argparse_validate_get_uri(uri):
     return uri
 
 
+def _cutout_params(id):
+    # splits the cutouts out of a cadcget id. Returns the id of the file and
+    # the parameters of the request
+    params = {}
+    uri = urlparse(id)
+    if 'cutout=[' in uri.query.lower():
+        lquery = uri.query.lower()
+        params['SUB'] = [x.strip('&') for x in lquery.split('cutout=')[1:]]
+        id = uri.scheme + ":" + uri.path
+    return id, params
+
+
+def _mime_headers(src, file_type, file_encoding):
+    # headers with the MIME type and encoding of a file. They are detected
+    # (magic) unless provided. Returns (headers, type, encoding)
+    headers = {}
+    magic = None
+    if file_type is None or not file_encoding:
+        magic = _load_magic()
+    if file_type is not None:
+        mtype = file_type
+    elif magic is None:
+        mtype = None
+        logger.warning(MAGIC_WARN)
+    else:
+        m = magic.Magic(mime=True)
+        mtype = m.from_file(os.path.realpath(src))
+    if file_encoding:
+        mencoding = file_encoding
+    elif magic is None:
+        mencoding = None
+        if mtype:
+            logger.warning(MAGIC_WARN)
+    else:
+        m = magic.Magic(mime_encoding=True)
+        mencoding = m.from_file(os.path.realpath(src))
+    if mtype is not None:
+        headers['Content-Type'] = mtype
+        logger.debug('Set MIME type: {}'.format(mtype))
+
+    if mencoding:
+        headers['Content-Encoding'] = mencoding
+        logger.debug('Set MIME encoding: {}'.format(mencoding))
+    return headers, mtype, mencoding
+
+
+def _file_info(id, headers):
+    # FileInfo of a file from the headers of a HEAD response
+    file_info = FileInfo(id)
+    size = headers.get('Content-Length', None)
+    if size is not None:
+        file_info.size = int(size)
+    file_info.md5sum = net.extract_md5(headers)
+    file_info.name = net.netutils.get_header_filename(headers)
+    if headers.get('Last-Modified', None):
+        file_info.lastmod = \
+            datetime.datetime.strptime(headers.get('Last-Modified'),
+                                       '%a, %d %b %Y %H:%M:%S %Z')
+    file_info.file_type = headers.get('Content-Type', None)
+    file_info.encoding = headers.get('Content-Encoding', None)
+    logger.debug('File info: {}'.format(file_info))
+    return file_info
+
+
 def _fix_uri(func):
     def wrapper(*args, **kwargs):
         if 'id' in kwargs:
             id = kwargs['id']
         else:
             id = args[1]
-        fixed = args[0]._get_uris(id)
+        with util.timing_phase('resolve'):
+            fixed = args[0]._get_uris(id)
         for uri in fixed:
             if 'id' in kwargs:
                 kwargs['id'] = uri
@@ -292,6 +406,27 @@ def _fix_uri(func):
     return wrapper
 
 
+def _timed(operation):
+    # records the phases of the transfer in the timing report of the client
+    # (if any). Goes before _fix_uri so that the resolution is timed.
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            report = args[0].timing
+            if report is None:
+                return func(*args, **kwargs)
+            id = kwargs['id'] if 'id' in kwargs else args[1]
+            with util.transfer_timing(report.new_timing(id, operation)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _set_timing_size(size):
+    timing = util.current_timing()
+    if timing is not None:
+        timing.size = size
+
+
 class StorageInventoryClient(object):
     """Class to access CADC storage inventory.
 
@@ -336,7 +471,7 @@ class StorageInventoryClient(object):
     """
 
     def __init__(self, subject=net.Subject(), resource_id=DEFAULT_RESOURCE_ID,
-                 host=None, insecure=False):
+                 host=None, insecure=False, pool_maxsize=None):
         """
         Instance of a StorageInventoryClient
         :param subject: the subject(user) performing the action
@@ -345,6 +480,8 @@ class StorageInventoryClient(object):
                             (e.g 'ivo://cadc.nrc.ca/data')
         :param host: Host server for the caom2repo service
         :param insecure Allow insecure server connections over SSL
+        :param pool_maxsize: maximum number of connections kept alive for each
+        host. Should be at least the number of concurrent transfers.
         """
 
         self.resource_id = resource_id
@@ -386,13 +523,23 @@ class StorageInventoryClient(object):
             resource_id, subject,
             agent, retry=True, host=self.host,
             insecure=insecure,
-            server_versions=SUPPORTED_SERVER_VERSIONS)
+            server_versions=SUPPORTED_SERVER_VERSIONS,
+            pool_maxsize=pool_maxsize)
 
         # for now, this is only used to get the pub schema-archive mapping info
         self._data_client = net.BaseWsClient(DATA_RESOURCE_ID, net.Subject(),
                                              agent, retry=True, host=self.host,
                                              insecure=insecure,
                                              server_versions=SUPPORTED_SERVER_VERSIONS)
+        # endpoints of previous transfer negotiations (None when disabled)
+        self.transfer_cache = net.get_transfer_cache()
+        # performance of the endpoint hosts (None when disabled)
+        self.endpoint_ranker = net.get_endpoint_ranker()
+        # hosts that fail at the moment (None when disabled)
+        self.circuit_breaker = net.get_circuit_breaker()
+        # cadcutils.util.TimingReport that receives the breakdown of the time
+        # spent in the phases of each cadcget and cadcput (None when disabled)
+        self.timing = None
 
     @property
     def transfer(self):
@@ -418,8 +565,10 @@ class StorageInventoryClient(object):
         except KeyError:
             return None
 
+    @_timed('get')
     @_fix_uri
-    def cadcget(self, id, dest=None, fhead=False, process_bytes=None):
+    def cadcget(self, id, dest=None, fhead=False, process_bytes=None,
+                transfer_cache=None):
         """
         Get a file from an archive. The entire file is delivered unless the
         cutout argument is present in the id in which case only the
@@ -433,17 +582,19 @@ class StorageInventoryClient(object):
         anything that supports open/close and write).
         :param fhead: return the FITS header information (for all extensions)
         :param process_bytes: function to be applied to the received bytes
+        :param transfer_cache: net.TransferCache with the negotiated transfers
+        to use instead of the `transfer_cache` of the client
+        :return: FileInfo with the name, size and md5 checksum of the
+        received content
         """
 
         validate_get_uri(id)
         logger.debug('cadcget GET {} -> {}'.format(id, dest))
-        params = {}
-        uri = urlparse(id)
-        if 'cutout=[' in uri.query.lower():
-            lquery = uri.query.lower()
-            params['SUB'] = [x.strip('&') for x in lquery.split('cutout=')[1:]]
-            id = uri.scheme + ":" + uri.path
-        urls = self._get_transfer_urls(id, params=params)
+        id, params = _cutout_params(id)
+        if transfer_cache is None:
+            transfer_cache = self.transfer_cache
+        urls = self._get_transfer_urls(id, params=params,
+                                       transfer_cache=transfer_cache)
         if len(urls) == 0:
             raise exceptions.HttpException('No URLs available to access data')
         last_exception = None
@@ -456,9 +607,22 @@ class StorageInventoryClient(object):
         for url in urls:
             logger.debug('GET from URL {}'.format(url))
             try:
-                self._cadc_client.download_file(url=url, dest=dest, params=params)
-                return
+                start = time.time()
+                with util.timing_phase('transfer'):
+                    name, md5sum, size = self._cadc_client.download_file(
+                        url=url, dest=dest, params=params,
+                        process_bytes=process_bytes)
+                _set_timing_size(size)
+                if self.endpoint_ranker is not None:
+                    self.endpoint_ranker.record_success(
+                        url, size, time.time() - start)
+                return FileInfo(id, size=size, name=name, md5sum=md5sum)
             except Exception as e:
+                self._endpoint_failed(url, e, transfer_cache)
+                if isinstance(e, exceptions.TransferException) and \
+                        hasattr(dest, 'write'):
+                    # content has already been written to the stream
+                    raise e
                 # try a different URL
                 logger.debug(
                     'WARN: Cannot retrieve data from {}. Exception: {}'.
@@ -478,6 +642,45 @@ class StorageInventoryClient(object):
             raise exceptions.HttpException(
                 'BUG: Unable to download data to any of the available URLs')
 
+    @_fix_uri
+    def iter_bytes(self, id, chunk_size=None, byte_range=None):
+        """
+        Returns an iterator over the content of a file. The content is
+        downloaded as it is consumed so the iteration can be stopped (and the
+        iterator closed) before the end of the file without downloading the
+        rest of it.
+        :param id: the CADC Storage Inventory identifier (URI) of the file.
+        If the scheme in the URI is missing, the system will try to guess it
+        and return the first match. Cutouts are not supported.
+        :param chunk_size: size of the returned chunks of bytes
+        :param byte_range: (first, last) tuple with the positions of the first
+        and last bytes (inclusive) to return. last can be None for the end
+        of the file. Can be used to resume from an offset.
+        :return: iterator of bytes. The size and, for entire files, the md5
+        checksum of the content are verified after the last chunk
+        (TransferException).
+        """
+        validate_uri(id, False)
+        logger.debug('iter_bytes GET {} {}'.format(id, byte_range))
+        urls = self._get_transfer_urls(id)
+        if len(urls) == 0:
+            raise exceptions.HttpException('No URLs available to access data')
+        last_exception = None
+        for url in urls:
+            logger.debug('GET from URL {}'.format(url))
+            try:
+                return self._cadc_client.iter_file(
+                    url, chunk_size=chunk_size, byte_range=byte_range)
+            except Exception as e:
+                self._endpoint_failed(url, e)
+                # try a different URL
+                logger.debug(
+                    'WARN: Cannot retrieve data from {}. Exception: {}'.
+                    format(url, e))
+                last_exception = e
+        raise last_exception
+
+    @_timed('put')
     def cadcput(self, id, src, replace=False, file_type=None,
                 file_encoding=None, md5_checksum=None):
         """
@@ -491,6 +694,7 @@ class StorageInventoryClient(object):
         :param file_encoding: file MIME encoding
         :param md5_checksum: md5 sum of the content. Bytes are always
         transferred when this argument is not provided.
+        :return: FileInfo of the file in the inventory system
         """
         validate_uri(id)
         # We actually raise an exception here since the web
@@ -500,40 +704,17 @@ class StorageInventoryClient(object):
             raise exceptions.UnauthorizedException(
                 'Must be authenticated to put data')
 
-        headers = {}
-
-        if file_type is not None:
-            mtype = file_type
-        elif MAGIC_WARN:
-            mtype = None
-            logger.warning(MAGIC_WARN)
-        else:
-            m = magic.Magic(mime=True)
-            mtype = m.from_file(os.path.realpath(src))
-        if mtype is not None:
-            headers['Content-Type'] = mtype
-            logger.debug('Set MIME type: {}'.format(mtype))
-
-        if file_encoding:
-            mencoding = file_encoding
-        elif MAGIC_WARN:
-            mencoding = None
-            if mtype:
-                logger.warning(MAGIC_WARN)
-        else:
-            m = magic.Magic(mime_encoding=True)
-            mencoding = m.from_file(os.path.realpath(src))
-        if mencoding:
-            headers['Content-Encoding'] = mencoding
-            logger.debug('Set MIME encoding: {}'.format(mencoding))
-
+        with util.timing_phase('mime'):
+            headers, mtype, mencoding = _mime_headers(src, file_type,
+                                                      file_encoding)
         if md5_checksum:
             net.add_md5_header(headers, md5_checksum=md5_checksum)
 
         operation = 'put'
         if md5_checksum:
             try:
-                file_info = self.cadcinfo(id)
+                with util.timing_phase('head'):
+                    file_info = self.cadcinfo(id)
             except exceptions.NotFoundException:
                 file_info = None
 
@@ -544,7 +725,7 @@ class StorageInventoryClient(object):
                 else:
                     logger.info('Source {} already in the storage '
                                 'inventory'.format(src))
-                    return
+                    return file_info
 
         urls = self._get_transfer_urls(id, is_get=False)
         if len(urls) == 0:
@@ -557,30 +738,41 @@ class StorageInventoryClient(object):
             if operation == 'post':
                 logger.debug('POST to URL {}'.format(url))
                 start = time.time()
-                result = self._cadc_client.post(url, headers=headers)
+                with util.timing_phase('transfer'):
+                    result = self._cadc_client.post(url, headers=headers)
                 result.raise_for_status()
                 duration = time.time() - start
                 logger.info('Updated metadata for identifier {} in {} ms'.
                             format(id, duration))
-                return
+                return file_info
             logger.debug('PUT to URL {}'.format(url))
             try:
                 file_info = os.stat(src)
+                _set_timing_size(file_info.st_size)
                 start = time.time()
-                self._cadc_client.upload_file(
-                    url=url,
-                    src=src,
-                    md5_checksum=md5_checksum,
-                    headers=headers)
+                with util.timing_phase('transfer'):
+                    uploaded = self._cadc_client.upload_file(
+                        url=url,
+                        src=src,
+                        md5_checksum=md5_checksum,
+                        headers=headers)
                 duration = time.time() - start
+                self._invalidate_transfer_urls(id)
+                if self.endpoint_ranker is not None:
+                    self.endpoint_ranker.record_success(
+                        url, file_info.st_size, duration)
                 logger.info(
                     ('Successfully uploaded file {} in {}s '
                      '(avg. speed: {}MB/s)').format(
                         id, round(duration, 2),
                         round(file_info.st_size / 1024 / 1024 / duration, 2)))
-                return
+                return FileInfo(
+                    id, size=file_info.st_size, name=os.path.basename(src),
+                    md5sum=uploaded[1],
+                    file_type=mtype, encoding=mencoding)
             except Exception as e:
                 last_exception = e
+                self._endpoint_failed(url, e)
                 if isinstance(e, exceptions.TransferException) and \
                         urls.count(url) < MAX_TRANSIENT_TRIES:
                     # this is a transient exception - append url to try later
@@ -598,6 +790,181 @@ class StorageInventoryClient(object):
                 'Unable to {} data from any of the available '
                 'URLs'.format(operation))
 
+    def bulk_put(self, files, file_type=None, file_encoding=None,
+                 max_workers=1, manifest=None):
+        """
+        Puts multiple files into the inventory system. The files are
+        transferred concurrently by up to `max_workers` threads that share
+        the authenticated session of the client. Unlike `cadcput`, a failure
+        does not stop the transfer of the other files.
+        :param files: list of (id, src) tuples with the unique identifier
+        (URI) in the CADC inventory and the location of each source file
+        :param file_type: file MIME type applied to all the files
+        :param file_encoding: file MIME encoding applied to all the files
+        :param max_workers: maximum number of concurrent transfers
+        :param manifest: TransferManifest that records the transfers. Files
+        that it confirms as already put are skipped.
+        :returns dictionary of ids and corresponding exceptions for the files
+        that failed to transfer (empty when all succeeded)
+        """
+        cmd_args = [{'id': id, 'src': src, 'file_type': file_type,
+                     'file_encoding': file_encoding} for id, src in files]
+        if manifest is not None:
+            cmd_args = [args for args in cmd_args
+                        if not self._confirmed(manifest, 'put', args['id'],
+                                               args['src'])]
+        return self._bulk_execute(self.cadcput, cmd_args, max_workers,
+                                  manifest=manifest, op='put')
+
+    def bulk_get(self, ids, dest=None, fhead=False, max_workers=1,
+                 manifest=None):
+        """
+        Gets multiple files from the inventory system. The files are
+        transferred concurrently by up to `max_workers` threads that share
+        the authenticated session of the client. Unlike `cadcget`, a failure
+        does not stop the transfer of the other files.
+        :param ids: list of the CADC Storage Inventory identifiers (URI) of the
+        files to retrieve (see `cadcget`)
+        :param dest: directory to save the files to (default is the current
+        directory)
+        :param fhead: return the FITS header information (for all extensions)
+        :param max_workers: maximum number of concurrent transfers
+        :param manifest: TransferManifest that records the transfers. Files
+        that it confirms as already received are skipped.
+        :returns dictionary of ids and corresponding exceptions for the files
+        that failed to transfer (empty when all succeeded)
+        """
+        if dest is not None and not os.path.isdir(dest):
+            raise ValueError(
+                'Destination of multiple files must be a directory: {}'.format(
+                    dest))
+        ids = list(ids)
+        if manifest is not None:
+            ids = [id for id in ids
+                   if not self._confirmed(manifest, 'get', id, dest=dest)]
+        # endpoints negotiated for this call only, unless the transfer cache
+        # of the client is enabled
+        transfer_cache = self.transfer_cache
+        if transfer_cache is None:
+            transfer_cache = net.TransferCache(BULK_NEGOTIATION_TTL)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=NEGOTIATION_WORKERS) as negotiator:
+            # negotiate the transfers ahead of the downloads
+            negotiations = self._negotiate_gets(ids, transfer_cache,
+                                                negotiator)
+
+            def get(id, dest, fhead):
+                # the download picks up the endpoints from the cache once
+                # its negotiation is done
+                negotiation = negotiations.get(id, None)
+                if negotiation is not None:
+                    concurrent.futures.wait([negotiation])
+                return self.cadcget(id=id, dest=dest, fhead=fhead,
+                                    transfer_cache=transfer_cache)
+            try:
+                return self._bulk_execute(
+                    get,
+                    [{'id': id, 'dest': dest, 'fhead': fhead} for id in ids],
+                    max_workers, manifest=manifest, op='get')
+            finally:
+                for negotiation in negotiations.values():
+                    negotiation.cancel()
+
+    def _negotiate_gets(self, ids, transfer_cache, executor):
+        # submits the negotiations of the downloads of multiple files to the
+        # executor. The results go to the transfer cache. Returns the
+        # futures of the negotiations by id
+        transfer_url = self.transfer
+        if not transfer_url:
+            return {}
+        uris = {}
+        for id in ids:
+            uri = urlparse(id)
+            # ids without scheme are resolved by cadcget
+            if uri.scheme:
+                # cutouts are not part of the negotiation
+                uris[id] = '{}:{}'.format(uri.scheme, uri.path)
+        if len(uris) < 2:
+            return {}
+        trans = net.Transfer(self._cadc_client._get_session(),
+                             cache=transfer_cache)
+        negotiations = {}
+        futures = {}
+        for id, uri in uris.items():
+            if uri not in futures:
+                futures[uri] = executor.submit(
+                    self._negotiate_get, trans, transfer_url, uri)
+            negotiations[id] = futures[uri]
+        return negotiations
+
+    @staticmethod
+    def _negotiate_get(trans, transfer_url, uri):
+        try:
+            trans.transfer(transfer_url, uri, 'pullFromVoSpace',
+                           with_uws_job=False)
+        except Exception as e:
+            # cadcget negotiates it again and reports the error
+            logger.debug('Cannot negotiate the transfer of {}: {}'.format(
+                uri, str(e)))
+
+    @staticmethod
+    def _confirmed(manifest, op, id, src=None, dest=None):
+        if manifest.is_confirmed(op, id, src, dest):
+            logger.info('{} already transferred (manifest)'.format(id))
+            return True
+        return False
+
+    @staticmethod
+    def _manifest_cmd(cmd, manifest, op):
+        # records the states of the transfers of cmd in the manifest
+        def record(**args):
+            id = args['id']
+            manifest.record(op, id, PENDING)
+            try:
+                file_info = cmd(**args)
+            except Exception as e:
+                manifest.record(op, id, FAILED, error=str(e))
+                raise e
+            fields = {}
+            if file_info is not None:
+                fields = {'size': file_info.size, 'md5': file_info.md5sum}
+            if op == 'put':
+                stat_info = os.stat(args['src'])
+                fields.update({'path': os.path.realpath(args['src']),
+                               'size': stat_info.st_size,
+                               'mtime': stat_info.st_mtime})
+            elif file_info is not None and file_info.name:
+                fields['path'] = os.path.realpath(
+                    os.path.join(args.get('dest') or '.', file_info.name))
+            manifest.record(op, id, DONE, **fields)
+            return file_info
+        return record
+
+    def _bulk_execute(self, cmd, cmd_args, max_workers, manifest=None,
+                      op=None):
+        # create the session before the workers need it so that it is shared
+        self._cadc_client._get_session()
+        if manifest is not None:
+            cmd = self._manifest_cmd(cmd, manifest, op)
+        errors = {}
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, max_workers)) as executor:
+            futures = {executor.submit(cmd, **args): args['id']
+                       for args in cmd_args}
+            for future in concurrent.futures.as_completed(futures):
+                id = futures[future]
+                try:
+                    future.result()
+                    logger.info('{} done'.format(id))
+                except Exception as e:
+                    logger.debug('{} failed: {}'.format(id, str(e)))
+                    errors[id] = e
+        logger.debug('Connections: {}'.format(
+            self._cadc_client.connection_stats()))
+        # report errors in the order of the request
+        return {args['id']: errors[args['id']] for args in cmd_args
+                if args['id'] in errors}
+
     def cadcremove(self, id):
         """
         Removes a file into the inventory system. `NotFoundException` is raised
@@ -629,9 +996,11 @@ class StorageInventoryClient(object):
                 start = time.time()
                 self._cadc_client.delete(url)
                 duration = time.time() - start
+                self._invalidate_transfer_urls(id)
                 logger.info('{} removed in {} ms'.format(id, duration))
                 return
             except Exception as e:
+                self._endpoint_failed(url, e)
                 logger.debug('WARN: Cannot remove data from {}. Exception: {}'.
                              format(url, e))
                 error_msg += str(e) + '\n'
@@ -664,31 +1033,131 @@ class StorageInventoryClient(object):
             response = self._cadc_client.head(resource, allow_redirects=True)
         except exceptions.NotFoundException as e:
             raise exceptions.NotFoundException(id, e)
-        h = response.headers
-        file_info = FileInfo(id)
-        size = h.get('Content-Length', None)
-        if size is not None:
-            file_info.size = int(size)
-        file_info.md5sum = net.extract_md5(response.headers)
-        file_info.name = net.netutils.get_header_filename(response.headers)
-        if h.get('Last-Modified', None):
-            file_info.lastmod = \
-                datetime.datetime.strptime(h.get('Last-Modified'),
-                                           '%a, %d %b %Y %H:%M:%S %Z')
-        file_info.file_type = h.get('Content-Type', None)
-        file_info.encoding = h.get('Content-Encoding', None)
-        logger.debug('File info: {}'.format(file_info))
-        return file_info
-
-    def _get_transfer_urls(self, id, params=None, is_get=True):
-        if not self.transfer:
-            # this is site location
-            return ['{}/{}'.format(self.files, id)]
-        trans = net.Transfer(self._cadc_client._get_session(), )
-        return trans.transfer(
-            endpoint_url=self.transfer, uri=id,
-            direction='pullFromVoSpace' if is_get else 'pushToVoSpace',
-            with_uws_job=False, cutout=params)
+        return _file_info(id, response.headers)
+
+    def cadcinfo_many(self, ids, max_workers=INFO_WORKERS):
+        """
+        Get information regarding multiple files in SI. The HEAD requests are
+        sent concurrently by up to `max_workers` threads and the results are
+        returned in the order of `ids`.
+        For ids without a scheme, all the possible URIs are tried at the same
+        time and the first match (in the order of the `cadcinfo` guesses) is
+        returned.
+        :param ids: iterable of unique identifiers (URIs) for the files in the
+        CADC inventory system. An id that is repeated while its requests are
+        in progress shares their result but is still returned once for each
+        occurrence.
+        :param max_workers: maximum number of concurrent requests
+        :returns generator of (id, result) tuples where result is the
+        FileInfo object with the file metadata or the exception raised for
+        that id (NotFoundException when the file is not found).
+        """
+        ids = iter(ids)
+        futures = {}
+        pending = collections.deque()  # (id, results) in the order of ids
+        in_progress = {}  # results of the possible URIs of ids in progress
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, max_workers))
+        try:
+            while True:
+                # keep a bounded number of ids in progress
+                while len(pending) < 2 * max_workers:
+                    id = next(ids, None)
+                    if id is None:
+                        break
+                    results = in_progress.get(id)
+                    if results is None:
+                        try:
+                            validate_uri(id, strict=False)
+                            uris = self._get_uris(id)
+                        except Exception as e:
+                            pending.append((id, [e]))
+                            continue
+                        results = [None] * len(uris)
+                        in_progress[id] = results
+                        for index, uri in enumerate(uris):
+                            futures[executor.submit(self.cadcinfo, uri)] = \
+                                (results, index)
+                    # duplicate of an id in progress gets the same result
+                    pending.append((id, results))
+                # return the results that are decided, in order
+                while pending:
+                    id, results = pending[0]
+                    result = self._resolve_candidates(id, results)
+                    if result is None:
+                        break
+                    pending.popleft()
+                    if in_progress.get(id) is results:
+                        del in_progress[id]
+                    yield id, result
+                if not pending:
+                    break
+                done, _ = concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    results, index = futures.pop(future)
+                    try:
+                        results[index] = future.result()
+                    except Exception as e:
+                        results[index] = e
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def _resolve_candidates(id, results):
+        # returns the result of the first URI guess that is found, an error
+        # if all the guesses failed or None if it cannot be decided yet
+        for result in results:
+            if result is None:
+                return None
+            if not isinstance(result, exceptions.NotFoundException):
+                return result
+        return exceptions.NotFoundException(id)
+
+    def _get_transfer_urls(self, id, params=None, is_get=True,
+                           transfer_cache=None):
+        with util.timing_phase('negotiate'):
+            if not self.transfer:
+                # this is site location
+                return ['{}/{}'.format(self.files, id)]
+            if transfer_cache is None:
+                transfer_cache = self.transfer_cache
+            trans = net.Transfer(self._cadc_client._get_session(),
+                                 cache=transfer_cache)
+            urls = trans.transfer(
+                endpoint_url=self.transfer, uri=id,
+                direction='pullFromVoSpace' if is_get else 'pushToVoSpace',
+                with_uws_job=False, cutout=params)
+        return self._rank_urls(urls)
+
+    def _rank_urls(self, urls):
+        # order in which the negotiated endpoints are tried
+        if self.endpoint_ranker is not None:
+            # try the best performing sites first
+            urls = self.endpoint_ranker.rank(urls)
+        if self.circuit_breaker is not None:
+            # and the sites that fail at the moment last
+            urls.sort(key=lambda url: self.circuit_breaker.is_open(
+                urlparse(url).netloc))
+        return urls
+
+    def _endpoint_failed(self, url, error, transfer_cache=None):
+        # failed endpoints are negotiated again next time and their hosts
+        # are tried last for a while. Errors of the request (e.g. file not
+        # found) or local errors do not count against the endpoint.
+        if not _is_endpoint_error(error):
+            return
+        if transfer_cache is None:
+            transfer_cache = self.transfer_cache
+        if transfer_cache is not None:
+            transfer_cache.discard(url)
+        if self.endpoint_ranker is not None:
+            self.endpoint_ranker.record_failure(url)
+
+    def _invalidate_transfer_urls(self, id):
+        # file changed or removed
+        if self.transfer_cache is not None:
+            self.transfer_cache.invalidate(id)
 
     def _get_uris(self, target):
         # takes a target URI and if the URI is not fully qualified (schema
@@ -701,7 +1170,9 @@ class StorageInventoryClient(object):
         scheme_file = os.path.join(
             os.path.dirname(self._data_client.caps.caps_file),
             '.data_uri_scheme_map')
-        scheme_url = self._data_client.caps.caps_urls[DATA_RESOURCE_ID].replace('/capabilities', '/uri-scheme-map')
+        # the registry is not loaded yet when the client was built with a host
+        scheme_url = self._data_client.caps._get_capability_url().replace(
+            '/capabilities', '/uri-scheme-map')
         content = util.get_url_content(url=scheme_url,
                                        cache_file=scheme_file,
                                        refresh_interval=24 * 60 * 60)
@@ -756,6 +1227,11 @@ def build_cadcput_parser():
     parser.add_argument('-r', '--replace', action='store_true',
                         help='DEPRECATED. A safeguard for accidental '
                              'replacements.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of files to put at the same time '
+                             '(default: 1)')
+    _add_timing_argument(parser)
+    _add_manifest_argument(parser)
     parser.add_argument(
         'identifier', type=argparse_validate_uri_strict,
         help='unique identifier (URI) given to the file in the CADC '
@@ -781,13 +1257,26 @@ def build_cadcput_parser():
         'cadc:TEST/ dir\n'
         '- Connect as user to put files from multiple sources (prompt for\n'
         '  password if user not in $HOME/.netrc):\n'
-        '      cadcput -v -u auser cadc:TEST/ myfile.fits.gz dir1 dir2')
+        '      cadcput -v -u auser cadc:TEST/ myfile.fits.gz dir1 dir2\n'
+        '- Put the files from a directory, 8 files at a time:\n'
+        '      cadcput -n -j 8 cadc:TEST/ dir\n'
+        '- Put the files of a directory that were not put by a previous '
+        'run:\n'
+        '      cadcput -n -j 8 --manifest put.manifest cadc:TEST/ dir\n'
+        '- Make the uploads of large files resumable (an interrupted upload '
+        'continues\n  where it left off when the command is run again):\n'
+        '      CADC_PUT_JOURNAL=1 cadcput -n cadc:TEST/ large_file.fits')
     return parser
 
 
 def cadcput_cli():
     args = build_cadcput_parser().parse_args()
     client = _create_client(args)
+    with _timing_report(client, args):
+        _cadcput(client, args)
+
+
+def _cadcput(client, args):
 
     files = []
     for file in args.src:
@@ -803,17 +1292,30 @@ def cadcput_cli():
             'A root identifier (ending in "/") is required to put multiple '
             'files: {}'.format(args.identifier))
 
-    for file in files:
-        if len(files) > 1:
+    if len(files) == 1 and not args.manifest:
+        logger.info('PUT {} -> {}'.format(files[0], args.identifier))
+        execute_cmd(client.cadcput, {'id': args.identifier,
+                                     'src': files[0],
+                                     'file_type': args.type,
+                                     'file_encoding': args.encoding})
+        return
+    put_files = []
+    if len(files) == 1:
+        put_files.append((args.identifier, files[0]))
+    else:
+        for file in files:
             file_id = '{}/{}'.format(args.identifier.strip('/'),
                                      os.path.basename(file))
-        else:
-            file_id = args.identifier
+            put_files.append((file_id, file))
+    for file_id, file in put_files:
         logger.info('PUT {} -> {}'.format(file, file_id))
-        execute_cmd(client.cadcput, {'id': file_id,
-                                     'src': file,
-                                     'file_type': args.type,
-                                     'file_encoding': args.encoding})
+    with _open_manifest(args) as manifest:
+        errors = execute_cmd(client.bulk_put, {'files': put_files,
+                                               'file_type': args.type,
+                                               'file_encoding': args.encoding,
+                                               'max_workers': args.jobs,
+                                               'manifest': manifest})
+    _handle_bulk_errors(errors)
 
 
 def build_cadcget_parser():
@@ -827,8 +1329,15 @@ def build_cadcget_parser():
 
     parser.add_argument(
         '-o', '--output',
-        help='write to file or other directory instead of the current one.',
+        help='write to file or other directory instead of the current one. '
+             'Multiple identifiers require a directory. Use - to write the '
+             'file to the standard output.',
         required=False)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of files to get at the same time '
+                             '(default: 1)')
+    _add_timing_argument(parser)
+    _add_manifest_argument(parser)
     parser.add_argument(
         'identifier', type=argparse_validate_get_uri,
         help='unique identifier (URI) given to the file in the CADC, typically'
@@ -837,7 +1346,7 @@ def build_cadcget_parser():
              ' possible to attach cutout arguments to the identifier to'
              ' download specific sections of a FITS file as in:'
              ' CFHT/806045o.fits.fz?cutout=[1][10:120,20:30]'
-             'Storage Inventory')
+             'Storage Inventory', nargs='+')
     parser.add_argument(
         '--fhead', action='store_true',
         help='return the FITS header information (for all extensions')
@@ -848,17 +1357,60 @@ def build_cadcget_parser():
         '- Use certificate and a full specified id to get a cutout and save '
         'it to a file in the current directory (service provided file name):\n'
         '      cadcget --cert ~/.ssl/cadcproxy.pem '
-        '"CFHT/806045o.fits.fz?cutout=[1][10:120,20:30]&cutout=[2][10:120,20:30]"\n')
+        '"CFHT/806045o.fits.fz?cutout=[1][10:120,20:30]&cutout=[2][10:120,20:30]"\n'
+        '- Download 4 files at a time into the data directory:\n'
+        '      cadcget -j 4 -o data GEMINI/N20220825S0383.fits '
+        'GEMINI/N20220825S0384.fits ...\n'
+        '- Stream a file to another program:\n'
+        '      cadcget -o - GEMINI/N20220825S0383.fits | gzip > data.fits.gz\n'
+        '- Reuse the transfer negotiations of the last 5 minutes (the '
+        'CADC_TRANSFER_CACHE_TTL\n  environment variable is in seconds):\n'
+        '      CADC_TRANSFER_CACHE_TTL=300 cadcget -j 4 GEMINI/N20220825S0383.fits ...\n'
+        '- Download from the best performing sites first, remembering their '
+        'performance\n  between runs:\n'
+        '      CADC_ENDPOINT_RANKING=~/.config/cadc-endpoints.json cadcget '
+        'GEMINI/N20220825S0383.fits\n'
+        '- Retry sooner with random delays and move on to another site '
+        'after 3 failures:\n'
+        '      CADC_RETRY_START_DELAY=1 CADC_RETRY_JITTER=full '
+        'CADC_CIRCUIT_BREAKER=3 cadcget ...\n'
+        '- Get the files that were not received by a previous run:\n'
+        '      cadcget -j 4 --manifest get.manifest -o dir '
+        'GEMINI/N20220825S0383.fits ...\n'
+        '- Report where the time goes (negotiation, md5, transfer...):\n'
+        '      cadcget --timing json -j 4 GEMINI/N20220825S0383.fits ... '
+        '2> timing.json\n')
     return parser
 
 
 def cadcget_cli():
     args = build_cadcget_parser().parse_args()
     client = _create_client(args)
-    logger.info('GET id {} -> {}'.format(
-        args.identifier, args.output if args.output else 'stdout'))
-    execute_cmd(client.cadcget, {'id': args.identifier, 'dest': args.output,
-                                 'fhead': args.fhead})
+    with _timing_report(client, args):
+        _cadcget(client, args)
+
+
+def _cadcget(client, args):
+    if args.manifest and (args.output == '-' or (
+            args.output and not os.path.isdir(args.output))):
+        handle_error('--manifest requires a destination directory')
+    if len(args.identifier) == 1 and not args.manifest:
+        logger.info('GET id {} -> {}'.format(
+            args.identifier[0], args.output if args.output else 'stdout'))
+        dest = sys.stdout.buffer if args.output == '-' else args.output
+        execute_cmd(client.cadcget, {'id': args.identifier[0],
+                                     'dest': dest,
+                                     'fhead': args.fhead})
+        return
+    logger.info('GET ids {} -> {}'.format(
+        ' '.join(args.identifier), args.output if args.output else '.'))
+    with _open_manifest(args) as manifest:
+        errors = execute_cmd(client.bulk_get, {'ids': args.identifier,
+                                               'dest': args.output,
+                                               'fhead': args.fhead,
+                                               'max_workers': args.jobs,
+                                               'manifest': manifest})
+    _handle_bulk_errors(errors)
 
 
 def build_cadcinfo_parser():
@@ -875,6 +1427,10 @@ def build_cadcinfo_parser():
              ' of the form <scheme>:<archive>/<filename> where <scheme> is a '
              ' concept internal to the storage system and is optional with this command.',
              nargs='+')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of identifiers to look up at the same '
+                             'time (default: 1). Results are displayed in '
+                             'the order of the identifiers.')
     parser.epilog = (
         'Examples:\n'
         '- Anonymously getting information about a public file:\n'
@@ -888,23 +1444,26 @@ def build_cadcinfo_parser():
 def cadcinfo_cli():
     args = build_cadcinfo_parser().parse_args()
     client = _create_client(args)
-    for id in args.identifier:
-        logger.info('INFO for id {}'.format(id))
-        try:
-            file_info = execute_cmd(client.cadcinfo, {'id': id})
-            print('CADC Storage Inventory artifact {}:'.format(id))
-            print('\t {:>15}: {}'.format('id', file_info.id))
-            print('\t {:>15}: {}'.format('name', file_info.name))
-            print('\t {:>15}: {}'.format('size', file_info.size))
-            print('\t {:>15}: {}'.format('type', file_info.file_type))
-            print('\t {:>15}: {}'.format('encoding', file_info.encoding))
-            print('\t {:>15}: {}'.format('last modified',
-                                         date2ivoa(file_info.lastmod)))
-            print('\t {:>15}: {}'.format('md5sum', file_info.md5sum))
-        except exceptions.NotFoundException:
-            logger.error('Identifier {} not found in the CADC Storage '
-                         'Inventory'.format(id), exit_after=False)
+    logger.info('INFO for ids {}'.format(' '.join(args.identifier)))
+    failed = False
+    for id, file_info in client.cadcinfo_many(args.identifier,
+                                              max_workers=args.jobs):
+        if isinstance(file_info, Exception):
+            # report and carry on with the other ids
+            handle_error(file_info, exit_after=False)
+            failed = True
             continue
+        print('CADC Storage Inventory artifact {}:'.format(id))
+        print('\t {:>15}: {}'.format('id', file_info.id))
+        print('\t {:>15}: {}'.format('name', file_info.name))
+        print('\t {:>15}: {}'.format('size', file_info.size))
+        print('\t {:>15}: {}'.format('type', file_info.file_type))
+        print('\t {:>15}: {}'.format('encoding', file_info.encoding))
+        print('\t {:>15}: {}'.format('last modified',
+                                     date2ivoa(file_info.lastmod)))
+        print('\t {:>15}: {}'.format('md5sum', file_info.md5sum))
+    if failed:
+        sys.exit(-1)
     logger.info('DONE')
 
 
@@ -936,14 +1495,16 @@ def cadcremove_cli():
 
 
 def _set_logging_level(args):
+    # keep the standard output clean when the data is written to it
+    stream = sys.stderr if getattr(args, 'output', None) == '-' else sys.stdout
     if args.verbose:
         logger.setLevel(logging.INFO)
-        logging.basicConfig(level=logging.INFO, stream=sys.stdout,
+        logging.basicConfig(level=logging.INFO, stream=stream,
                             format='%(message)s')
     elif args.debug:
-        logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
+        logging.basicConfig(level=logging.DEBUG, stream=stream)
     else:
-        logging.basicConfig(level=logging.WARN, stream=sys.stdout)
+        logging.basicConfig(level=logging.WARN, stream=stream)
 
 
 def _create_client(args):
@@ -951,12 +1512,63 @@ def _create_client(args):
     try:
         _set_logging_level(args)
         subject = net.Subject.from_cmd_line_args(args)
+        # keep alive a connection for each concurrent job
+        pool_maxsize = None
+        jobs = getattr(args, 'jobs', None)
+        if jobs and jobs > net.ws.POOL_MAXSIZE:
+            pool_maxsize = jobs
         return StorageInventoryClient(subject, args.service, host=args.host,
-                                      insecure=args.insecure)
+                                      insecure=args.insecure,
+                                      pool_maxsize=pool_maxsize)
     except Exception as ex:
         handle_error(str(ex))
 
 
+def _add_manifest_argument(parser):
+    parser.add_argument(
+        '--manifest', metavar='FILE',
+        help='record the state of the transfer of each file in FILE. Files '
+             'recorded as transferred by a previous run are skipped.')
+
+
+def _open_manifest(args):
+    if not args.manifest:
+        return contextlib.nullcontext()
+    try:
+        return TransferManifest(args.manifest)
+    except Exception as e:
+        handle_error(e)
+
+
+def _add_timing_argument(parser):
+    parser.add_argument(
+        '--timing', choices=['json'],
+        help='write a report of the time spent in each phase of the '
+             'transfers (with percentiles for multiple files) to stderr')
+
+
+@contextlib.contextmanager
+def _timing_report(client, args):
+    # writes the timing report when the command completes or fails
+    if not getattr(args, 'timing', None):
+        yield
+        return
+    client.timing = util.TimingReport()
+    try:
+        yield
+    finally:
+        sys.stderr.write(client.timing.to_json(indent=2) + '\n')
+
+
+def _handle_bulk_errors(errors):
+    # reports the errors of a bulk command and exits if there were any
+    if not errors:
+        return
+    for id, error in errors.items():
+        handle_error('{}: {}'.format(id, error), exit_after=False)
+    handle_error('{} file(s) failed'.format(len(errors)))
+
+
 def execute_cmd(cmd, cmd_args):
     try:
         return cmd(**cmd_args)
@@ -0,0 +1,540 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#
+# ***********************************************************************
+
+"""
+Local stand-in for the Storage Inventory services: the registry, the global
+locator (raven) and two storage sites (minoc1 and minoc2). The stand-in
+keeps the files in memory and speaks the subset of the protocols that the
+clients use: capabilities, transfer negotiation, files HEAD/GET (with Range,
+cutouts and headers), PUT (with transactions), POST and DELETE.
+
+The `si_server` fixture starts a server and the `si_client` fixture returns a
+StorageInventoryClient that is configured to use it.
+"""
+
+import hashlib
+import logging
+import socket
+import struct
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+from xml.etree import ElementTree
+
+import pytest
+
+from cadcutils import net
+from cadcutils.net import ws
+from cadcdata import storageinv
+
+logger = logging.getLogger(__name__)
+
+SITES = ['minoc1', 'minoc2']
+CAPABILITIES = {
+    'raven': [storageinv.FILES_STANDARD_ID, storageinv.LOCATE_STANDARD_ID],
+    'data': [],
+    'minoc1': [storageinv.FILES_STANDARD_ID],
+    'minoc2': [storageinv.FILES_STANDARD_ID]}
+RESOURCE_IDS = {
+    'raven': storageinv.DEFAULT_RESOURCE_ID,
+    'data': storageinv.DATA_RESOURCE_ID,
+    'minoc1': 'ivo://cadc.nrc.ca/minoc1',
+    'minoc2': 'ivo://cadc.nrc.ca/minoc2'}
+FITS_BLOCK = 2880  # size of the headers returned with META=true
+MIN_SEGMENT = 1024 * 1024
+MAX_SEGMENT = 8 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Storage Inventory stand-in server. Files are added with `add_file` or
+    uploaded with the clients. `interrupted_downloads` is the number of
+    (non range) downloads to cut in the middle to exercise resumed downloads.
+    `failed_segments` is the number of transaction segments to append only
+    partially before resetting the connection. With `reorder_segments` the
+    first segment of a transaction with Content-Range is held until another
+    segment arrives. With `ignore_content_range` segments are appended in
+    the order they arrive. `segments` lists the offsets of the segments in
+    the order they were received.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _StandInHandler)
+        self.files = {}
+        self.txns = {}
+        self.requests = {}
+        self.interrupted_downloads = 0
+        self.failed_segments = 0
+        self.reorder_segments = False
+        self.ignore_content_range = False
+        self.segments = []
+        self._later_segment = threading.Event()
+        self.lock = threading.Lock()
+        self._last_txn = 0
+
+    @property
+    def host(self):
+        return '{}:{}'.format(*self.server_address)
+
+    @property
+    def url(self):
+        return 'http://{}'.format(self.host)
+
+    def add_file(self, uri, content, content_type='application/fits'):
+        """
+        Adds a file to the storage
+        :param uri: URI of the file
+        :param content: bytes of the file
+        :param content_type: MIME type of the file
+        """
+        with self.lock:
+            self.files[uri] = _StoredFile(bytes(content), content_type)
+
+    def get_content(self, uri):
+        with self.lock:
+            return self.files[uri].content
+
+    def new_txn(self, uri):
+        with self.lock:
+            self._last_txn += 1
+            txn_id = 'txn{}'.format(self._last_txn)
+            self.txns[txn_id] = _PutTxn(uri)
+            return txn_id
+
+    def count(self, method):
+        with self.lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+
+class _StoredFile(object):
+
+    def __init__(self, content, content_type):
+        self.content = content
+        self.content_type = content_type
+        self.md5 = hashlib.md5(content).hexdigest()
+        self.lastmod = formatdate(time.time(), usegmt=True)
+
+
+class _PutTxn(object):
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.content = bytearray()
+        self.lengths = []  # length of the content before each segment
+
+    def add(self, segment, offset=None):
+        self.lengths.append(len(self.content))
+        if offset is None:
+            offset = len(self.content)
+        end = offset + len(segment)
+        if end > len(self.content):
+            self.content.extend(bytes(end - len(self.content)))
+        self.content[offset:end] = segment
+
+    def revert(self):
+        if self.lengths:
+            del self.content[self.lengths.pop():]
+
+    def md5(self):
+        if not self.content:
+            return None
+        return hashlib.md5(self.content).hexdigest()
+
+
+def _capabilities(base_url, service):
+    capabilities = ['<?xml version="1.0" encoding="UTF-8"?>',
+                    '<vosi:capabilities '
+                    'xmlns:vosi="http://www.ivoa.net/xml/VOSICapabilities/v1.0" '
+                    'xmlns:vs="http://www.ivoa.net/xml/VODataService/v1.1" '
+                    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">']
+    features = [('ivo://ivoa.net/std/VOSI#capabilities', 'capabilities'),
+                ('ivo://ivoa.net/std/VOSI#availability', 'availability')]
+    for standard_id in CAPABILITIES[service]:
+        features.append((standard_id, standard_id.split('#')[1].split('-')[0]))
+    for standard_id, path in features:
+        url = '{}/{}/{}'.format(base_url, service, path)
+        capabilities.append(
+            '<capability standardID="{}">'
+            '<interface xsi:type="vs:ParamHTTP" role="std">'
+            '<accessURL use="base">{}</accessURL>'
+            '</interface>'
+            '<interface xsi:type="vs:ParamHTTP" role="std">'
+            '<accessURL use="base">{}</accessURL>'
+            '<securityMethod standardID="{}"/>'
+            '</interface>'
+            '</capability>'.format(standard_id, url, url,
+                                   net.auth.SECURITY_METHODS_IDS['token']))
+    capabilities.append('</vosi:capabilities>')
+    return '\n'.join(capabilities)
+
+
+def _md5_header(md5_checksum):
+    headers = {}
+    if md5_checksum:
+        net.add_md5_header(headers, md5_checksum)
+    return headers
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_HEAD(self):
+        self._dispatch('HEAD')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _dispatch(self, method):
+        self.server.count(method)
+        body = self._read_body()
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/', 2)
+        service = parts[0]
+        resource = parts[1] if len(parts) > 1 else None
+        uri = unquote(parts[2]) if len(parts) > 2 else None
+        query = parse_qs(url.query)
+        if service == 'reg' and resource == 'resource-caps':
+            self._send(200, '\n'.join(
+                ['{} = {}/{}/capabilities'.format(resource_id, self.server.url,
+                                                  service)
+                 for service, resource_id in RESOURCE_IDS.items()]))
+        elif service in CAPABILITIES and resource == 'capabilities':
+            self._send(200, _capabilities(self.server.url, service),
+                       {'Content-Type': 'text/xml'})
+        elif service in CAPABILITIES and resource == 'availability':
+            self._send(200, '<availability/>', {'Content-Type': 'text/xml'})
+        elif service == 'data' and resource == 'uri-scheme-map':
+            self._send(200, 'default: cadc\n')
+        elif service == 'raven' and resource == 'locate' and method == 'POST':
+            self._locate(body)
+        elif resource == 'files' and uri and method in ['GET', 'HEAD']:
+            self._get_file(method, uri, query)
+        elif resource == 'files' and uri and service in SITES:
+            getattr(self, '_{}_file'.format(method.lower()))(uri, body)
+        else:
+            self._send(404, 'Not found: {}'.format(self.path))
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    return body
+                body.extend(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length', 0))
+        body = bytearray()
+        while len(body) < length:
+            chunk = self.rfile.read(min(READ_SIZE, length - len(body)))
+            if not chunk:
+                break
+            body.extend(chunk)
+        return body
+
+    def _send(self, status, body=b'', headers=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        headers = dict(headers or {})
+        headers.setdefault('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _locate(self, body):
+        vosns = '{{{}}}'.format(net.Transfer.VOSNS)
+        transfer = ElementTree.fromstring(bytes(body))
+        uri = transfer.find(vosns + 'target').text
+        direction = transfer.find(vosns + 'direction').text
+        if direction == net.Transfer.DIRECTION_PULL_FROM:
+            with self.server.lock:
+                if uri not in self.server.files:
+                    self._send(404, 'File not found: {}'.format(uri))
+                    return
+            protocol = 'httpsget'
+        else:
+            protocol = 'httpsput'
+        endpoints = ''.join(
+            '<vos:endpoint>{}/{}/files/{}</vos:endpoint>'.format(
+                self.server.url, site, uri) for site in SITES)
+        self._send(200, (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<vos:transfer xmlns:vos="{}" version="2.1">'
+            '<vos:target>{}</vos:target>'
+            '<vos:direction>{}</vos:direction>'
+            '<vos:protocol uri="ivo://ivoa.net/vospace/core#{}">{}'
+            '</vos:protocol>'
+            '</vos:transfer>').format(net.Transfer.VOSNS, uri, direction,
+                                      protocol, endpoints),
+            {'Content-Type': 'text/xml'})
+
+    def _get_file(self, method, uri, query):
+        txn_id = self.headers.get(ws.PUT_TXN_ID, None)
+        if txn_id:
+            with self.server.lock:
+                txn = self.server.txns.get(txn_id, None)
+                if txn is None:
+                    self._send(404, 'Transaction not found: {}'.format(txn_id))
+                    return
+                headers = _md5_header(txn.md5())
+                headers[ws.PUT_TXN_ID] = txn_id
+                headers['Content-Length'] = str(len(txn.content))
+            self._send(200, headers=headers)
+            return
+        with self.server.lock:
+            stored = self.server.files.get(uri, None)
+        if stored is None:
+            self._send(404, 'File not found: {}'.format(uri))
+            return
+        content = stored.content
+        name = uri.split('/')[-1]
+        headers = {'Content-Type': stored.content_type,
+                   'Last-Modified': stored.lastmod,
+                   'Accept-Ranges': 'bytes'}
+        if 'META' in query:
+            # FITS headers
+            headers['Content-Disposition'] = \
+                'inline; filename={}.txt'.format(name)
+            self._send(200, content[:FITS_BLOCK], headers)
+            return
+        if 'SUB' in query:
+            # cutouts are the first quarter of the file for each SUB
+            size = max(1, len(content) // 4)
+            headers['Content-Disposition'] = \
+                'inline; filename={}__cutout'.format(name)
+            self._send(200, content[:size] * len(query['SUB']), headers)
+            return
+        headers.update(_md5_header(stored.md5))
+        headers['Content-Disposition'] = 'inline; filename={}'.format(name)
+        byte_range = self.headers.get('Range', None)
+        if byte_range and method == 'GET':
+            first, last = byte_range.split('=')[1].split('-')
+            first = int(first)
+            last = int(last) if last else len(content) - 1
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                first, last, len(content))
+            self._send(206, content[first:last + 1], headers)
+            return
+        if method == 'HEAD':
+            headers['Content-Length'] = str(len(content))
+            self._send(200, headers=headers)
+            return
+        with self.server.lock:
+            interrupt = self.server.interrupted_downloads > 0
+            if interrupt:
+                self.server.interrupted_downloads -= 1
+        if interrupt:
+            # send half of the file and drop the connection
+            self.send_response(200)
+            headers['Content-Length'] = str(len(content))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(content[:len(content) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self._send(200, content, headers)
+
+    def _put_file(self, uri, body):
+        op = self.headers.get(ws.PUT_TXN_OP, None)
+        txn_id = self.headers.get(ws.PUT_TXN_ID, None)
+        content_type = self.headers.get('Content-Type', None) or \
+            'application/octet-stream'
+        if txn_id is None and op != ws.PUT_TXN_START:
+            # upload in one go
+            md5_checksum = hashlib.md5(body).hexdigest()
+            expected_md5 = net.extract_md5(self.headers)
+            if expected_md5 and expected_md5 != md5_checksum:
+                self._send(412, 'md5 mismatch: {} != {}'.format(
+                    expected_md5, md5_checksum))
+                return
+            self.server.add_file(uri, body, content_type)
+            self._send(201, headers=_md5_header(md5_checksum))
+            return
+        if txn_id is None:
+            txn_id = self.server.new_txn(uri)
+        with self.server.lock:
+            txn = self.server.txns.get(txn_id, None)
+        if txn is None:
+            self._send(404, 'Transaction not found: {}'.format(txn_id))
+            return
+        headers = {ws.PUT_TXN_ID: txn_id,
+                   ws.PUT_TXN_MIN_SEGMENT: str(MIN_SEGMENT),
+                   ws.PUT_TXN_MAX_SEGMENT: str(MAX_SEGMENT)}
+        if op == ws.PUT_TXN_COMMIT:
+            with self.server.lock:
+                del self.server.txns[txn_id]
+            self.server.add_file(uri, txn.content, content_type)
+            headers.update(_md5_header(txn.md5()))
+            self._send(201, headers=headers)
+            return
+        offset = None
+        content_range = self.headers.get('Content-Range', None)
+        if content_range:
+            offset = int(content_range.split()[1].split('-')[0])
+            if offset == 0 and self.server.reorder_segments:
+                self.server._later_segment.wait(5)
+            elif offset:
+                self.server._later_segment.set()
+        with self.server.lock:
+            fail = body and self.server.failed_segments > 0
+            if fail:
+                self.server.failed_segments -= 1
+                body = body[:len(body) // 2]
+            if body:
+                txn.add(body, None if self.server.ignore_content_range
+                        else offset)
+                self.server.segments.append(offset or 0)
+            headers.update(_md5_header(txn.md5()))
+        if fail:
+            # reset the connection
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                       struct.pack('ii', 1, 0))
+            self.close_connection = True
+            self.connection.close()
+            return
+        self._send(202, headers=headers)
+
+    def _post_file(self, uri, body):
+        op = self.headers.get(ws.PUT_TXN_OP, None)
+        txn_id = self.headers.get(ws.PUT_TXN_ID, None)
+        if txn_id is None:
+            # metadata update
+            with self.server.lock:
+                stored = self.server.files.get(uri, None)
+                if stored is not None and self.headers.get('Content-Type'):
+                    stored.content_type = self.headers.get('Content-Type')
+            self._send(200 if stored else 404)
+            return
+        with self.server.lock:
+            txn = self.server.txns.get(txn_id, None)
+            if txn is None:
+                self._send(404, 'Transaction not found: {}'.format(txn_id))
+                return
+            if op == ws.PUT_TXN_ABORT:
+                del self.server.txns[txn_id]
+                headers = {}
+            else:
+                txn.revert()
+                headers = _md5_header(txn.md5())
+                headers[ws.PUT_TXN_ID] = txn_id
+        self._send(204 if op == ws.PUT_TXN_ABORT else 202, headers=headers)
+
+    def _delete_file(self, uri, body):
+        with self.server.lock:
+            found = self.server.files.pop(uri, None) is not None
+        self._send(204 if found else 404)
+
+
+@pytest.fixture
+def si_server():
+    """
+    Storage Inventory stand-in server running in a background thread
+    """
+    server = StandInServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def si_client(si_server, tmp_path, monkeypatch):
+    """
+    Authenticated StorageInventoryClient that uses the stand-in server
+    """
+    monkeypatch.setenv('CADC_VERSION_CHECK', '0')
+    monkeypatch.setattr(ws, 'DEFAULT_REGISTRY',
+                        '{}/reg/resource-caps'.format(si_server.url))
+    monkeypatch.setattr(ws, 'CACHE_LOCATION', str(tmp_path / 'cache'))
+    return storageinv.StorageInventoryClient(net.Subject(token='standin'),
+                                             host=si_server.host)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero pour
+#  more details.                        plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est pas le cas,
+#  <http://www.gnu.org/licenses/>.      consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+# ***********************************************************************
+
+
+"""
+Transfer benchmarks against the local Storage Inventory stand-in. They
+require pytest-benchmark (the ``benchmark`` extra) and are skipped
+otherwise. Run them with:
+
+    tox -e benchmark
+
+or, with the extra installed:
+
+    pytest cadcdata/tests/test_benchmarks.py --benchmark-only
+"""
+
+import os
+
+import pytest
+
+from cadcutils.net import ws
+
+pytest.importorskip('pytest_benchmark')
+
+ROUNDS = 3
+SMALL_FILES = 100
+SMALL_SIZE = 10 * 1024
+LARGE_SIZE = 32 * 1024 * 1024
+
+
+@pytest.fixture
+def small_files(si_server):
+    ids = ['cadc:BENCH/small{}.fits'.format(i) for i in range(SMALL_FILES)]
+    for id in ids:
+        si_server.add_file(id, os.urandom(SMALL_SIZE))
+    return ids
+
+
+@pytest.fixture
+def large_file(tmp_path):
+    src = tmp_path / 'large.fits'
+    src.write_bytes(os.urandom(LARGE_SIZE))
+    return str(src)
+
+
+@pytest.mark.parametrize('max_workers', [1, 10])
+def test_small_files_get(benchmark, si_client, small_files, tmp_path,
+                         max_workers):
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    errors = benchmark.pedantic(
+        si_client.bulk_get, args=(small_files,),
+        kwargs={'dest': str(dest), 'max_workers': max_workers},
+        rounds=ROUNDS, iterations=1)
+    assert not errors
+    assert SMALL_FILES == len(os.listdir(str(dest)))
+
+
+@pytest.mark.parametrize('max_workers', [1, 10])
+def test_small_files_info(benchmark, si_client, small_files, max_workers):
+    def info():
+        return list(si_client.cadcinfo_many(small_files,
+                                            max_workers=max_workers))
+    assert SMALL_FILES == len(benchmark.pedantic(info, rounds=ROUNDS,
+                                                 iterations=1))
+
+
+@pytest.mark.parametrize('segment_workers', [1, 4])
+def test_segmented_upload(benchmark, si_server, si_client, large_file,
+                          monkeypatch, segment_workers):
+    monkeypatch.setattr(ws, 'FILE_SEGMENT_THRESHOLD', LARGE_SIZE // 4)
+    monkeypatch.setattr(ws, 'MAX_SEGMENT_WORKERS', segment_workers)
+    id = 'cadc:BENCH/large.fits'
+
+    def put():
+        si_server.files.pop(id, None)
+        si_client.cadcput(id, large_file)
+    benchmark.pedantic(put, rounds=ROUNDS, iterations=1)
+    assert LARGE_SIZE == len(si_server.get_content(id))
+
+
+@pytest.mark.parametrize('interrupted', [False, True])
+def test_resumed_download(benchmark, si_server, si_client, tmp_path,
+                          interrupted):
+    id = 'cadc:BENCH/download.fits'
+    si_server.add_file(id, os.urandom(LARGE_SIZE))
+    dest = tmp_path / 'download.fits'
+
+    def get():
+        if interrupted:
+            si_server.interrupted_downloads = 1
+        si_client.cadcget(id, dest=str(dest))
+    benchmark.pedantic(get, rounds=ROUNDS, iterations=1)
+    assert LARGE_SIZE == dest.stat().st_size
+
+
+def test_cutout(benchmark, si_server, si_client, tmp_path):
+    id = 'cadc:BENCH/cutout.fits'
+    si_server.add_file(id, os.urandom(LARGE_SIZE))
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    benchmark.pedantic(si_client.cadcget, args=(id + '?cutout=[1]',),
+                       kwargs={'dest': str(dest)}, rounds=ROUNDS,
+                       iterations=1)
+    assert LARGE_SIZE // 4 == \
+        (dest / 'cutout.fits__cutout').stat().st_size
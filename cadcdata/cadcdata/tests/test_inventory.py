@@ -65,23 +65,28 @@
 #
 # ***********************************************************************
 #
+import asyncio
 import os
 import sys
 import shutil
+import threading
 
 from io import StringIO
-from unittest.mock import Mock, patch, call
+from unittest.mock import AsyncMock, Mock, patch, call
 import pytest
 import hashlib
 import base64
 import datetime
+import requests
 from requests.structures import CaseInsensitiveDict
 import argparse
 import tempfile
 
+from cadcutils import net
 from cadcutils.net import auth
 from cadcutils import exceptions
 from cadcutils.util import str2ivoa
+from cadcutils.util.tests.import_helpers import assert_lazy_imports
 from cadcdata import StorageInventoryClient, cadcget_cli, cadcput_cli, \
     cadcinfo_cli, cadcremove_cli
 from cadcdata import storageinv
@@ -107,21 +112,23 @@ def test_get():
     client = StorageInventoryClient(auth.Subject())
     client._get_transfer_urls = Mock(
         return_value=['https://url1', 'https://url2'])
-    download_file_mock = Mock()
+    download_file_mock = Mock(return_value=('file', 'abc', 10))
     client._cadc_client.download_file = download_file_mock
     client.cadcget('cadc:COLLECTION/file', dest='/tmp')
-    download_file_mock.assert_called_once_with(url='https://url1', dest='/tmp', params={})
+    download_file_mock.assert_called_once_with(
+        url='https://url1', dest='/tmp', params={}, process_bytes=None)
 
     # raise error on the first url
     client._get_transfer_urls.reset_mock()
     download_file_mock.reset_mock()
-    download_file_mock.side_effect = [exceptions.TransferException(), None]
+    download_file_mock.side_effect = [exceptions.TransferException(),
+                                      ('file', 'abc', 10)]
     client.cadcget('cadc:COLLECTION/file', dest='/tmp')
     assert 2 == download_file_mock.call_count
-    assert call(url='https://url1', dest='/tmp', params={}) in \
-        download_file_mock.mock_calls
-    assert call(url='https://url2', dest='/tmp', params={}) in \
-        download_file_mock.mock_calls
+    assert call(url='https://url1', dest='/tmp', params={},
+                process_bytes=None) in download_file_mock.mock_calls
+    assert call(url='https://url2', dest='/tmp', params={},
+                process_bytes=None) in download_file_mock.mock_calls
 
     # fhead call
     client._get_transfer_urls.reset_mock()
@@ -129,7 +136,7 @@ def test_get():
     download_file_mock.side_effect = None
     client.cadcget('cadc:COLLECTION/file', dest='/tmp', fhead=True)
     download_file_mock.assert_called_once_with(
-        url='https://url1', dest='/tmp', params={'META': 'true'})
+        url='https://url1', dest='/tmp', params={'META': 'true'}, process_bytes=None)
 
     # cutout call
     client._get_transfer_urls.reset_mock()
@@ -138,7 +145,7 @@ def test_get():
     client.cadcget('COLLECTION/file?cutOUT=[1][1:1]&Cutout=[2][2:2]', dest='/tmp')
     download_file_mock.assert_called_once_with(
         url='https://url1', dest='/tmp',
-        params={'SUB': ['[1][1:1]', '[2][2:2]']})
+        params={'SUB': ['[1][1:1]', '[2][2:2]']}, process_bytes=None)
 
     # no urls after transfer negotiation
     client._get_transfer_urls.reset_mock()
@@ -168,7 +175,32 @@ def test_get():
                        dest='/tmp', fhead=True)
 
 
-@pytest.mark.skipif(cadcdata.storageinv.MAGIC_WARN is not None,
+def test_iter_bytes():
+    client = StorageInventoryClient(auth.Subject())
+    client._get_transfer_urls = Mock(
+        return_value=['https://url1', 'https://url2'])
+    chunks = iter([b'abc'])
+    client._cadc_client.iter_file = Mock(
+        side_effect=[exceptions.TransferException(), chunks])
+    assert chunks == client.iter_bytes('cadc:COLLECTION/file', chunk_size=3,
+                                       byte_range=(2, None))
+    assert [call('https://url1', chunk_size=3, byte_range=(2, None)),
+            call('https://url2', chunk_size=3, byte_range=(2, None))] == \
+        client._cadc_client.iter_file.mock_calls
+
+    # file not found
+    client._cadc_client.iter_file = Mock(
+        side_effect=exceptions.NotFoundException())
+    with pytest.raises(exceptions.NotFoundException):
+        client.iter_bytes('cadc:COLLECTION/file')
+
+    # no urls after transfer negotiation
+    client._get_transfer_urls.return_value = []
+    with pytest.raises(exceptions.HttpException):
+        client.iter_bytes('cadc:COLLECTION/file')
+
+
+@pytest.mark.skipif(cadcdata.storageinv._load_magic() is None,
                     reason='libmagic not available')
 @patch('cadcdata.storageinv.net.BaseDataClient')
 @patch('cadcdata.storageinv.net.extract_md5')
@@ -184,7 +216,7 @@ def test_put(md5file_mock, extract_md5_mock, basews_mock):
     # write the file
     with open(file_name, 'w') as f:
         f.write(file_content)
-    upload_mock = Mock()
+    upload_mock = Mock(return_value=('putfile.txt', hash_md5, 13))
     basews_mock.return_value.upload_file = upload_mock
     with pytest.raises(exceptions.UnauthorizedException):
         client.cadcput('cadc:TEST/putfile', file_name)
@@ -326,6 +358,68 @@ def test_put(md5file_mock, extract_md5_mock, basews_mock):
     assert upload_mock.call_count == 3
 
 
+def test_bulk():
+    client = StorageInventoryClient(auth.Subject())
+    client._cadc_client = Mock()
+    client.cadcput = Mock(side_effect=[None, exceptions.TransferException('err'),
+                                       None])
+    files = [('cadc:TEST/file{}'.format(i), '/tmp/file{}'.format(i))
+             for i in range(3)]
+    errors = client.bulk_put(files, file_type='text/plain', max_workers=2)
+    assert 3 == client.cadcput.call_count
+    for id, src in files:
+        assert call(id=id, src=src, file_type='text/plain',
+                    file_encoding=None) in client.cadcput.mock_calls
+    assert 1 == len(errors)
+    assert isinstance(list(errors.values())[0], exceptions.TransferException)
+    # session created before the workers start
+    assert client._cadc_client._get_session.called
+
+    client.cadcget = Mock()
+    ids = ['cadc:TEST/file1', 'cadc:TEST/file2']
+    assert not client.bulk_get(ids, dest='/tmp', max_workers=2)
+    transfer_cache = client.cadcget.call_args[1]['transfer_cache']
+    assert isinstance(transfer_cache, net.TransferCache)
+    assert [call(id='cadc:TEST/file1', dest='/tmp', fhead=False,
+                 transfer_cache=transfer_cache),
+            call(id='cadc:TEST/file2', dest='/tmp', fhead=False,
+                 transfer_cache=transfer_cache)] == \
+        sorted(client.cadcget.mock_calls, key=lambda c: c[2]['id'])
+
+    client.cadcget.side_effect = [exceptions.NotFoundException('file1'),
+                                  exceptions.NotFoundException('file2')]
+    errors = client.bulk_get(ids, max_workers=1)
+    assert ids == list(errors.keys())
+
+    with pytest.raises(ValueError):
+        client.bulk_get(ids, dest='/tmp/nonexistent/dir')
+
+    # transfers negotiated ahead of the downloads, which wait for them
+    negotiated = []
+    downloaded = []
+    client.cadcget = Mock(side_effect=lambda id, **kwargs: downloaded.append(
+        (id, list(negotiated))))
+    ids = ['cadc:TEST/file1', 'TEST/file2', 'cadc:TEST/file3?cutout=[1]']
+    with patch('cadcdata.storageinv.net.Transfer') as transfer_mock:
+        transfer_mock.return_value.transfer.side_effect = \
+            lambda url, uri, *args, **kwargs: negotiated.append(uri)
+        assert not client.bulk_get(ids, max_workers=2)
+        assert [call(client.transfer, 'cadc:TEST/file1', 'pullFromVoSpace',
+                     with_uws_job=False),
+                call(client.transfer, 'cadc:TEST/file3', 'pullFromVoSpace',
+                     with_uws_job=False)] == \
+            sorted(transfer_mock.return_value.transfer.mock_calls)
+        transfer_cache = transfer_mock.call_args[1]['cache']
+        assert isinstance(transfer_cache, net.TransferCache)
+    assert 3 == client.cadcget.call_count
+    for id, negotiated_before in downloaded:
+        if id != 'TEST/file2':
+            assert id.split('?')[0] in negotiated_before
+    assert transfer_cache == client.cadcget.call_args[1]['transfer_cache']
+    # the cache of the client is not changed
+    assert client.transfer_cache is None
+
+
 @patch('cadcdata.storageinv.net.BaseDataClient')
 def test_remove(basews_mock):
     client = StorageInventoryClient(auth.Subject())
@@ -369,6 +463,110 @@ def test_remove(basews_mock):
         client.cadcremove('cadc:TEST/removefile')
 
 
+@patch('cadcdata.storageinv.net.BaseDataClient')
+def test_transfer_cache(basews_mock):
+    client = StorageInventoryClient(auth.Subject())
+    assert client.transfer_cache is None  # not enabled
+    client.transfer_cache = net.TransferCache(ttl=60)
+    client._cadc_client.subject.anon = False
+    with patch('cadcdata.storageinv.net.Transfer') as transfer_mock:
+        transfer_mock.return_value.transfer.return_value = \
+            ['https://url1', 'https://url2']
+        client._get_transfer_urls('cadc:TEST/file')
+        transfer_mock.assert_called_once_with(
+            client._cadc_client._get_session.return_value,
+            cache=client.transfer_cache)
+
+    id = 'cadc:TEST/file'
+    client.transfer_cache.put((id, 'get'), ['https://url1', 'https://url2'])
+    client.transfer_cache.put((id, 'put'), ['https://url3'])
+    client._get_transfer_urls = Mock(
+        return_value=['https://url1', 'https://url2'])
+    # failed endpoints are not reused
+    client._cadc_client.download_file.side_effect = [
+        exceptions.TransferException(), ('file', 'abc', 10)]
+    client.cadcget(id, dest='/tmp')
+    assert client.transfer_cache.get((id, 'get')) is None
+    assert ['https://url3'] == client.transfer_cache.get((id, 'put'))
+    # removed files are negotiated again
+    client._get_transfer_urls = Mock(return_value=['https://url3'])
+    client.cadcinfo = Mock()
+    client.cadcremove(id)
+    assert client.transfer_cache.get((id, 'put')) is None
+
+
+@patch('cadcdata.storageinv.net.BaseDataClient')
+def test_endpoint_ranking(basews_mock):
+    client = StorageInventoryClient(auth.Subject())
+    assert client.endpoint_ranker is None  # not enabled
+    client.endpoint_ranker = net.EndpointRanker()
+    id = 'cadc:TEST/file'
+    with patch('cadcdata.storageinv.net.Transfer') as transfer_mock:
+        transfer_mock.return_value.transfer.return_value = \
+            ['https://site1/file', 'https://site2/file']
+        # failed site tried last
+        client._cadc_client.download_file.side_effect = \
+            [exceptions.TransferException(), ('file', 'abc', 10)]
+        client.cadcget(id, dest='/tmp')
+        assert [call(url='https://site1/file', dest='/tmp', params={},
+                     process_bytes=None),
+                call(url='https://site2/file', dest='/tmp', params={},
+                     process_bytes=None)] == \
+            client._cadc_client.download_file.mock_calls
+        assert ['https://site2/file', 'https://site1/file'] == \
+            client._get_transfer_urls(id)
+
+        # request and local errors are not failures of the endpoint
+        client.endpoint_ranker = net.EndpointRanker()
+        client._cadc_client.download_file.side_effect = \
+            exceptions.NotFoundException('file')
+        with pytest.raises(exceptions.NotFoundException):
+            client.cadcget(id, dest='/tmp')
+        client._cadc_client.download_file.side_effect = \
+            OSError('No space left on device')
+        with pytest.raises(OSError):
+            client.cadcget(id, dest='/tmp')
+        assert ['https://site1/file', 'https://site2/file'] == \
+            client._get_transfer_urls(id)
+        # server errors are
+        server_error = requests.HTTPError(
+            response=Mock(status_code=502, text='Bad Gateway'))
+        client._cadc_client.download_file.side_effect = \
+            [exceptions.UnexpectedException(orig_exception=server_error),
+             ('file', 'abc', 10)]
+        client.cadcget(id, dest='/tmp')
+        assert ['https://site2/file', 'https://site1/file'] == \
+            client._get_transfer_urls(id)
+
+        # uploads are ranked as well
+        client.endpoint_ranker = Mock()
+        client.endpoint_ranker.rank.return_value = ['https://site2/file']
+        assert ['https://site2/file'] == \
+            client._get_transfer_urls(id, is_get=False)
+        client.endpoint_ranker.rank.assert_called_once_with(
+            ['https://site1/file', 'https://site2/file'])
+
+
+@patch('cadcdata.storageinv.net.BaseDataClient')
+def test_circuit_breaker(basews_mock):
+    client = StorageInventoryClient(auth.Subject())
+    assert client.circuit_breaker is None  # not enabled
+    client.circuit_breaker = net.CircuitBreaker(failure_threshold=1)
+    id = 'cadc:TEST/file'
+    with patch('cadcdata.storageinv.net.Transfer') as transfer_mock:
+        transfer_mock.return_value.transfer.return_value = \
+            ['https://site1/file', 'https://site2/file']
+        # fail over to the next site
+        client._cadc_client.download_file.side_effect = \
+            [exceptions.CircuitOpenException(), ('file', 'abc', 10)]
+        client.cadcget(id, dest='/tmp')
+        assert 2 == client._cadc_client.download_file.call_count
+        # sites that fail at the moment are tried last
+        client.circuit_breaker.record_failure('site1')
+        assert ['https://site2/file', 'https://site1/file'] == \
+            client._get_transfer_urls(id)
+
+
 @patch('cadcdata.storageinv.net.BaseDataClient')
 def test_info(basews_mock):
     client = StorageInventoryClient(auth.Subject())
@@ -409,6 +607,70 @@ def test_info(basews_mock):
         client.cadcinfo(id)
 
 
+def test_cadcinfo_many():
+    client = StorageInventoryClient(auth.Subject())
+    uris = {'TEST/file1': ['cadc:TEST/file1'],
+            'TEST/file2': ['mast:TEST/file2', 'cadc:TEST/file2'],
+            'TEST/file3': ['mast:TEST/file3', 'cadc:TEST/file3'],
+            'cadc:TEST/file4': ['cadc:TEST/file4']}
+    client._get_uris = Mock(side_effect=lambda id: uris[id])
+
+    def cadcinfo_mock(id):
+        if id in ['cadc:TEST/file1', 'cadc:TEST/file2']:
+            return cadcdata.FileInfo(id)
+        if id == 'cadc:TEST/file4':
+            raise exceptions.UnauthorizedException()
+        raise exceptions.NotFoundException(id)
+    client.cadcinfo = Mock(side_effect=cadcinfo_mock)
+    results = list(client.cadcinfo_many(uris.keys(), max_workers=3))
+    # results in the order of the ids
+    assert list(uris.keys()) == [id for id, _ in results]
+    results = dict(results)
+    assert 'cadc:TEST/file1' == results['TEST/file1'].id
+    # second guess is found
+    assert 'cadc:TEST/file2' == results['TEST/file2'].id
+    assert isinstance(results['TEST/file3'], exceptions.NotFoundException)
+    assert isinstance(results['cadc:TEST/file4'],
+                      exceptions.UnauthorizedException)
+    assert 6 == client.cadcinfo.call_count
+
+    assert list(uris.keys()) == \
+        [id for id, _ in client.cadcinfo_many(uris.keys(), max_workers=1)]
+
+    # a slow first id does not change the order
+    first_done = threading.Event()
+
+    def slow_cadcinfo(id):
+        if id == 'cadc:TEST/file1':
+            assert first_done.wait(5)
+        elif id == 'cadc:TEST/file4':
+            first_done.set()
+        return cadcinfo_mock(id)
+    client.cadcinfo = Mock(side_effect=slow_cadcinfo)
+    assert list(uris.keys()) == \
+        [id for id, _ in client.cadcinfo_many(uris.keys(), max_workers=4)]
+
+    # first guess takes precedence
+    client.cadcinfo = Mock(side_effect=lambda id: cadcdata.FileInfo(id))
+    results = dict(client.cadcinfo_many(['TEST/file2']))
+    assert 'mast:TEST/file2' == results['TEST/file2'].id
+
+    # duplicate ids get their own results
+    client.cadcinfo = Mock(side_effect=cadcinfo_mock)
+    ids = ['TEST/file2', 'TEST/file2', 'TEST/file3', 'TEST/file2']
+    results = list(client.cadcinfo_many(ids, max_workers=3))
+    assert ids == [id for id, _ in results]
+    assert all(result.id == 'cadc:TEST/file2' for id, result in results
+               if id == 'TEST/file2')
+    # requests sent once for the duplicates in progress
+    assert 4 == client.cadcinfo.call_count
+
+    # invalid id
+    results = list(client.cadcinfo_many(['']))
+    assert 1 == len(results)
+    assert isinstance(results[0][1], AttributeError)
+
+
 @patch('cadcdata.storageinv.net.BaseDataClient')
 def test_get_uris(basews_mock):
     client = StorageInventoryClient(auth.Subject())
@@ -469,6 +731,7 @@ def test_get_uris(basews_mock):
 
 
 @patch('sys.exit', Mock(side_effect=[MyExitError, MyExitError]))
+@patch('cadcdata.StorageInventoryClient._cadc_client', Mock(), create=True)
 @patch('cadcdata.StorageInventoryClient.cadcget')
 def test_cadcget_cli(cadcget_mock):
     sys.argv = ['cadcget', 'cadc:TEST/file']
@@ -483,6 +746,35 @@ def test_cadcget_cli(cadcget_mock):
     calls = [call(id='cadc:TEST/file', dest='file.txt', fhead=True)]
     cadcget_mock.assert_has_calls(calls)
 
+    # stream to stdout
+    cadcget_mock.reset_mock()
+    sys.argv = ['cadcget', 'cadc:TEST/file', '-o', '-']
+    cadcget_cli()
+    calls = [call(id='cadc:TEST/file', dest=sys.stdout.buffer, fhead=False)]
+    cadcget_mock.assert_has_calls(calls)
+
+    # multiple files
+    cadcget_mock.reset_mock()
+    sys.argv = ['cadcget', '-j', '2', 'cadc:TEST/file1', 'cadc:TEST/file2']
+    cadcget_cli()
+    transfer_cache = cadcget_mock.call_args[1]['transfer_cache']
+    calls = [call(id='cadc:TEST/file1', dest=None, fhead=False,
+                  transfer_cache=transfer_cache),
+             call(id='cadc:TEST/file2', dest=None, fhead=False,
+                  transfer_cache=transfer_cache)]
+    cadcget_mock.assert_has_calls(calls, any_order=True)
+
+    # errors are reported at the end
+    cadcget_mock.reset_mock()
+    cadcget_mock.side_effect = [exceptions.NotFoundException('file1'), None]
+    sys.argv = ['cadcget', 'cadc:TEST/file1', 'cadc:TEST/file2']
+    with patch('sys.stdout', new_callable=StringIO) as stdout_mock:
+        with pytest.raises(MyExitError):
+            cadcget_cli()
+    assert 2 == cadcget_mock.call_count
+    assert 'ERROR: cadc:TEST/file1: file1\n' \
+           'ERROR: 1 file(s) failed\n' == stdout_mock.getvalue()
+
 
 @patch('sys.exit', Mock(side_effect=[MyExitError]))
 @patch('cadcdata.StorageInventoryClient.cadcinfo')
@@ -538,6 +830,20 @@ def test_cadcinfo_cli(cadcinfo_mock):
                 '\t          md5sum: 0x123456\n')
     assert expected == stdout_mock.getvalue()
 
+    # ids not found are reported in order and the command fails
+    cadcinfo_mock.reset_mock()
+    cadcinfo_mock.side_effect = [
+        exceptions.NotFoundException('cadc:TEST/file1.txt.gz'),
+        cadcdata.FileInfo('cadc:TEST/file2.txt', name='file2.txt')]
+    sys.argv = ['cadcinfo', 'cadc:TEST/file1.txt.gz', 'cadc:TEST/file2.txt']
+    with patch('sys.stdout', new_callable=StringIO) as stdout_mock:
+        with pytest.raises(MyExitError):
+            cadcinfo_cli()
+    assert stdout_mock.getvalue().startswith(
+        'ERROR: Not found: cadc:TEST/file1.txt.gz\n'
+        'CADC Storage Inventory artifact cadc:TEST/file2.txt:\n')
+    assert 2 == cadcinfo_mock.call_count
+
 
 @patch('sys.exit', Mock(side_effect=[MyExitError, MyExitError, MyExitError]))
 @patch('cadcdata.storageinv._create_client')
@@ -580,7 +886,7 @@ def test_cadcput_cli(putclient_mock):
     # put multiple files in directory
     cadcput_mock.reset_mock()
     sys.argv = ['cadcput', '--netrc-file', netrc, '--type', 'application/text',
-                '--encoding', 'encoded', 'cadc:TEST/', put_dir]
+                '--encoding', 'encoded', '-j', '2', 'cadc:TEST/', put_dir]
     with patch('sys.stdout', new_callable=StringIO):
         cadcput_cli()
     # file3 is in subdirectory and not part of the list
@@ -688,3 +994,49 @@ def test_validate_get_uri():
         storageinv.validate_get_uri('cadc:TEST/somefile.txt[1]?CUTOUT=[1]&CUTOUT[2]')
     with pytest.raises(ValueError):
         storageinv.validate_get_uri('cadc:TEST/somefile.txt?CUTOUT=[1]&CUTUOT=[2]')
+
+
+@patch('cadcdata.storageinv.net.BaseDataClient')
+def test_async_client(basews_mock):
+    client = cadcdata.AsyncStorageInventoryClient(auth.Subject(),
+                                                  pool_maxsize=3)
+    assert isinstance(client.client, StorageInventoryClient)
+    assert 3 == basews_mock.call_args[1]['pool_maxsize']
+    assert isinstance(client._cadc_client, net.AsyncBaseDataClient)
+    assert 3 == client._cadc_client.pool_maxsize
+
+    # the possible URIs of an id without scheme are tried in order
+    client.client._get_uris = Mock(
+        return_value=['cadc:TEST/myfile.txt', 'mast:TEST/myfile.txt'])
+    client._cadc_client = Mock(aclose=AsyncMock(), head=AsyncMock(
+        side_effect=[exceptions.NotFoundException('cadc:TEST/myfile.txt'),
+                     Mock(headers={'Content-Length': '33'})]))
+
+    async def calls():
+        async with client:
+            info = await client.cadcinfo('TEST/myfile.txt')
+            with pytest.raises(exceptions.UnauthorizedException):
+                await client.cadcput('cadc:TEST/myfile.txt', 'myfile.txt')
+            return info
+
+    info = asyncio.run(calls())
+    assert 'mast:TEST/myfile.txt' == info.id
+    assert 33 == info.size
+    client.client._get_uris.assert_called_once_with('TEST/myfile.txt')
+    assert [call(('http://www.opencadc.org/std/storage#files-1.0', uri),
+                 follow_redirects=True) for uri in
+            ['cadc:TEST/myfile.txt', 'mast:TEST/myfile.txt']] == \
+        client._cadc_client.head.call_args_list
+    # connections released on exit
+    client._cadc_client.aclose.assert_called_once_with()
+
+
+# modules that are slow to load and that the command line tools import only
+# when they need them
+LAZY_MODULES = ['OpenSSL', 'magic', 'clint', 'lxml', 'packaging', 'sqlite3',
+                'distro', 'asyncio', 'httpx']
+
+
+def test_lazy_imports():
+    # guards the start up time of the command line tools
+    assert_lazy_imports('cadcdata', LAZY_MODULES)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero pour
+#  more details.                        plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est pas le cas,
+#  <http://www.gnu.org/licenses/>.      consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+# ***********************************************************************
+
+"""Contract tests for cadcdata CLI parsers."""
+import json
+import os
+
+from cadcdata.manifest import TransferManifest, PENDING, DONE, FAILED
+
+
+def test_manifest(tmp_path):
+    location = str(tmp_path / 'transfers.manifest')
+    src = tmp_path / 'file.fits'
+    src.write_bytes(b'abcde')
+    stat_info = os.stat(str(src))
+    with TransferManifest(location) as manifest:
+        assert manifest.get('put', 'cadc:TEST/file.fits') is None
+        manifest.record('put', 'cadc:TEST/file.fits', PENDING)
+        assert not manifest.is_confirmed('put', 'cadc:TEST/file.fits',
+                                         str(src))
+        manifest.record('put', 'cadc:TEST/file.fits', DONE,
+                        path=os.path.realpath(str(src)), size=5,
+                        mtime=stat_info.st_mtime, md5='ab56b4d9')
+        manifest.record('get', 'cadc:TEST/other.fits', FAILED, error='boom')
+        assert manifest.is_confirmed('put', 'cadc:TEST/file.fits', str(src))
+        assert not manifest.is_confirmed('get', 'cadc:TEST/file.fits')
+    # append-only
+    with open(location) as f:
+        lines = [json.loads(line) for line in f]
+    assert [PENDING, DONE, FAILED] == [line['state'] for line in lines]
+
+    # restart with a line truncated by a crash
+    with open(location, 'a') as f:
+        f.write('{"op": "get", "id": "cadc:TE')
+    with TransferManifest(location) as manifest:
+        assert {DONE: 1, FAILED: 1} == manifest.summary()
+        assert 'ab56b4d9' == manifest.get('put', 'cadc:TEST/file.fits')['md5']
+        assert manifest.is_confirmed('put', 'cadc:TEST/file.fits', str(src))
+        # source changed
+        src.write_bytes(b'abcdef')
+        assert not manifest.is_confirmed('put', 'cadc:TEST/file.fits',
+                                         str(src))
+
+        # received file
+        dest = tmp_path / 'other.fits'
+        dest.write_bytes(b'xyz')
+        manifest.record('get', 'cadc:TEST/other.fits', DONE,
+                        path=os.path.realpath(str(dest)), size=3)
+        assert manifest.is_confirmed('get', 'cadc:TEST/other.fits',
+                                     dest=str(tmp_path))
+        # not in the destination directory
+        assert not manifest.is_confirmed('get', 'cadc:TEST/other.fits',
+                                         dest=str(tmp_path / 'dest'))
+        assert not manifest.is_confirmed('get', 'cadc:TEST/other.fits')
+
+    # records written after the truncated line are kept
+    with TransferManifest(location) as manifest:
+        assert manifest.is_confirmed('get', 'cadc:TEST/other.fits',
+                                     dest=str(tmp_path))
+        dest.unlink()
+        assert not manifest.is_confirmed('get', 'cadc:TEST/other.fits',
+                                         dest=str(tmp_path))
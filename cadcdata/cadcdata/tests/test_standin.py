@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero pour
+#  more details.                        plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est pas le cas,
+#  <http://www.gnu.org/licenses/>.      consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+# ***********************************************************************
+
+
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+
+from cadcutils import exceptions, util
+from cadcutils.net import ws
+from cadcdata import storageinv, TransferManifest, \
+    AsyncStorageInventoryClient
+
+
+def test_standin_round_trip(si_server, si_client, tmp_path):
+    # exercises the protocols of the Storage Inventory stand-in
+    content = os.urandom(100000)
+    src = tmp_path / 'file.fits'
+    src.write_bytes(content)
+    id = 'cadc:TEST/file.fits'
+    si_client.cadcput(id, str(src), file_type='application/fits',
+                      file_encoding='binary')
+    assert content == si_server.get_content(id)
+    info = si_client.cadcinfo(id)
+    assert len(content) == info.size
+    assert hashlib.md5(content).hexdigest() == info.md5sum
+    assert 'file.fits' == info.name
+    assert info.lastmod is not None
+
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    si_client.cadcget(id, dest=str(dest))
+    assert content == (dest / 'file.fits').read_bytes()
+    si_client.cadcget(id + '?cutout=[1]', dest=str(dest))
+    assert content[:len(content) // 4] == \
+        (dest / 'file.fits__cutout').read_bytes()
+    assert content == b''.join(bytes(b) for b in si_client.iter_bytes(id))
+    assert content[10:20] == b''.join(
+        bytes(b) for b in si_client.iter_bytes(id, byte_range=(10, 19)))
+
+    si_client.cadcremove(id)
+    with pytest.raises(exceptions.NotFoundException):
+        si_client.cadcinfo(id)
+
+
+def test_standin_async_round_trip(si_server, si_client, tmp_path):
+    # the asyncio client with the protocols of the stand-in
+    contents = [os.urandom(10000 + i) for i in range(4)]
+    ids = ['cadc:TEST/file{}.fits'.format(i) for i in range(4)]
+    for id, content in zip(ids, contents):
+        (tmp_path / id.split('/')[-1]).write_bytes(content)
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    client = AsyncStorageInventoryClient(si_client._cadc_client.subject,
+                                         host=si_server.host)
+
+    async def calls():
+        async with client:
+            puts = await asyncio.gather(*[client.cadcput(
+                id, str(tmp_path / id.split('/')[-1]),
+                file_type='application/fits') for id in ids])
+            infos = await asyncio.gather(*[client.cadcinfo(id)
+                                           for id in ids])
+            gets = await asyncio.gather(*[client.cadcget(id, dest=str(dest))
+                                          for id in ids])
+            buffer = io.BytesIO()
+            await client.cadcget(ids[0], dest=buffer)
+            cutout = await client.cadcget(ids[0] + '?cutout=[1]',
+                                          dest=str(dest))
+            await client.cadcremove(ids[0])
+            with pytest.raises(exceptions.NotFoundException):
+                await client.cadcinfo(ids[0])
+            return puts, infos, gets, buffer, cutout
+
+    puts, infos, gets, buffer, cutout = asyncio.run(calls())
+    for id, content, put, info, get in zip(ids, contents, puts, infos, gets):
+        md5 = hashlib.md5(content).hexdigest()
+        assert md5 == put.md5sum
+        assert (len(content), md5) == (info.size, info.md5sum)
+        assert 'application/fits' == info.file_type
+        assert (len(content), md5) == (get.size, get.md5sum)
+        assert content == (dest / get.name).read_bytes()
+    for id, content in zip(ids[1:], contents[1:]):
+        assert content == si_server.get_content(id)
+    assert contents[0] == buffer.getvalue()
+    assert 'file0.fits__cutout' == cutout.name
+    assert contents[0][:len(contents[0]) // 4] == \
+        (dest / cutout.name).read_bytes()
+
+
+@pytest.mark.parametrize('segment_workers', [1, 3])
+def test_standin_segments(si_server, si_client, tmp_path, monkeypatch,
+                          segment_workers):
+    monkeypatch.setattr(ws, 'FILE_SEGMENT_THRESHOLD', 1024)
+    monkeypatch.setattr(ws, 'PREFERRED_SEGMENT_SIZE', 1024 * 1024)
+    monkeypatch.setattr(ws, 'MAX_SEGMENT_WORKERS', segment_workers)
+    content = os.urandom(5 * 1024 * 1024 + 100)
+    src = tmp_path / 'large.fits'
+    src.write_bytes(content)
+    id = 'cadc:TEST/large.fits'
+    si_client.cadcput(id, str(src))
+    assert content == si_server.get_content(id)
+    assert not si_server.txns
+    # transaction instead of a single PUT
+    assert si_server.requests['PUT'] > 1
+
+
+def test_standin_segments_out_of_order(si_server, si_client, tmp_path,
+                                       monkeypatch):
+    monkeypatch.setattr(ws, 'FILE_SEGMENT_THRESHOLD', 1024)
+    monkeypatch.setattr(ws, 'PREFERRED_SEGMENT_SIZE', 1024 * 1024)
+    monkeypatch.setattr(ws, 'MAX_SEGMENT_WORKERS', 3)
+    content = os.urandom(3 * 1024 * 1024 + 100)
+    src = tmp_path / 'large.fits'
+    src.write_bytes(content)
+    id = 'cadc:TEST/large.fits'
+    si_server.reorder_segments = True
+    si_client.cadcput(id, str(src))
+    assert content == si_server.get_content(id)
+    assert 0 != si_server.segments[0]
+    assert [0, 1024 * 1024, 2 * 1024 * 1024, 3 * 1024 * 1024] == \
+        sorted(si_server.segments)
+
+
+def test_standin_segments_content_range_ignored(si_server, si_client,
+                                                tmp_path, monkeypatch):
+    # segments are sent sequentially after the first batch is misplaced
+    monkeypatch.setattr(ws, 'FILE_SEGMENT_THRESHOLD', 1024)
+    monkeypatch.setattr(ws, 'PREFERRED_SEGMENT_SIZE', 1024 * 1024)
+    monkeypatch.setattr(ws, 'MAX_SEGMENT_WORKERS', 3)
+    content = os.urandom(5 * 1024 * 1024 + 100)
+    src = tmp_path / 'large.fits'
+    src.write_bytes(content)
+    id = 'cadc:TEST/large.fits'
+    si_server.reorder_segments = True
+    si_server.ignore_content_range = True
+    si_client.cadcput(id, str(src))
+    assert content == si_server.get_content(id)
+    assert not si_server.txns
+    # first batch of 3 segments and 6 sequential segments
+    assert 3 + 6 == len(si_server.segments)
+
+
+@pytest.mark.parametrize('segment_workers', [1, 3])
+def test_standin_failed_segment(si_server, si_client, tmp_path, monkeypatch,
+                                segment_workers):
+    # partially appended segments are reverted or the transaction restarted
+    monkeypatch.setattr(ws, 'FILE_SEGMENT_THRESHOLD', 1024)
+    monkeypatch.setattr(ws, 'PREFERRED_SEGMENT_SIZE', 1024 * 1024)
+    monkeypatch.setattr(ws, 'MAX_SEGMENT_WORKERS', segment_workers)
+    content = os.urandom(3 * 1024 * 1024 + 100)
+    src = tmp_path / 'large.fits'
+    src.write_bytes(content)
+    id = 'cadc:TEST/large.fits'
+    si_server.failed_segments = 1
+    si_client.cadcput(id, str(src))
+    assert content == si_server.get_content(id)
+    assert 0 == si_server.failed_segments
+    assert not si_server.txns
+
+
+def test_standin_interrupted_download(si_server, si_client, tmp_path):
+    content = os.urandom(1000000)
+    id = 'cadc:TEST/interrupted.fits'
+    si_server.add_file(id, content)
+    si_server.interrupted_downloads = 1
+    dest = tmp_path / 'interrupted.fits'
+    si_client.cadcget(id, dest=str(dest))
+    assert content == dest.read_bytes()
+    assert 0 == si_server.interrupted_downloads
+
+
+def test_standin_timing(si_server, si_client, tmp_path, capsys):
+    content = os.urandom(100000)
+    src = tmp_path / 'timed.fits'
+    src.write_bytes(content)
+    id = 'cadc:TEST/timed.fits'
+    si_client.timing = util.TimingReport()
+    si_client.cadcput(id, str(src), file_type='application/fits',
+                      file_encoding='binary',
+                      md5_checksum=hashlib.md5(content).hexdigest())
+    si_client.cadcget('TEST/timed.fits', dest=str(tmp_path / 'dest.fits'))
+    report = si_client.timing.to_dict()
+    put, get = report['transfers']
+    assert ('put', len(content)) == (put['operation'], put['size'])
+    assert {'capabilities', 'head', 'mime', 'negotiate', 'transfer',
+            'other'}.issubset(set(put['phases']))
+    assert ('get', len(content)) == (get['operation'], get['size'])
+    assert {'resolve', 'negotiate', 'transfer', 'other'}.issubset(
+        set(get['phases']))
+    assert 2 == report['summary']['transfers']
+    assert 'p90' in report['summary']['phases']['transfer']
+
+    # command line
+    dest = tmp_path / 'cli'
+    dest.mkdir()
+    with patch.object(sys, 'argv', ['cadcget', '--timing', 'json', '-o',
+                                    str(dest), '--host', si_server.host,
+                                    id, 'cadc:TEST/missing.fits']):
+        with pytest.raises(SystemExit):
+            storageinv.cadcget_cli()
+    report = json.loads(capsys.readouterr().err)
+    assert 2 == report['summary']['transfers']
+    assert 1 == report['summary']['failed']
+    assert 'NotFoundException: cadc:TEST/missing.fits' == \
+        report['transfers'][1]['error']
+
+
+def test_standin_manifest(si_server, si_client, tmp_path):
+    src_dir = tmp_path / 'src'
+    src_dir.mkdir()
+    files = []
+    for i in range(5):
+        src = src_dir / 'file{}.fits'.format(i)
+        src.write_bytes(os.urandom(1000))
+        files.append(('cadc:TEST/file{}.fits'.format(i), str(src)))
+    location = str(tmp_path / 'put.manifest')
+    with TransferManifest(location) as manifest:
+        assert not si_client.bulk_put(files, file_type='application/fits',
+                                      file_encoding='binary',
+                                      manifest=manifest, max_workers=2)
+    requests = dict(si_server.requests)
+    # nothing to do on restart, not even network calls
+    with TransferManifest(location) as manifest:
+        assert {'done': 5} == manifest.summary()
+        assert not si_client.bulk_put(files, manifest=manifest)
+        assert requests == si_server.requests
+        # changed file
+        (src_dir / 'file1.fits').write_bytes(b'changed')
+        assert not si_client.bulk_put(files, file_type='application/fits',
+                                      file_encoding='binary',
+                                      manifest=manifest)
+    assert b'changed' == si_server.get_content('cadc:TEST/file1.fits')
+
+    ids = [id for id, _ in files] + ['cadc:TEST/missing.fits']
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    location = str(tmp_path / 'get.manifest')
+    with TransferManifest(location) as manifest:
+        errors = si_client.bulk_get(ids, dest=str(dest), manifest=manifest)
+        assert ['cadc:TEST/missing.fits'] == list(errors)
+        assert 'failed' == manifest.get('get', ids[-1])['state']
+        record = manifest.get('get', ids[0])
+        assert str(dest / 'file0.fits') == record['path']
+        assert hashlib.md5(
+            (dest / 'file0.fits').read_bytes()).hexdigest() == record['md5']
+    # only the failed file is retried
+    si_server.add_file('cadc:TEST/missing.fits', b'found')
+    (dest / 'file2.fits').unlink()
+    requests = dict(si_server.requests)
+    with TransferManifest(location) as manifest:
+        assert not si_client.bulk_get(ids, dest=str(dest), manifest=manifest)
+    assert requests['GET'] + 2 == si_server.requests['GET']
+    assert b'found' == (dest / 'missing.fits').read_bytes()
+
+    # all the files are received in a different destination
+    other = tmp_path / 'other'
+    other.mkdir()
+    with TransferManifest(location) as manifest:
+        assert not si_client.bulk_get(ids, dest=str(other), manifest=manifest)
+    assert sorted(os.listdir(str(dest))) == sorted(os.listdir(str(other)))
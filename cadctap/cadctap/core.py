@@ -70,7 +70,6 @@
 import logging
 import traceback
 import sys
-from clint.textui import progress
 import datetime
 from cadcutils import net, util, exceptions
 import netrc as netrclib
@@ -79,12 +78,9 @@ from cadctap import version
 from urllib.parse import urlparse, urlencode
 import contextlib
 import cadcutils
-from xml.dom import minidom
 import re
 from argparse import ArgumentError, ArgumentTypeError
 
-from requests_toolbelt.multipart.encoder import MultipartEncoder
-
 logger = logging.getLogger(__name__)
 
 # Prefix to be prepended to the short name of a service ID
@@ -124,9 +120,6 @@ AUTH_OPTION_EXPLANATION = \
 
 cadctap_agent = 'cadc-tap-client/{}'.format(version.version)
 
-# make the stream bar show up on stdout
-progress.STREAM = sys.stdout
-
 __all__ = ['CadcTapClient']
 
 TABLES_CAPABILITY = 'ivo://ivoa.net/std/VOSI#tables-1.1'
@@ -436,6 +429,7 @@ class CadcTapClient(object):
 
         try:
             logger.debug('QUERY fileds: {}'.format(fields))
+            from requests_toolbelt.multipart.encoder import MultipartEncoder
             m = MultipartEncoder(fields=fields)
             # TODO the following if/else is temporary to support both TAP1.0 and
             # TAP1.1 capabilities. For TAP1.1 the resource argument in the post
@@ -587,6 +581,7 @@ class CadcTapClient(object):
         if not self._db_schemas:
             results = self._tap_client.get((TABLES_CAPABILITY_ID, None),
                                            params={'detail': 'min'})
+            from xml.dom import minidom
             doc = minidom.parseString(results.text)
             for s in doc.getElementsByTagName('schema'):
                 schema_info = TabularInfo(
@@ -627,6 +622,7 @@ class CadcTapClient(object):
         """
         response = self._tap_client.get((TABLES_CAPABILITY_ID, table),
                                         params={'detail': 'min'})
+        from xml.dom import minidom
         doc = minidom.parseString(response.text)
         try:
             tab_descr = doc.getElementsByTagName(
@@ -933,6 +929,7 @@ def exit_on_exception(ex):
     if message:
         # could be votable format
         try:
+            from xml.dom import minidom
             doc = minidom.parseString(message)
             # in the absence of a votable parser, try a simple w
             for el in doc.getElementsByTagName('INFO'):
@@ -71,6 +71,7 @@ import os
 import sys
 import unittest
 from cadcutils import net, exceptions
+from cadcutils.util.tests.import_helpers import assert_lazy_imports
 
 from io import StringIO, BytesIO
 import cadctap
@@ -847,3 +848,14 @@ class TestCadcTapClient(unittest.TestCase):
                 main_app()
             except SystemExit:
                 assert stderr_mock.getvalue() == 'KeyboardInterrupt\n'
+
+
+# modules that are slow to load and that the command line tools import only
+# when they need them
+LAZY_MODULES = ['OpenSSL', 'clint', 'requests_toolbelt', 'xml.dom.minidom',
+                'lxml', 'packaging', 'sqlite3', 'distro']
+
+
+def test_lazy_imports():
+    # guards the start up time of the command line tools
+    assert_lazy_imports('cadctap', LAZY_MODULES)
@@ -76,7 +76,8 @@ import requests
 
 __all__ = ['UnauthorizedException', 'ForbiddenException', 'NotFoundException',
            'BadRequestException', 'ByteLimitException',
-           'InternalServerException', 'UnexpectedException', 'SslException']
+           'InternalServerException', 'UnexpectedException', 'SslException',
+           'CircuitOpenException']
 
 
 class HttpException(Exception):
@@ -210,3 +211,13 @@ class SslException(HttpException):
     def __init__(self, msg=None, orig_exception=None):
         HttpException.__init__(self, msg, orig_exception)
         self.errno = errno.EIO
+
+
+class CircuitOpenException(HttpException):
+    """Requests to a host are not sent for a while because of its recent
+    failures. Clients should try another endpoint if available.
+    Attributes:
+        msg
+    """
+    def __init__(self, msg=None, orig_exception=None):
+        HttpException.__init__(self, msg, orig_exception)
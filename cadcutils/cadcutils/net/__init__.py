@@ -56,6 +56,8 @@ inter processes communication to determine the result of running the command.
 
 from .auth import *  # noqa
 from .ws import *  # noqa
+from .asyncws import *  # noqa
+from .metrics import *  # noqa
 from .netutils import *  # noqa
 from .group import *  # noqa
 from .groups_client import *  # noqa
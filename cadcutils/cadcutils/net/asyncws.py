@@ -0,0 +1,922 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#
+# ***********************************************************************
+
+"""
+asyncio web service clients.
+
+The requests are sent from the event loop with httpx, an optional dependency
+of cadcutils (`pip install cadcutils[async]`). The clients have the same retry
+semantics (BackoffPolicy, RetryBudget and CircuitBreaker), request listeners,
+credentials (Subject) and capabilities lookup as the blocking clients and they
+raise the same exceptions. Blocking work is done in worker threads: reading
+and writing local files and refreshing the capabilities of a service (every
+REG_REFRESH_INTERVAL sec).
+
+A client and its connections belong to the event loop that it is first used
+in.
+"""
+
+import functools
+import hashlib
+import logging
+import os
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from cadcutils import exceptions, util
+from cadcutils import version as cadctools_version
+from . import ws, ssl_errors, cert_validation
+from .netutils import Transfer, add_md5_header, extract_md5, \
+    get_header_filename
+
+__all__ = ['AsyncRetrySession', 'AsyncBaseWsClient', 'AsyncBaseDataClient',
+           'AsyncTransfer']
+
+# timeout (sec) of the requests that do not set one
+DEFAULT_TIMEOUT = 120
+
+
+def _import_httpx():
+    try:
+        import httpx
+    except ImportError:
+        raise ImportError('The asyncio clients require httpx. Install it '
+                          'with: pip install cadcutils[async]')
+    return httpx
+
+
+async def _run_blocking(func, *args, **kwargs):
+    # runs a blocking function in the default executor of the event loop
+    import asyncio  # not loaded for the sync clients
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(func, *args, **kwargs))
+
+
+def _ssl_context(verify, cert):
+    # SSL context of the connections. Like requests, it trusts the
+    # certificates of certifi
+    import ssl
+    import certifi
+    context = ssl.create_default_context(cafile=certifi.where())
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if cert:
+        try:
+            context.load_cert_chain(cert)
+        except ssl.SSLError as e:
+            raise ssl_errors.ssl_exception_from_error(e, cert=cert)
+    return context
+
+
+def _caused_by_ssl_error(error):
+    import ssl
+    while error is not None:
+        if isinstance(error, ssl.SSLError):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _requests_error(error):
+    # the requests exception that corresponds to an httpx transport error so
+    # that the errors are handled like those of the blocking clients
+    httpx = _import_httpx()
+    if isinstance(error, httpx.ConnectTimeout):
+        error_class = requests.exceptions.ConnectTimeout
+    elif isinstance(error, httpx.TimeoutException):
+        error_class = requests.exceptions.ReadTimeout
+    elif _caused_by_ssl_error(error):
+        error_class = requests.exceptions.SSLError
+    else:
+        error_class = requests.ConnectionError
+    return error_class(str(error) or repr(error))
+
+
+class _FileContent(object):
+    """
+    Body of a request with the content of a file, which is read in a worker
+    thread. The file is read again by each iteration (retries of the request)
+    and the md5 checksum of the content sent is available at the end of the
+    iteration.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.md5_checksum = None
+
+    async def __aiter__(self):
+        self.md5_checksum = None
+        md5_hash = hashlib.md5()
+        with open(self.file_path, 'rb') as reader:
+
+            def read():
+                buffer = reader.read(ws.BUFSIZE)
+                md5_hash.update(buffer)
+                return buffer
+
+            while True:
+                buffer = await _run_blocking(read)
+                if not buffer:
+                    break
+                yield buffer
+        self.md5_checksum = md5_hash.hexdigest()
+
+
+class AsyncRetrySession(object):
+    """
+    asyncio counterpart of the RetrySession on top of an httpx.AsyncClient.
+    Transient errors are retried with the same backoff policy, retry budget
+    and circuit breaker, the requests are reported to the same listeners
+    (RequestEvent) and the errors are raised as the same exceptions. The
+    original exception of transport errors is the corresponding requests
+    exception, e.g. requests.ConnectionError.
+    """
+
+    retry_errors = ws.RetrySession.retry_errors
+
+    def __init__(self, retry=True, start_delay=1, idempotent_posts=False,
+                 pool_maxsize=None, pool_block=None, keep_alive=True,
+                 retry_policy=None, retry_budget=None, circuit_breaker=None,
+                 cert=None, verify=True, auth=None, headers=None,
+                 transport=None):
+        """
+        ::param retry, start_delay, idempotent_posts, keep_alive,
+        retry_policy, retry_budget, circuit_breaker: see RetrySession
+        ::param pool_maxsize: maximum number of connections kept alive
+        (default=POOL_MAXSIZE)
+        ::param pool_block: limit the number of connections to pool_maxsize.
+        The requests wait for a connection to become available
+        (default=POOL_BLOCK)
+        ::param cert: client certificate (PEM file that includes the key)
+        ::param verify: set to False to skip the verification of the server
+        certificates
+        ::param auth: (user, password) of the basic authentication
+        ::param headers: headers of all the requests
+        ::param transport: httpx transport of the requests, e.g.
+        httpx.MockTransport in tests (default=HTTP transport)
+        """
+        httpx = _import_httpx()
+        self.logger = logging.getLogger('RetrySession')
+        self.listeners = []
+        self.retry = retry
+        self.start_delay = start_delay
+        self.idempotent_posts = idempotent_posts
+        self.retry_policy = retry_policy or \
+            ws.BackoffPolicy.from_env(start_delay)
+        if retry_budget is None and os.getenv(ws.RETRY_BUDGET_ENV, None):
+            retry_budget = ws.RetryBudget(float(os.getenv(ws.RETRY_BUDGET_ENV)))
+        self.retry_budget = retry_budget
+        self.circuit_breaker = circuit_breaker if circuit_breaker \
+            is not None else ws.get_circuit_breaker()
+        self.server_versions = None  # server versions that client supports
+        self.cert = cert
+        self.auth = auth
+        self.keep_alive = keep_alive
+        headers = dict(headers or {})
+        if not keep_alive:
+            headers['Connection'] = 'close'
+        pool_maxsize = pool_maxsize or ws.POOL_MAXSIZE
+        if pool_block is None:
+            pool_block = ws.POOL_BLOCK
+        limits = httpx.Limits(
+            max_connections=pool_maxsize if pool_block else None,
+            max_keepalive_connections=pool_maxsize if keep_alive else 0)
+        # trust_env=False prevents httpx from using .netrc
+        self._client = httpx.AsyncClient(
+            auth=auth, headers=headers, verify=_ssl_context(verify, cert),
+            timeout=DEFAULT_TIMEOUT, limits=limits, trust_env=False,
+            transport=transport)
+
+    # same listeners, circuit breaker and token as the blocking sessions
+    _notify = ws.RetrySession._notify
+    _record_host = ws.RetrySession._record_host
+    token = ws.RetrySession.token
+
+    @property
+    def headers(self):
+        return self._client.headers
+
+    @property
+    def cookies(self):
+        # http.cookiejar.Cookie objects
+        return self._client.cookies.jar
+
+    def set_cookie(self, domain, name, value):
+        self._client.cookies.set(name, value, domain=domain)
+
+    async def request(self, method, url, stream=False, **kwargs):
+        """
+        Sends a request, retrying the transient errors (see RetrySession)
+        :param method: HTTP method
+        :param url: URL of the request
+        :param stream: True to return the response before reading its
+        content. The response must then be closed (aclose).
+        :param kwargs: arguments of httpx.AsyncClient.build_request (content,
+        params, headers, timeout...) and follow_redirects (default=True).
+        The content of the requests that might be retried must be bytes or an
+        async iterable that can be iterated more than once.
+        :return: the httpx.Response
+        """
+        follow_redirects = kwargs.pop('follow_redirects', True)
+        if kwargs.get('timeout', None) is None:
+            kwargs.pop('timeout', None)
+        request = self._client.build_request(method, url, **kwargs)
+        event = ws.RequestEvent(request)
+        start = time.time()
+        try:
+            return await self._send(request, event, stream, follow_redirects)
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            event.duration = time.time() - start
+            self._notify(event)
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def put(self, url, **kwargs):
+        return await self.request('PUT', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self.request('DELETE', url, **kwargs)
+
+    async def head(self, url, **kwargs):
+        kwargs.setdefault('follow_redirects', False)
+        return await self.request('HEAD', url, **kwargs)
+
+    async def aclose(self):
+        """
+        Closes the connections
+        """
+        await self._client.aclose()
+
+    async def _send(self, request, event, stream, follow_redirects):
+        import asyncio  # not loaded for the sync clients
+        if (request.method.upper() == 'POST') and self.idempotent_posts:
+            self.logger.debug(
+                'POST requests considered idempotent. re-tries enabled')
+
+        # host of the circuit breaker (if any)
+        host = None
+        if self.circuit_breaker is not None:
+            host = event.host
+            self.circuit_breaker.check(host)
+
+        if (request.method.upper() != 'POST' or self.idempotent_posts) \
+           and self.retry:
+            delays = self.retry_policy.delays()
+            if self.retry_budget is not None:
+                self.retry_budget.record_request()
+            num_retries = 0
+            self.logger.debug(
+                "Sending request {0}  to server.".format(request))
+            current_error = None
+            while True:
+                retry_after = None
+                try:
+                    response = await self._send_once(
+                        request, event, stream, follow_redirects)
+                    if response.status_code not in self.retry_errors:
+                        self._record_host(host, failed=False)
+                    self.check_status(response)
+                    return response
+                except requests.exceptions.ConnectTimeout as ct:
+                    # retry on timeouts
+                    current_error = ct
+                    self.logger.debug(ct)
+                except requests.exceptions.ReadTimeout as rt:
+                    # this could happen after the request has made it to
+                    # the server so it should be re-done
+                    self._record_host(host, failed=True)
+                    raise exceptions.TransferException(
+                        'Read timeout on {}'.format(request.url), rt)
+                except requests.HTTPError as e:
+                    current_error = e
+                    if e.response.status_code == requests.codes.unavailable:
+                        # is there a delay from the server (Retry-After)?
+                        try:
+                            retry_after = int(
+                                e.response.headers[ws.SERVICE_RETRY])
+                        except Exception:
+                            pass
+                except requests.ConnectionError as ce:
+                    self._record_host(host, failed=True)
+                    raise ssl_errors.connection_error_to_exception(
+                        ce, url=str(request.url), cert=self.cert)
+                if num_retries == self.retry_policy.retries:
+                    break
+                if host is not None and self.circuit_breaker.is_open(host):
+                    # fail fast so that the caller can try another endpoint
+                    raise exceptions.CircuitOpenException(
+                        'Too many failures of {}: {}'.format(
+                            host, str(current_error)), current_error)
+                if self.retry_budget is not None and \
+                        not self.retry_budget.try_retry():
+                    self.logger.debug('Retry budget exhausted')
+                    break
+                current_delay = delays.next_delay(retry_after)
+                self.logger.debug(
+                    "Error {}. Resending request in {}s ...".format(
+                        str(current_error), current_delay))
+                await asyncio.sleep(current_delay)
+                num_retries += 1
+                event.retries = num_retries
+                event.backoff += current_delay
+            # one failure per request, once its retries are used up
+            self._record_host(host, failed=True)
+            raise exceptions.HttpException(current_error)
+        else:
+            try:
+                response = await self._send_once(request, event, stream,
+                                                 follow_redirects)
+            except requests.ConnectionError as ce:
+                self._record_host(host, failed=True)
+                if isinstance(ce, requests.exceptions.ConnectTimeout):
+                    raise
+                raise ssl_errors.connection_error_to_exception(
+                    ce, url=str(request.url), cert=self.cert)
+            self._record_host(
+                host, failed=response.status_code in self.retry_errors)
+            self.check_status(response, retry=False)
+            return response
+
+    async def _send_once(self, request, event, stream, follow_redirects):
+        # sends a request once. The content of the response is read unless
+        # it is streamed and the request succeeded
+        httpx = _import_httpx()
+        start = time.time()
+        try:
+            response = await self._client.send(
+                request, stream=True, follow_redirects=follow_redirects)
+        except httpx.TransportError as e:
+            raise _requests_error(e) from e
+        event.record_response(response, time.time() - start)
+        if not stream or response.is_error:
+            try:
+                await response.aread()
+            except httpx.TransportError as e:
+                raise _requests_error(e) from e
+            finally:
+                await response.aclose()
+        return response
+
+    def check_status(self, response, retry=True):
+        """
+        Check the response status. Maps the application related requests
+        error status into Exceptions and raises the others (see
+        RetrySession.check_status)
+        :param response: httpx.Response
+        :param retry: request can be re-tried. Let the re-tried errors through
+        """
+        ws._check_server_version(self.server_versions,
+                                 response.headers.get('server', None))
+        if not response.is_error:
+            return
+        error = requests.HTTPError('{} Error: {} for url: {}'.format(
+            response.status_code, response.reason_phrase, response.url),
+            response=response)
+        if retry and response.status_code in self.retry_errors:
+            raise error
+        raise ws._status_exception(error)
+
+
+class AsyncBaseWsClient(ws.BaseWsClient):
+    """
+    asyncio Web Service client. It is a BaseWsClient (same constructor
+    arguments, credentials and capabilities) with coroutine versions of the
+    get/put/post/delete/head functions. The requests are sent by an
+    AsyncRetrySession and the arguments and the responses are those of httpx
+    (e.g. `content` instead of `data` for the body of a request).
+
+    Example:
+        client = await AsyncBaseWsClient.create(resource_id, subject, agent)
+        async with client:
+            responses = await asyncio.gather(
+                *[client.head(url) for url in urls])
+    """
+
+    def __init__(self, resource_id, subject, agent, transport=None,
+                 **kwargs):
+        """
+        Client constructor. Like the constructor of the BaseWsClient, it might
+        access the network to look up the host of the service (see `create`).
+        :param resource_id -- ID of the resource being accessed (URI format)
+        as it appears in the registry.
+        :param subject -- The subject that is using the service
+        :param agent -- Name of the agent (application) that accesses the
+        service and its version, e.g. foo/1.0.2
+        :param transport -- httpx transport of the requests (see
+        AsyncRetrySession)
+        :param kwargs -- other arguments of the BaseWsClient constructor
+        """
+        httpx = _import_httpx()
+        super().__init__(resource_id, subject, agent, **kwargs)
+        self.transport = transport
+        self.package_info = "cadcutils/{} httpx/{}".format(
+            cadctools_version.version, httpx.__version__)
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        """
+        Creates a client without blocking the event loop. Constructors might
+        access the network, e.g. to look up the host of a service or for
+        the authentication with user/password.
+        :param args: positional arguments of the constructor
+        :param kwargs: keyword arguments of the constructor
+        :return: the client
+        """
+        return await _run_blocking(cls, *args, **kwargs)
+
+    async def post(self, resource=None, **kwargs):
+        """
+        Coroutine version of BaseWsClient.post
+        :returns httpx.Response
+        """
+        url = await self._get_async_url(resource)
+        return await self._get_session().post(url, **kwargs)
+
+    async def put(self, resource=None, **kwargs):
+        """
+        Coroutine version of BaseWsClient.put
+        :returns httpx.Response
+        """
+        url = await self._get_async_url(resource)
+        return await self._get_session().put(url, **kwargs)
+
+    async def get(self, resource, params=None, **kwargs):
+        """
+        Coroutine version of BaseWsClient.get. Responses to `stream=True`
+        requests must be closed (aclose).
+        :returns httpx.Response
+        """
+        url = await self._get_async_url(resource)
+        return await self._get_session().get(url, params=params, **kwargs)
+
+    async def delete(self, resource=None, **kwargs):
+        """
+        Coroutine version of BaseWsClient.delete
+        :returns httpx.Response
+        """
+        url = await self._get_async_url(resource)
+        return await self._get_session().delete(url, **kwargs)
+
+    async def head(self, resource=None, **kwargs):
+        """
+        Coroutine version of BaseWsClient.head
+        :returns httpx.Response
+        """
+        url = await self._get_async_url(resource)
+        return await self._get_session().head(url, **kwargs)
+
+    async def is_available(self):
+        """
+        Checks whether the service is currently available or not
+        :return: True if service is available, False otherwise
+        """
+        try:
+            await self.get((ws.SERVICE_AVAILABILITY_ID, None))
+        except exceptions.HttpException:
+            return False
+        return True
+
+    async def get_url(self, resource):
+        """
+        Coroutine version of the resolution of a resource (URL or (feature,
+        path) tuple, see BaseWsClient.get) into a URL. The capabilities of
+        the service are read in a worker thread when they have to be
+        refreshed.
+        :param resource: the resource
+        :return: URL of the resource
+        """
+        return await self._get_async_url(resource)
+
+    async def _get_async_url(self, resource):
+        if type(resource) is tuple and \
+                time.time() - self.caps.last_capstime > \
+                ws.REG_REFRESH_INTERVAL:
+            return await _run_blocking(self._get_url, resource)
+        return self._get_url(resource)
+
+    async def aclose(self):
+        """
+        Closes the connections of the client
+        """
+        if self._session is not None:
+            await self._session.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    def _create_session(self):
+        self.logger.debug('Creating async session.')
+        headers = {'User-Agent': self._user_agent()}
+        if self.session_headers is not None:
+            headers.update(self.session_headers)
+        cert = None
+        auth = None
+        if not self.subject.token and self.subject.certificate is not None:
+            if self.subject.validate_certificate:
+                cert_validation.validate_client_certificate(
+                    self.subject.certificate)
+            cert = self.subject.certificate
+        elif not self.subject.token and not self.subject.cookies:
+            if (not self.subject.anon) and (self.host is not None):
+                auth = self.subject.get_auth(self.host)
+        session = AsyncRetrySession(
+            self.retry, idempotent_posts=self.idempotent_posts,
+            pool_maxsize=self.pool_maxsize, pool_block=self.pool_block,
+            keep_alive=self.keep_alive, retry_policy=self.retry_policy,
+            retry_budget=self.retry_budget,
+            circuit_breaker=self.circuit_breaker, cert=cert,
+            verify=self.verify, auth=auth, headers=headers,
+            transport=self.transport)
+        if self.subject.token:
+            session.token = self.subject.token
+        elif cert is None and self.subject.cookies:
+            for cookie in self.subject.cookies:
+                session.set_cookie(cookie.domain, cookie.name, cookie.value)
+        session.server_versions = self._server_versions
+        return session
+
+
+class AsyncBaseDataClient(AsyncBaseWsClient):
+    """
+    asyncio data client with coroutine versions of the transfer methods of
+    BaseDataClient.
+    """
+
+    async def upload_file(self, url, src, md5_checksum=None, **kwargs):
+        """
+        Coroutine version of BaseDataClient.upload_file for files smaller
+        than FILE_SEGMENT_THRESHOLD. Larger files require segmented
+        transactions (BaseDataClient.upload_file).
+        :param url: URL to upload the file to
+        :param src: name of the file to upload
+        :param md5_checksum: optional md5 checksum of the file content
+        :param kwargs: other http attributes
+        :returns (name_of_uploaded_file, md5_checksum, file_size)
+        :throws: HttpExceptions
+        """
+        stat_info = os.stat(src)
+        if stat_info.st_size == 0:
+            raise ValueError('Cannot upload empty files')
+        if stat_info.st_size >= ws.FILE_SEGMENT_THRESHOLD:
+            raise ValueError(
+                'Files of {} bytes or more require segmented transfers '
+                '(BaseDataClient.upload_file)'.format(
+                    ws.FILE_SEGMENT_THRESHOLD))
+        orig_headers = dict(kwargs.pop(ws.HEADERS, None) or {})
+        orig_headers[ws.HTTP_LENGTH] = str(stat_info.st_size)
+
+        def combine_headers(new_headers):
+            result = dict(orig_headers)
+            result.update(new_headers)
+            return result
+
+        src_md5 = md5_checksum
+        md5_cache = util.get_md5_cache()
+        if not src_md5 and md5_cache:
+            # checksum of a file that has already been digested
+            src_md5 = md5_cache.get(src)
+        if not src_md5 and stat_info.st_size <= ws.MAX_MD5_COMPUTE_SIZE:
+            src_md5 = await _run_blocking(ws.BaseDataClient.compute_file_md5,
+                                          src)
+
+        dest_name = os.path.basename(urlparse(url).path)
+        start = time.time()
+        if src_md5:
+            # try a HEAD first on the destination
+            try:
+                response = await self.head(url)
+                dest_md5 = extract_md5(response.headers)
+                if dest_md5 and (dest_md5 == src_md5):
+                    self.logger.info(
+                        'Source and destination identical for {}. '
+                        'Skip transfer!'.format(src))
+                    return dest_name, dest_md5, stat_info.st_size
+            except Exception:
+                # continue
+                pass
+            # no transactions needed since the server checks the integrity
+            # of the file with the md5 of the source
+            headers = dict(orig_headers)
+            add_md5_header(headers=headers, md5_checksum=src_md5)
+            retries = ws.MD5_MISMATCH_RETRY
+            while True:
+                try:
+                    response = await self.put(url, content=_FileContent(src),
+                                              headers=headers, **kwargs)
+                    break
+                except exceptions.PreconditionFailedException as e:
+                    # retry as this is likely caused by md5 mismatch
+                    retries -= 1
+                    if not retries:
+                        raise e
+            dest_md5 = extract_md5(response.headers)
+        else:
+            # one go upload with transaction
+            retries = ws.MD5_MISMATCH_RETRY
+            while True:
+                content = _FileContent(src)
+                response = await self.put(
+                    url, content=content,
+                    headers=combine_headers({ws.PUT_TXN_OP: ws.PUT_TXN_START}),
+                    **kwargs)
+                trans_id = response.headers.get(ws.PUT_TXN_ID, None)
+                # check the file made it OK
+                dest_md5 = extract_md5(response.headers)
+                if dest_md5 == content.md5_checksum:
+                    break
+                msg = 'File {} not properly uploaded. Mismatched md5 src ' \
+                      'vs dest: {} vs {}'.format(src, content.md5_checksum,
+                                                 dest_md5)
+                self.logger.warning(msg)
+                if trans_id:
+                    await self.post(url, headers=combine_headers(
+                        {ws.PUT_TXN_ID: trans_id,
+                         ws.PUT_TXN_OP: ws.PUT_TXN_ABORT,
+                         ws.HTTP_LENGTH: '0'}), **kwargs)
+                retries -= 1
+                if not retries:
+                    raise exceptions.TransferException(msg)
+                self.logger.warning('Retrying')
+            if trans_id:
+                await self.put(url, headers=combine_headers(
+                    {ws.PUT_TXN_ID: trans_id,
+                     ws.PUT_TXN_OP: ws.PUT_TXN_COMMIT,
+                     ws.HTTP_LENGTH: '0'}), **kwargs)
+        duration = time.time() - start
+        self.logger.info(
+            'Successfully uploaded file {} in {}s '
+            '(avg. speed: {}MB/s)'.format(
+                src, round(duration, 2),
+                round(stat_info.st_size / 1024 / 1024 / duration, 2)))
+        ws.BaseDataClient._cache_md5(src, dest_md5, stat_info)
+        return dest_name, dest_md5, stat_info.st_size
+
+    async def download_file(self, url, dest=None, process_bytes=None,
+                            **kwargs):
+        """
+        Coroutine version of BaseDataClient.download_file. The file is
+        downloaded in one stream and it is written in a worker thread.
+        Interrupted downloads are not resumed.
+        :param url: URL to get the file from
+        :param dest: name of the file or of the directory to save it to or
+        binary file-like object (see BaseDataClient.download_file)
+        :param process_bytes: function to be applied to the received bytes
+        (in order). It is called in the event loop and must not block.
+        :param kwargs: other http attributes
+        :return: (file_name, md5_checksum, file_size)
+        :throws: HttpExceptions
+        """
+        response = await self.get(url, stream=True, **kwargs)
+        try:
+            src_md5 = extract_md5(response.headers)
+            src_size = int(response.headers.get(ws.HTTP_LENGTH, 0))
+            content_disp = get_header_filename(response.headers)
+            if hasattr(dest, 'write'):
+                _, dest_size = await self._save_bytes(
+                    response, src_md5, src_size, dest, process_bytes)
+                return content_disp, src_md5, dest_size
+            final_dest, temp_dest = \
+                ws.BaseDataClient._resolve_destination_file(
+                    dest=dest, src_md5=src_md5,
+                    default_file_name=content_disp)
+            if os.path.isfile(final_dest) and \
+                    src_size == os.stat(final_dest).st_size and \
+                    src_md5 == await _run_blocking(
+                        ws.BaseDataClient.compute_file_md5, final_dest):
+                # nothing to be done
+                self.logger.info(
+                    'Source and destination identical for {}. '
+                    'Skip transfer!'.format(final_dest))
+                return os.path.basename(final_dest), src_md5, src_size
+            try:
+                with open(temp_dest, 'wb') as dest_file:
+                    dest_md5, dest_size = await self._save_bytes(
+                        response, src_md5, src_size, dest_file,
+                        process_bytes)
+            except BaseException:
+                os.remove(temp_dest)
+                raise
+            os.rename(temp_dest, final_dest)
+            ws.BaseDataClient._cache_md5(final_dest, dest_md5)
+            return os.path.basename(final_dest), dest_md5, dest_size
+        finally:
+            await response.aclose()
+
+    async def iter_file(self, url, chunk_size=None, byte_range=None,
+                        **kwargs):
+        """
+        Async iterator over the content of a file (see
+        BaseDataClient.iter_file). The transfer is not resumed after errors.
+        Closing the iterator (aclose) before the end closes the connection
+        without reading the rest of the content.
+        :param url: URL to get the file from
+        :param chunk_size: size of the returned chunks (the last chunk might
+        be smaller). Default is READ_BLOCK_SIZE
+        :param byte_range: (first, last) tuple with the positions of the first
+        and last bytes (inclusive) to return. last can be None for the end of
+        the file. By default, the whole file is returned.
+        :param kwargs: other http attributes
+        :return: async iterator of bytes objects
+        :throws: HttpExceptions when the file cannot be accessed. A
+        TransferException is raised when the transfer is interrupted or,
+        after the last chunk, when the size or the md5 checksum of the
+        received content does not match the source.
+        """
+        httpx = _import_httpx()
+        first, last = byte_range or (0, None)
+        headers = dict(kwargs.pop(ws.HEADERS, None) or {})
+        whole_file = not first and last is None
+        if not whole_file:
+            headers['Range'] = 'bytes={}-{}'.format(
+                first, '' if last is None else last)
+        response = await self.get(url, stream=True, headers=headers,
+                                  **kwargs)
+        try:
+            if not whole_file and \
+                    response.status_code != requests.codes.partial_content:
+                raise exceptions.TransferException(
+                    'Expected partial content for range request {}'.format(
+                        headers['Range']))
+            # the md5 checksum can only be checked for the whole file
+            src_md5 = extract_md5(response.headers) if whole_file else None
+            src_length = int(response.headers.get(ws.HTTP_LENGTH, 0))
+            md5_hash = hashlib.md5()
+            length = 0
+            try:
+                async for chunk in response.aiter_raw(
+                        chunk_size or ws.READ_BLOCK_SIZE):
+                    if src_md5:
+                        md5_hash.update(chunk)
+                    length += len(chunk)
+                    yield chunk
+            except httpx.TransportError as e:
+                raise exceptions.TransferException(
+                    'Transfer interrupted after {} bytes: {}'.format(
+                        length, str(e)), _requests_error(e)) from e
+            if src_length and src_length != length:
+                raise exceptions.TransferException(
+                    'Sizes of source and received content do not match: '
+                    '{} vs {}'.format(src_length, length))
+            if src_md5 and src_md5 != md5_hash.hexdigest():
+                raise exceptions.TransferException(
+                    'Received content is corrupted: expected md5({}) != '
+                    'actual md5({})'.format(src_md5, md5_hash.hexdigest()))
+        finally:
+            await response.aclose()
+
+    async def _save_bytes(self, response, src_md5, src_length, dest,
+                          process_bytes=None):
+        # writes the content of the response to a file-like object (in a
+        # worker thread) and checks it against the source md5 and length.
+        # Returns the md5 checksum and the length of the content
+        httpx = _import_httpx()
+        md5_hash = hashlib.md5()
+        dest_length = 0
+        start = time.time()
+
+        def write(data):
+            md5_hash.update(data)
+            ws._write_all(dest, data)
+
+        try:
+            async for chunk in response.aiter_raw(ws.READ_BLOCK_SIZE):
+                if process_bytes is not None:
+                    process_bytes(chunk)
+                await _run_blocking(write, chunk)
+                dest_length += len(chunk)
+        except httpx.TransportError as e:
+            raise exceptions.TransferException(
+                'Transfer interrupted after {} bytes: {}'.format(
+                    dest_length, str(e)), _requests_error(e)) from e
+        dest_md5 = md5_hash.hexdigest()
+        if src_length and src_length != dest_length:
+            raise exceptions.TransferException(
+                'Sizes of source and received content do not match: '
+                '{} vs {}'.format(src_length, dest_length))
+        if src_md5 and src_md5 != dest_md5:
+            raise exceptions.TransferException(
+                'Received content is corrupted: expected md5({}) != '
+                'actual md5({})'.format(src_md5, dest_md5))
+        duration = time.time() - start
+        self.logger.info(
+            'Successfully received {} bytes in {}s'.format(
+                dest_length, round(duration, 2)))
+        return dest_md5, dest_length
+
+
+class AsyncTransfer(Transfer):
+    """
+    Transfer negotiation with an AsyncRetrySession. Only the negotiations
+    without UWS jobs (e.g. Storage Inventory) are supported.
+    """
+
+    async def transfer(self, endpoint_url, uri, direction, view=None,
+                       cutout=None, security_methods=None):
+        """
+        Coroutine version of Transfer.transfer (with_uws_job=False)
+        :return: list of endpoint URLs
+        """
+        if self.cache is None or view == 'move':
+            return await self._transfer(endpoint_url, uri, direction, view,
+                                        cutout, security_methods)
+        key = self._cache_key(endpoint_url, uri, direction, view, cutout,
+                              security_methods)
+        result = self.cache.get(key)
+        if result is not None:
+            logging.debug('Cached transfer endpoints for {}'.format(uri))
+            return result
+        result = await self._transfer(endpoint_url, uri, direction, view,
+                                      cutout, security_methods)
+        self.cache.put(key, result)
+        return result
+
+    async def _transfer(self, endpoint_url, uri, direction, view, cutout,
+                        security_methods):
+        data = self._transfer_document(uri, direction, view, cutout,
+                                       security_methods)
+        resp = await self.session.post(
+            endpoint_url, content=data, follow_redirects=False,
+            headers={'Content-Type': 'text/xml'})
+        while resp.status_code == 303:
+            resp = await self.session.get(self._redirect_url(resp),
+                                          follow_redirects=False)
+        return self._endpoints(resp.status_code, str(resp.url), resp.content,
+                               uri, view)
@@ -72,8 +72,6 @@ Validation of client X509 certificates before use.
 
 from datetime import datetime, timezone
 
-from OpenSSL import crypto
-
 import logging
 
 __all__ = ['validate_client_certificate']
@@ -92,6 +90,8 @@ def validate_client_certificate(cert_path, warn_days=DEFAULT_WARN_DAYS):
     :raises ValueError: if the file cannot be read, is not valid PEM, or is
         expired
     """
+    # OpenSSL is slow to import and only needed when a certificate is used
+    from OpenSSL import crypto
     try:
         with open(cert_path, 'rb') as cert_file:
             pem_data = cert_file.read()
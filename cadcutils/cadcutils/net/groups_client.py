@@ -82,7 +82,6 @@ from cadcutils.util.cli_errors import format_user_error
 from . import BaseWsClient, Subject, User
 from .auth import SECURITY_METHODS_IDS, CookieInfo
 from . import Role, Group, Identity
-from .group_xml import GroupWriter, GroupReader, GroupsReader
 
 
 CADC_LOGIN_CAPABILITY = 'ivo://ivoa.net/std/UMS#login-0.1'
@@ -186,6 +185,7 @@ class GroupsClient():
         if group is None:
             raise ValueError("Group cannot be None.")
 
+        from .group_xml import GroupWriter  # lxml loaded on demand
         writer = GroupWriter()
         xml_string = writer.write(group)
         self._gms_client.put(self._groups_ep, data=xml_string)
@@ -196,6 +196,7 @@ class GroupsClient():
 
         xml_string = self._gms_client.get('{}/{}'.format(
             self._groups_ep, group_id)).content
+        from .group_xml import GroupReader
         reader = GroupReader()
         group = reader.read(xml_string)
         return group
@@ -207,6 +208,7 @@ class GroupsClient():
         if group is None:
             raise ValueError("Group cannot be None.")
 
+        from .group_xml import GroupWriter
         writer = GroupWriter()
         xml_string = writer.write(group)
         self._gms_client.post('{}/{}'.format(self._groups_ep, group.group_id),
@@ -291,6 +293,7 @@ class GroupsClient():
             params['role'] = role.get_name()
         xml_string = self._gms_client.get(
             self._search_ep, params=params).content
+        from .group_xml import GroupsReader
         reader = GroupsReader()
         groups = reader.read(xml_string, deep_copy=False)
         return groups
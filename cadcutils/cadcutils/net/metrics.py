@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#
+# ***********************************************************************
+
+"""
+Adapters that publish the RequestEvent of the requests sent by the web
+service clients (see ws.add_request_listener) to monitoring systems.
+
+The adapters for Prometheus/OpenMetrics and OpenTelemetry require the
+prometheus_client and opentelemetry-api packages respectively. These are not
+dependencies of cadcutils and are only imported when the adapter is created.
+
+The CADC_REQUEST_METRICS environment variable installs listeners without any
+code change. It is a comma separated list of:
+    log - logs each request as a JSON line with the cadcutils.requests
+          logger at INFO level
+    prometheus[:port] - Prometheus metrics in the default registry, served
+          at http://localhost:port/metrics when a port is specified
+    otel - OpenTelemetry metrics and spans with the global providers
+Example:
+    CADC_REQUEST_METRICS=log,prometheus:9100 cadcput ...
+"""
+
+import json
+import logging
+import time
+
+__all__ = ['LogListener', 'PrometheusListener', 'OpenTelemetryListener']
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the buckets of the request latency histograms (sec)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+                   60, 120)
+
+
+def _status_label(event):
+    if event.status is None:
+        return 'error' if event.error is not None else 'none'
+    return str(event.status)
+
+
+class LogListener(object):
+    """
+    Logs each request as a JSON line
+    """
+
+    def __init__(self, logger_name='cadcutils.requests', level=logging.INFO):
+        """
+        :param logger_name: name of the logger
+        :param level: logging level of the lines
+        """
+        self.logger = logging.getLogger(logger_name)
+        self.level = level
+
+    def __call__(self, event):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        self.logger.log(self.level, json.dumps({
+            'method': event.method,
+            'url': event.url,
+            'host': event.host,
+            'status': event.status,
+            'bytes_sent': event.bytes_sent,
+            'bytes_received': event.bytes_received,
+            'latency': event.latency,
+            'duration': event.duration,
+            'retries': event.retries,
+            'backoff': event.backoff,
+            'server': event.server,
+            'error': None if event.error is None else repr(event.error)}))
+
+
+class PrometheusListener(object):
+    """
+    Prometheus/OpenMetrics adapter. Maintains the following metrics labeled
+    with method and host (and status for the requests):
+        <prefix>_requests_total
+        <prefix>_request_retries_total
+        <prefix>_request_backoff_seconds_total
+        <prefix>_request_latency_seconds (histogram)
+        <prefix>_request_duration_seconds (histogram)
+        <prefix>_request_sent_bytes_total
+        <prefix>_request_received_bytes_total
+    """
+
+    def __init__(self, registry=None, prefix='cadc'):
+        """
+        :param registry: prometheus_client CollectorRegistry to register the
+        metrics with (default is the prometheus_client default registry)
+        :param prefix: prefix of the metric names
+        """
+        import prometheus_client as prom
+        if registry is None:
+            registry = prom.REGISTRY
+        labels = ['method', 'host']
+        self.requests = prom.Counter(
+            prefix + '_requests', 'Requests sent', labels + ['status'],
+            registry=registry)
+        self.retries = prom.Counter(
+            prefix + '_request_retries', 'Retries of the requests', labels,
+            registry=registry)
+        self.backoff = prom.Counter(
+            prefix + '_request_backoff_seconds',
+            'Time slept before the retries', labels, registry=registry)
+        self.latency = prom.Histogram(
+            prefix + '_request_latency_seconds',
+            'Time to the response headers', labels, buckets=LATENCY_BUCKETS,
+            registry=registry)
+        self.duration = prom.Histogram(
+            prefix + '_request_duration_seconds',
+            'Time of the requests including retries and backoff', labels,
+            buckets=LATENCY_BUCKETS, registry=registry)
+        self.sent = prom.Counter(
+            prefix + '_request_sent_bytes', 'Bytes sent in the requests',
+            labels, registry=registry)
+        self.received = prom.Counter(
+            prefix + '_request_received_bytes',
+            'Bytes received in the responses', labels, registry=registry)
+
+    def __call__(self, event):
+        labels = (event.method, event.host)
+        self.requests.labels(*labels, _status_label(event)).inc()
+        if event.retries:
+            self.retries.labels(*labels).inc(event.retries)
+            self.backoff.labels(*labels).inc(event.backoff)
+        if event.latency is not None:
+            self.latency.labels(*labels).observe(event.latency)
+        self.duration.labels(*labels).observe(event.duration)
+        if event.bytes_sent:
+            self.sent.labels(*labels).inc(event.bytes_sent)
+        if event.bytes_received:
+            self.received.labels(*labels).inc(event.bytes_received)
+
+
+class OpenTelemetryListener(object):
+    """
+    OpenTelemetry adapter. Records the requests as metrics (same names as
+    PrometheusListener) and as spans that start when the request was sent
+    and end when it completed.
+    """
+
+    def __init__(self, meter=None, tracer=None, prefix='cadc'):
+        """
+        :param meter: opentelemetry Meter (default is a meter of the global
+        MeterProvider)
+        :param tracer: opentelemetry Tracer (default is a tracer of the
+        global TracerProvider)
+        :param prefix: prefix of the metric names
+        """
+        from opentelemetry import metrics, trace
+        if meter is None:
+            meter = metrics.get_meter(__name__)
+        if tracer is None:
+            tracer = trace.get_tracer(__name__)
+        self.tracer = tracer
+        self._status_error = trace.StatusCode.ERROR
+        self.requests = meter.create_counter(
+            prefix + '_requests', description='Requests sent')
+        self.retries = meter.create_counter(
+            prefix + '_request_retries',
+            description='Retries of the requests')
+        self.backoff = meter.create_counter(
+            prefix + '_request_backoff_seconds', unit='s',
+            description='Time slept before the retries')
+        self.latency = meter.create_histogram(
+            prefix + '_request_latency_seconds', unit='s',
+            description='Time to the response headers')
+        self.duration = meter.create_histogram(
+            prefix + '_request_duration_seconds', unit='s',
+            description='Time of the requests including retries and backoff')
+        self.sent = meter.create_counter(
+            prefix + '_request_sent_bytes', unit='By',
+            description='Bytes sent in the requests')
+        self.received = meter.create_counter(
+            prefix + '_request_received_bytes', unit='By',
+            description='Bytes received in the responses')
+
+    def __call__(self, event):
+        attributes = {'http.request.method': event.method,
+                      'server.address': event.host}
+        self.requests.add(1, dict(attributes,
+                                  **{'http.response.status_code':
+                                     _status_label(event)}))
+        if event.retries:
+            self.retries.add(event.retries, attributes)
+            self.backoff.add(event.backoff, attributes)
+        if event.latency is not None:
+            self.latency.record(event.latency, attributes)
+        self.duration.record(event.duration, attributes)
+        if event.bytes_sent:
+            self.sent.add(event.bytes_sent, attributes)
+        if event.bytes_received:
+            self.received.add(event.bytes_received, attributes)
+
+        end = time.time_ns()
+        span = self.tracer.start_span(
+            '{} {}'.format(event.method, event.host),
+            start_time=end - int(event.duration * 1e9),
+            attributes=dict(attributes, **{
+                'url.full': event.url,
+                'http.response.status_code': event.status or 0,
+                'http.request.body.size': event.bytes_sent,
+                'http.response.body.size': event.bytes_received or 0,
+                'cadc.latency': event.latency or 0,
+                'cadc.retries': event.retries,
+                'cadc.backoff': event.backoff,
+                'cadc.server': event.server or ''}))
+        if event.error is not None:
+            span.record_exception(event.error)
+            span.set_status(self._status_error, str(event.error))
+        span.end(end_time=end)
+
+
+def listeners_from_config(config):
+    """
+    Creates the listeners listed in a configuration string (see the format
+    of the CADC_REQUEST_METRICS environment variable above)
+    :param config: comma separated list of listeners
+    :return: list of listeners
+    """
+    listeners = []
+    for item in config.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, arg = item.partition(':')
+        if name == 'log':
+            listeners.append(LogListener())
+        elif name == 'prometheus':
+            listeners.append(PrometheusListener())
+            if arg:
+                import prometheus_client
+                prometheus_client.start_http_server(int(arg))
+        elif name == 'otel':
+            listeners.append(OpenTelemetryListener())
+        else:
+            raise ValueError('Unknown request metrics listener: ' + item)
+    return listeners
@@ -75,10 +75,28 @@ import sys
 import errno
 import time
 import base64
+import hashlib
+import os
+import threading
+import json
+import atexit
+from urllib.parse import urlparse
+
+from cadcutils.util.utils import _write_file_atomically
 
 logger = logging.getLogger(__name__)
 
-__all__ = ['get_header_filename', 'extract_md5', 'add_md5_header', 'Transfer']
+__all__ = ['get_header_filename', 'extract_md5', 'add_md5_header', 'Transfer',
+           'TransferCache', 'get_transfer_cache', 'EndpointRanker',
+           'get_endpoint_ranker']
+
+# Time (sec) that negotiated transfer endpoints are reused for. Caching
+# is not enabled when 0.
+TRANSFER_CACHE_TTL_ENV = 'CADC_TRANSFER_CACHE_TTL'
+
+# Ranking of the transfer endpoints: 1 to rank them by their performance in
+# the process or name of the file that keeps it across processes
+ENDPOINT_RANKING_ENV = 'CADC_ENDPOINT_RANKING'
 
 
 VO_VIEW_DEFAULT = 'ivo://ivoa.net/vospace/core#defaultview'
@@ -147,6 +165,258 @@ def add_md5_header(headers, md5_checksum):
         base64.b64encode(bytes.fromhex(md5_checksum)).decode('ascii'))
 
 
+class TransferCache(object):
+    """
+    Cache of the endpoints negotiated with a transfer service. Entries expire
+    after a time to live. Since pre-authorized URLs are only valid for a
+    limited time, the time to live should be short (minutes).
+    """
+
+    def __init__(self, ttl):
+        """
+        :param ttl: time (sec) to live of the entries
+        """
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the endpoints of a negotiation or None when not cached or
+        expired
+        :param key: key of the negotiation
+        :return: list of endpoint URLs
+        """
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            return list(entry[1])
+
+    def put(self, key, urls):
+        """
+        Caches the endpoints of a negotiation
+        :param key: key of the negotiation
+        :param urls: list of endpoint URLs
+        """
+        if not urls:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, tuple(urls))
+
+    def invalidate(self, uri):
+        """
+        Invalidates the negotiations of a file, typically after the file was
+        removed or replaced.
+        :param uri: URI of the file. Keys start with the URI
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == uri]:
+                del self._entries[key]
+
+    def discard(self, url):
+        """
+        Invalidates the negotiations that returned an endpoint, typically
+        after the endpoint failed.
+        :param url: endpoint URL
+        """
+        with self._lock:
+            for key in [key for key, entry in self._entries.items()
+                        if url in entry[1]]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def get_transfer_cache():
+    """
+    Returns the transfer cache of the process or None when the cache is not
+    enabled (CADC_TRANSFER_CACHE_TTL environment variable)
+    """
+    ttl = os.getenv(TRANSFER_CACHE_TTL_ENV, None)
+    if not ttl or float(ttl) <= 0:
+        return None
+    ttl = float(ttl)
+    with get_transfer_cache.lock:
+        if ttl not in get_transfer_cache.caches:
+            get_transfer_cache.caches[ttl] = TransferCache(ttl)
+        return get_transfer_cache.caches[ttl]
+
+
+get_transfer_cache.caches = {}  # caches by ttl
+get_transfer_cache.lock = threading.Lock()
+
+
+class EndpointRanker(object):
+    """
+    Ranks equivalent endpoints (e.g. the sites that hold copies of a file)
+    by the performance of their hosts. The success rate and the throughput
+    of the transfers with each host are tracked as exponentially weighted
+    moving averages. Hosts that failed recently are tried last.
+    """
+
+    ALPHA = 0.3  # weight of the last transfer in the averages
+    FAILURE_BACKOFF = 300  # sec that a host is tried last after a failure
+    MAX_AGE = 7 * 24 * 3600  # sec after which the stats of a host expire
+    SAVE_INTERVAL = 10  # min sec between saves of the stats
+
+    def __init__(self, location=None):
+        """
+        :param location: JSON file to keep the stats in between processes.
+        The stats are kept in memory only when None
+        """
+        self.location = location
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._last_save = time.time()
+        self._dirty = False
+        if location:
+            location = os.path.expanduser(location)
+            self.location = location
+            if os.path.isfile(location):
+                with open(location) as f:
+                    hosts = json.load(f)
+                now = time.time()
+                self._hosts = {host: stats for host, stats in hosts.items()
+                               if now - stats.get('updated', 0) < self.MAX_AGE}
+            atexit.register(self.save)
+
+    def record_success(self, url, size=None, duration=None):
+        """
+        Records a successful transfer
+        :param url: URL of the endpoint
+        :param size: number of bytes transferred if known
+        :param duration: duration (sec) of the transfer if known
+        """
+        with self._lock:
+            stats = self._get_stats(url)
+            stats['success'] = self._average(stats.get('success'), 1.0)
+            if size and duration:
+                stats['throughput'] = self._average(stats.get('throughput'),
+                                                    size / duration)
+        self._save_periodically()
+
+    def record_failure(self, url):
+        """
+        Records a failed transfer
+        :param url: URL of the endpoint
+        """
+        with self._lock:
+            stats = self._get_stats(url)
+            stats['success'] = self._average(stats.get('success'), 0.0)
+            stats['last_failure'] = stats['updated']
+        self._save_periodically()
+
+    def rank(self, urls):
+        """
+        Orders endpoints by the expected performance of their hosts: those
+        that did not fail recently first, in the decreasing order of their
+        success rate times throughput. Hosts without stats are ranked as
+        average ones and ties keep the original order.
+        :param urls: list of endpoint URLs
+        :return: ranked list of endpoint URLs
+        """
+        now = time.time()
+        with self._lock:
+            stats = [self._hosts.get(urlparse(url).netloc, None)
+                     for url in urls]
+        scores = [self._score(s) for s in stats if s is not None]
+        default_score = sum(scores) / len(scores) if scores else 0
+
+        def key(index):
+            host_stats = stats[index]
+            if host_stats is None:
+                return 0, -default_score, index
+            failed = now - host_stats.get('last_failure', 0) < \
+                self.FAILURE_BACKOFF
+            return int(failed), -self._score(host_stats), index
+
+        return [urls[i] for i in sorted(range(len(urls)), key=key)]
+
+    def save(self):
+        """
+        Saves the stats to the location file (if any)
+        """
+        if not self.location:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            content = json.dumps(self._hosts)
+            self._dirty = False
+            self._last_save = time.time()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.location)),
+                        exist_ok=True)
+            _write_file_atomically(self.location, content)
+        except Exception as e:
+            logger.debug('Cannot save endpoint stats to {}: {}'.format(
+                self.location, str(e)))
+
+    def _get_stats(self, url):
+        stats = self._hosts.setdefault(urlparse(url).netloc, {})
+        stats['updated'] = time.time()
+        self._dirty = True
+        return stats
+
+    def _average(self, average, value):
+        if average is None:
+            return value
+        return self.ALPHA * value + (1 - self.ALPHA) * average
+
+    @staticmethod
+    def _score(stats):
+        # hosts without throughput measurements rank by success rate only
+        return stats.get('success', 1.0) * stats.get('throughput', 1.0)
+
+    def _save_periodically(self):
+        if self.location and \
+                time.time() - self._last_save > self.SAVE_INTERVAL:
+            self.save()
+
+
+def get_endpoint_ranker():
+    """
+    Returns the endpoint ranker of the process or None when the ranking is
+    not enabled (CADC_ENDPOINT_RANKING environment variable)
+    """
+    location = os.getenv(ENDPOINT_RANKING_ENV, None)
+    if not location or location.lower() in ['0', 'false', 'no']:
+        return None
+    if location.lower() in ['1', 'true', 'yes']:
+        location = None
+    with get_endpoint_ranker.lock:
+        if location not in get_endpoint_ranker.rankers:
+            try:
+                get_endpoint_ranker.rankers[location] = \
+                    EndpointRanker(location)
+            except Exception as e:
+                logger.warning(
+                    'Cannot use endpoint stats {}: {}'.format(location,
+                                                              str(e)))
+                get_endpoint_ranker.rankers[location] = EndpointRanker()
+        return get_endpoint_ranker.rankers[location]
+
+
+get_endpoint_ranker.rankers = {}  # rankers by location
+get_endpoint_ranker.lock = threading.Lock()
+
+
+def _session_identity(session):
+    # digest of the credentials of a session. Negotiated endpoints might be
+    # specific to the identity of the user
+    credentials = [repr(session.cert), repr(session.auth),
+                   session.headers.get('Authorization', '')]
+    credentials.extend(sorted('{}:{}={}'.format(c.domain, c.name, c.value)
+                              for c in session.cookies))
+    return hashlib.sha1('\n'.join(credentials).encode('utf-8')).hexdigest()
+
+
 class Transfer(object):
     IVOAURL = 'ivo://ivoa.net/vospace/core'
     VOSNS = 'http://www.ivoa.net/xml/VOSpace/v2.0'
@@ -169,12 +439,15 @@ class Transfer(object):
     DIRECTION_PULL_FROM = "pullFromVoSpace"
     DIRECTION_PUSH_TO = "pushToVoSpace"
 
-    def __init__(self, session):
+    def __init__(self, session, cache=None):
         """
         Handle transfer related business.  This is here to be reused as needed.
         :param session : requests session to use to communicate with the server
+        :param cache : TransferCache with the endpoints of previous
+        negotiations
         """
         self.session = session
+        self.cache = cache
 
     def transfer(self, endpoint_url, uri, direction, view=None, cutout=None,
                  security_methods=None, with_uws_job=True):
@@ -200,6 +473,54 @@ class Transfer(object):
         HttpException exceptions declared in the
         cadcutils.exceptions module
         """
+        if self.cache is None or view == 'move':
+            return self._transfer(endpoint_url, uri, direction, view, cutout,
+                                  security_methods, with_uws_job)
+        key = self._cache_key(endpoint_url, uri, direction, view, cutout,
+                              security_methods)
+        result = self.cache.get(key)
+        if result is not None:
+            logger.debug('Cached transfer endpoints for {}'.format(uri))
+            return result
+        result = self._transfer(endpoint_url, uri, direction, view, cutout,
+                                security_methods, with_uws_job)
+        self.cache.put(key, result)
+        return result
+
+    def _cache_key(self, endpoint_url, uri, direction, view, cutout,
+                   security_methods):
+        # cutout is only part of the negotiation of the cutout view
+        return (uri, endpoint_url, direction, view,
+                repr(cutout) if view == 'cutout' else None,
+                repr(security_methods), _session_identity(self.session))
+
+    def _transfer(self, endpoint_url, uri, direction, view, cutout,
+                  security_methods, with_uws_job):
+        data = self._transfer_document(uri, direction, view, cutout,
+                                       security_methods)
+        logging.debug("Sending to : {}".format(endpoint_url))
+        resp = self.session.post(
+            endpoint_url, data=data, allow_redirects=False,
+            headers={'Content-Type': 'text/xml'})
+
+        logging.debug("{0}".format(resp))
+        logging.debug("{0}".format(resp.content))
+        while resp.status_code == 303:
+            # for get or put we need the protocol value
+            resp = self.session.get(self._redirect_url(resp),
+                                    allow_redirects=False)
+        transfer_url = str(resp.url)
+        if resp.status_code == 200 and view != 'move' and with_uws_job:
+            # check the status of the job first
+            self.check_job_error(
+                str.replace(transfer_url, 'xfer', 'transfers'),
+                str(uri), True)
+        return self._endpoints(resp.status_code, transfer_url, resp.content,
+                               uri, view)
+
+    def _transfer_document(self, uri, direction, view, cutout,
+                           security_methods):
+        # the transfer XML document of a negotiation
         protocol = {
             Transfer.DIRECTION_PULL_FROM: "httpsget",
             Transfer.DIRECTION_PUSH_TO: "httpsput"}
@@ -247,36 +568,26 @@ class Transfer(object):
                     Transfer.IVOAURL, protocol[direction])
 
         logging.debug(ElementTree.tostring(transfer_xml))
-        logging.debug("Sending to : {}".format(endpoint_url))
+        return ElementTree.tostring(transfer_xml)
 
-        data = ElementTree.tostring(transfer_xml)
-        resp = self.session.post(
-            endpoint_url, data=data, allow_redirects=False,
-            headers={'Content-Type': 'text/xml'})
+    def _redirect_url(self, resp):
+        # URL of the job that a negotiation is redirected to
+        goto_url = resp.headers.get('Location', None)
 
-        logging.debug("{0}".format(resp))
-        logging.debug("{0}".format(resp.content))
-        while resp.status_code == 303:
-            goto_url = resp.headers.get('Location', None)
+        if self.session.auth is not None and \
+                "auth" not in goto_url:
+            goto_url = goto_url.replace('/vospace/', '/vospace/auth/')
 
-            if self.session.auth is not None and \
-                    "auth" not in goto_url:
-                goto_url = goto_url.replace('/vospace/', '/vospace/auth/')
+        logging.debug(
+            'Got back from transfer URL: {}'.format(goto_url))
+        return goto_url
 
-            logging.debug(
-                'Got back from transfer URL: {}'.format(goto_url))
-            # for get or put we need the protocol value
-            resp = self.session.get(goto_url, allow_redirects=False)
-        if resp.status_code == 200:
-            transfer_url = str(resp.url)
+    @staticmethod
+    def _endpoints(status_code, transfer_url, xml_string, uri, view):
+        # the endpoints in the transfer document returned by a negotiation
+        if status_code == 200:
             if view == 'move':
                 return transfer_url
-            if with_uws_job:
-                # check the status of the job first
-                self.check_job_error(
-                    str.replace(transfer_url, 'xfer', 'transfers'),
-                    str(uri), True)
-            xml_string = resp.content
             logging.debug('Transfer Document:{}'.format(xml_string))
             transfer_document = ElementTree.fromstring(xml_string)
             logging.debug(
@@ -287,11 +598,11 @@ class Transfer(object):
                 raise RuntimeError(
                     "BUG: No protocol/endpoint returned for transfer URL {}".
                     format(transfer_url))
-        elif resp.status_code == 404:
-            raise OSError(resp.status_code,
+        elif status_code == 404:
+            raise OSError(status_code,
                           "File not found: {0}".format(uri))
         else:
-            raise OSError(resp.status_code,
+            raise OSError(status_code,
                           "Failed to get transfer service response.")
 
         result = []
@@ -182,5 +182,6 @@ def connection_error_to_exception(connection_error, url=None, cert=None):
             orig_exception=connection_error)
     if 'Connection reset by peer' in str(connection_error):
         return exceptions.TransferException(
-            'Transfer error on URL: {}'.format(url or ''))
+            'Transfer error on URL: {}'.format(url or ''),
+            orig_exception=connection_error)
     return exceptions.HttpException(orig_exception=connection_error)
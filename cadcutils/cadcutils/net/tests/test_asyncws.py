@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2023.                            (c) 2023.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#
+# ***********************************************************************
+
+
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+
+import httpx
+import pytest
+import requests
+
+from cadcutils import exceptions
+from cadcutils.net import auth, ws, AsyncRetrySession, AsyncBaseWsClient, \
+    AsyncBaseDataClient, BackoffPolicy
+from cadcutils.net.netutils import add_md5_header
+
+SERVICE_URL = 'https://some.url/service'
+FILE_URL = 'https://some.url/service/file'
+
+
+class _Stream(httpx.AsyncByteStream):
+    # streamed content of the responses
+
+    def __init__(self, content):
+        self.content = content
+
+    async def __aiter__(self):
+        for i in range(0, len(self.content), 256):
+            yield self.content[i:i + 256]
+
+
+def _policy():
+    return BackoffPolicy(start_delay=0.01, max_retries=3)
+
+
+def test_async_session_retries():
+    statuses = [503, 503, 200]
+    requests_sent = []
+
+    def handler(request):
+        requests_sent.append(request)
+        return httpx.Response(statuses.pop(0), content=b'abc',
+                              headers={'Retry-After': '0'})
+
+    events = []
+    session = AsyncRetrySession(retry_policy=_policy(),
+                                headers={'User-Agent': 'TestApp'},
+                                transport=httpx.MockTransport(handler))
+    session.listeners.append(events.append)
+    session.token = 'sometoken'
+
+    async def calls():
+        async with session._client:
+            return await session.get(FILE_URL, params={'a': 1})
+
+    response = asyncio.run(calls())
+    assert 200 == response.status_code
+    assert b'abc' == response.content
+    assert 3 == len(requests_sent)
+    assert 'https://some.url/service/file?a=1' == str(requests_sent[0].url)
+    assert 'Bearer sometoken' == requests_sent[0].headers['Authorization']
+    assert 'TestApp' == requests_sent[0].headers['User-Agent']
+    assert 'sometoken' == session.token
+    assert 1 == len(events)
+    assert 'GET' == events[0].method
+    assert 200 == events[0].status
+    assert 2 == events[0].retries
+    assert events[0].error is None
+
+
+def test_async_session_errors():
+    def handler(request):
+        if request.url.path.endswith('missing'):
+            return httpx.Response(404, text='Not found')
+        elif request.url.path.endswith('busy'):
+            return httpx.Response(503)
+        elif request.url.path.endswith('down'):
+            raise httpx.ConnectError('Connection refused', request=request)
+        return httpx.Response(200)
+
+    events = []
+    session = AsyncRetrySession(retry_policy=_policy(),
+                                transport=httpx.MockTransport(handler))
+    session.listeners.append(events.append)
+
+    async def call(url, method='GET'):
+        return await session.request(method, url)
+
+    with pytest.raises(exceptions.NotFoundException) as e:
+        asyncio.run(call('https://some.url/missing'))
+    assert isinstance(e.value.orig_exception, requests.HTTPError)
+    assert 404 == e.value.orig_exception.response.status_code
+    assert 'Not found' == e.value.orig_exception.response.text
+    assert isinstance(events[-1].error, exceptions.NotFoundException)
+
+    # transient errors retried
+    with pytest.raises(exceptions.HttpException) as e:
+        asyncio.run(call('https://some.url/busy'))
+    assert 503 == e.value.msg.response.status_code
+    assert 3 == events[-1].retries
+
+    # POSTs are not retried
+    with pytest.raises(exceptions.UnexpectedException):
+        asyncio.run(call('https://some.url/busy', 'POST'))
+    assert 0 == events[-1].retries
+
+    # transport errors are the corresponding requests errors
+    with pytest.raises(exceptions.HttpException) as e:
+        asyncio.run(call('https://some.url/down'))
+    assert isinstance(e.value.orig_exception, requests.ConnectionError)
+    assert isinstance(e.value.orig_exception.__cause__, httpx.ConnectError)
+
+
+def test_async_session_circuit_breaker():
+    def handler(request):
+        return httpx.Response(503)
+
+    breaker = ws.CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    session = AsyncRetrySession(retry_policy=_policy(),
+                                circuit_breaker=breaker,
+                                transport=httpx.MockTransport(handler))
+
+    async def call():
+        return await session.get(FILE_URL)
+
+    with pytest.raises(exceptions.HttpException):
+        asyncio.run(call())
+    # host failed: following requests fail fast
+    with pytest.raises(exceptions.CircuitOpenException):
+        asyncio.run(call())
+
+
+def test_async_client():
+    requests_sent = []
+
+    def handler(request):
+        requests_sent.append(request)
+        return httpx.Response(200, content=request.content)
+
+    subject = auth.Subject()
+    subject.cookies.append(auth.CookieInfo('some.url', 'CADC_SSO', 'val'))
+    client = AsyncBaseWsClient(SERVICE_URL, subject, 'TestApp',
+                               session_headers={'X-Test': 'yes'},
+                               transport=httpx.MockTransport(handler))
+    assert client.package_info.startswith('cadcutils/')
+    assert 'httpx/{}'.format(httpx.__version__) in client.package_info
+
+    async def calls():
+        async with client:
+            responses = await asyncio.gather(
+                client.get(FILE_URL, params={'a': 1}),
+                client.put(FILE_URL, content=b'abc'),
+                client.post(FILE_URL, content=b'def'),
+                client.head(FILE_URL),
+                client.delete(FILE_URL))
+            return responses
+
+    responses = asyncio.run(calls())
+    assert [b'', b'abc', b'def', b'', b''] == \
+        [r.content for r in responses]
+    assert ['GET', 'PUT', 'POST', 'HEAD', 'DELETE'] == \
+        [r.method for r in requests_sent]
+    for request in requests_sent:
+        assert request.headers['User-Agent'].startswith('TestApp cadcutils/')
+        assert 'yes' == request.headers['X-Test']
+        assert 'CADC_SSO=val' == request.headers['Cookie']
+    assert client._session._client.is_closed
+
+
+def test_async_client_create():
+    async def create():
+        return await AsyncBaseDataClient.create(
+            SERVICE_URL, auth.Subject(), 'TestApp', pool_maxsize=2)
+
+    client = asyncio.run(create())
+    assert isinstance(client, AsyncBaseDataClient)
+    assert 2 == client.pool_maxsize
+
+
+def test_async_data_client():
+    content = os.urandom(1000)
+    content_md5 = hashlib.md5(content).hexdigest()
+    files = {}
+    ops = []
+
+    def handler(request):
+        ops.append((request.method, request.headers.get(ws.PUT_TXN_OP)))
+        if request.method == 'HEAD':
+            return httpx.Response(404)
+        elif request.method == 'PUT':
+            if ws.PUT_TXN_OP in request.headers and \
+                    request.headers[ws.PUT_TXN_OP] == ws.PUT_TXN_COMMIT:
+                return httpx.Response(200)
+            files[request.url.path] = request.content
+            assert str(len(content)) == request.headers['Content-Length']
+            headers = {}
+            add_md5_header(headers, hashlib.md5(request.content).hexdigest())
+            if ws.PUT_TXN_OP in request.headers:
+                headers[ws.PUT_TXN_ID] = '123'
+            return httpx.Response(201, headers=headers)
+        data = files[request.url.path]
+        headers = {'Content-Disposition': 'inline; filename=file.fits'}
+        add_md5_header(headers, hashlib.md5(data).hexdigest())
+        return httpx.Response(200, stream=_Stream(data), headers=headers)
+
+    client = AsyncBaseDataClient(SERVICE_URL, auth.Subject(), 'TestApp',
+                                 transport=httpx.MockTransport(handler))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src = os.path.join(tmp_dir, 'src.fits')
+        with open(src, 'wb') as f:
+            f.write(content)
+        received = []
+
+        async def calls():
+            async with client:
+                upload = await client.upload_file(FILE_URL, src)
+                download = await client.download_file(
+                    FILE_URL, dest=tmp_dir, process_bytes=received.append)
+                buffer = io.BytesIO()
+                stream = await client.download_file(FILE_URL, dest=buffer)
+                chunks = [chunk async for chunk in
+                          client.iter_file(FILE_URL, chunk_size=300)]
+                return upload, download, buffer, stream, chunks
+
+        upload, download, buffer, stream, chunks = asyncio.run(calls())
+        assert ('file', content_md5, len(content)) == upload
+        assert ('file.fits', content_md5, len(content)) == download
+        with open(os.path.join(tmp_dir, 'file.fits'), 'rb') as f:
+            assert content == f.read()
+        assert content == b''.join(received)
+        assert content == buffer.getvalue()
+        assert ('file.fits', content_md5, len(content)) == stream
+        assert content == b''.join(chunks)
+        assert [300, 300, 300, 100] == [len(c) for c in chunks]
+    # small file: md5 computed and sent with the file, no transaction
+    assert ('PUT', None) == ops[1]
+    assert ('HEAD', None) == ops[0]
+
+    with pytest.raises(ValueError):
+        asyncio.run(client.upload_file(FILE_URL, os.devnull))
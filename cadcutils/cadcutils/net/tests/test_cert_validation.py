@@ -136,7 +136,7 @@ class TestCertValidation(unittest.TestCase):
         logger_mock.warning.assert_called_once()
         self.assertIn('expires in', logger_mock.warning.call_args[0][0])
 
-    @patch('cadcutils.net.cert_validation.crypto.load_certificate')
+    @patch('OpenSSL.crypto.load_certificate')
     def test_no_expiry_date(self, load_mock):
         cert = MagicMock()
         cert.get_notAfter.return_value = None
@@ -69,9 +69,12 @@ import pytest
 from unittest.mock import patch, Mock, MagicMock, call
 from requests.utils import CaseInsensitiveDict
 import base64
+import time
+import requests
 
 from cadcutils.net import get_header_filename, extract_md5, Transfer, \
-    add_md5_header
+    add_md5_header, TransferCache, get_transfer_cache, EndpointRanker, \
+    get_endpoint_ranker
 
 
 def test_get_header_filename():
@@ -207,3 +210,149 @@ def test_transfer():
             'https://some.host/service', 'vos://abc',
             'pullFromVoSpace')
         assert 'Failed to get transfer service response.' == str(e)
+
+
+def test_transfer_cache():
+    cache = TransferCache(ttl=60)
+    assert cache.get(('cadc:TEST/abc', 'pull')) is None
+    cache.put(('cadc:TEST/abc', 'pull'), ['https://a/abc', 'https://b/abc'])
+    cache.put(('cadc:TEST/abc', 'push'), ['https://a/abc'])
+    cache.put(('cadc:TEST/def', 'pull'), ['https://b/def'])
+    cache.put(('cadc:TEST/ghi', 'pull'), [])  # nothing to cache
+    urls = cache.get(('cadc:TEST/abc', 'pull'))
+    assert ['https://a/abc', 'https://b/abc'] == urls
+    urls.append('https://c/abc')  # callers get copies
+    assert ['https://a/abc', 'https://b/abc'] == \
+        cache.get(('cadc:TEST/abc', 'pull'))
+    assert cache.get(('cadc:TEST/ghi', 'pull')) is None
+
+    # failed endpoint
+    cache.discard('https://b/abc')
+    assert cache.get(('cadc:TEST/abc', 'pull')) is None
+    assert ['https://a/abc'] == cache.get(('cadc:TEST/abc', 'push'))
+    # changed file
+    cache.invalidate('cadc:TEST/abc')
+    assert cache.get(('cadc:TEST/abc', 'push')) is None
+    assert ['https://b/def'] == cache.get(('cadc:TEST/def', 'pull'))
+    # expired
+    with patch('cadcutils.net.netutils.time.time',
+               Mock(return_value=time.time() + 61)):
+        assert cache.get(('cadc:TEST/def', 'pull')) is None
+    cache.put(('cadc:TEST/def', 'pull'), ['https://b/def'])
+    cache.clear()
+    assert cache.get(('cadc:TEST/def', 'pull')) is None
+
+    with patch.dict('os.environ', {'CADC_TRANSFER_CACHE_TTL': '0'}):
+        assert get_transfer_cache() is None
+    with patch.dict('os.environ', {'CADC_TRANSFER_CACHE_TTL': '30'}):
+        cache = get_transfer_cache()
+        assert 30 == cache.ttl
+        assert cache is get_transfer_cache()
+
+
+def test_transfer_with_cache():
+    session = requests.Session()
+    session.cert = ('cert.pem', 'cert.pem')
+    session.post = Mock()
+    session.get = Mock()
+    response = Mock()
+    response.status_code = 200
+    response.content = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<vos:transfer xmlns:vos="http://www.ivoa.net/xml/VOSpace/v2.0" '
+        'version="2.1">'
+        '<vos:target>cadc:TEST/abc</vos:target>'
+        '<vos:direction>pullFromVoSpace</vos:direction>'
+        '<vos:protocol uri="ivo://ivoa.net/vospace/core#httpsget">'
+        '<vos:endpoint>https://transfer.host/transfer/abc</vos:endpoint>'
+        '</vos:protocol>'
+        '</vos:transfer>')
+    session.post.return_value = response
+    cache = TransferCache(ttl=60)
+    transfer = Transfer(session=session, cache=cache)
+    for _ in range(3):
+        assert ['https://transfer.host/transfer/abc'] == transfer.transfer(
+            'https://some.host/service', 'cadc:TEST/abc', 'pullFromVoSpace',
+            with_uws_job=False)
+    assert 1 == session.post.call_count
+
+    # different direction or cutout view negotiated separately
+    transfer.transfer('https://some.host/service', 'cadc:TEST/abc',
+                      'pushToVoSpace', with_uws_job=False)
+    transfer.transfer('https://some.host/service', 'cadc:TEST/abc',
+                      'pullFromVoSpace', view='cutout', cutout='[1]',
+                      with_uws_job=False)
+    assert 3 == session.post.call_count
+    # cutout is ignored without the cutout view
+    transfer.transfer('https://some.host/service', 'cadc:TEST/abc',
+                      'pullFromVoSpace', cutout={'SUB': '[1]'},
+                      with_uws_job=False)
+    assert 3 == session.post.call_count
+
+    # so is a different identity
+    session.cert = ('other_cert.pem', 'other_cert.pem')
+    transfer.transfer('https://some.host/service', 'cadc:TEST/abc',
+                      'pullFromVoSpace', with_uws_job=False)
+    assert 4 == session.post.call_count
+    session.cert = None
+    session.cookies.set('CADC_SSO', 'value', domain='cadc.ca')
+    transfer.transfer('https://some.host/service', 'cadc:TEST/abc',
+                      'pullFromVoSpace', with_uws_job=False)
+    assert 5 == session.post.call_count
+    transfer.transfer('https://some.host/service', 'cadc:TEST/abc',
+                      'pullFromVoSpace', with_uws_job=False)
+    assert 5 == session.post.call_count
+
+    # renegotiated after the endpoint failed
+    cache.discard('https://transfer.host/transfer/abc')
+    transfer.transfer('https://some.host/service', 'cadc:TEST/abc',
+                      'pullFromVoSpace', with_uws_job=False)
+    assert 6 == session.post.call_count
+
+
+def test_endpoint_ranker(tmp_path):
+    urls = ['https://site1/file', 'https://site2/file', 'https://site3/file']
+    ranker = EndpointRanker()
+    assert urls == ranker.rank(urls)  # no stats
+    ranker.record_success('https://site2/other', 10000, 1)
+    ranker.record_success('https://site3/file', 1000, 1)
+    # fastest host first, unknown host ranked as average
+    assert ['https://site2/file', 'https://site1/file',
+            'https://site3/file'] == ranker.rank(urls)
+    # hosts that failed recently are tried last
+    ranker.record_failure('https://site2/file')
+    assert ['https://site1/file', 'https://site3/file',
+            'https://site2/file'] == ranker.rank(urls)
+    with patch('cadcutils.net.netutils.time.time',
+               Mock(return_value=time.time() +
+                    EndpointRanker.FAILURE_BACKOFF + 1)):
+        # ranked by success rate times throughput after the backoff
+        assert 'https://site2/file' == ranker.rank(urls)[0]
+    # unreliable hosts rank lower
+    for _ in range(10):
+        ranker.record_failure('https://site2/file')
+    with patch('cadcutils.net.netutils.time.time',
+               Mock(return_value=time.time() +
+                    EndpointRanker.FAILURE_BACKOFF + 1)):
+        assert 'https://site2/file' == ranker.rank(urls)[-1]
+
+    # stats kept between processes
+    location = str(tmp_path / 'stats' / 'endpoints.json')
+    ranker = EndpointRanker(location)
+    ranker.record_success('https://site1/file', 100, 1)
+    ranker.record_success('https://site3/file', 1000, 1)
+    ranker.save()
+    ranker = EndpointRanker(location)
+    assert 'https://site3/file' == ranker.rank(urls)[0]
+    ranker.record_failure('https://site3/file')
+    ranker.save()
+    assert 'https://site3/file' == EndpointRanker(location).rank(urls)[-1]
+
+    with patch.dict('os.environ', {'CADC_ENDPOINT_RANKING': 'no'}):
+        assert get_endpoint_ranker() is None
+    with patch.dict('os.environ', {'CADC_ENDPOINT_RANKING': '1'}):
+        ranker = get_endpoint_ranker()
+        assert ranker.location is None
+        assert ranker is get_endpoint_ranker()
+    with patch.dict('os.environ', {'CADC_ENDPOINT_RANKING': location}):
+        assert location == get_endpoint_ranker().location
@@ -65,7 +65,13 @@
 #
 # ***********************************************************************
 
+import concurrent.futures
+import datetime
+import io
+import json
 import os
+import threading
+import time
 import unittest
 
 import requests
@@ -78,10 +84,11 @@ import hashlib
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 
 from cadcutils import exceptions
-from cadcutils import net
-from cadcutils.net import ws, auth
+from cadcutils import net, util
+from cadcutils.net import ws, auth, metrics
 from cadcutils.net.ws import DEFAULT_RETRY_DELAY, MAX_RETRY_DELAY, \
     MAX_NUM_RETRIES, SERVICE_RETRY, _check_server_version
+from cadcutils.util.tests.import_helpers import assert_lazy_imports
 
 # The following is a temporary workaround for Python issue
 # 25532 (https://bugs.python.org/issue25532)
@@ -417,7 +424,7 @@ class TestListResources(unittest.TestCase):
         self.assertEqual('cookievalue',
                          client._session.cookies['MyTestCookie'])
 
-    @patch('cadcutils.net.ws.util.Md5File')
+    @patch('cadcutils.net.ws.util.Md5MappedFile')
     @patch('cadcutils.net.ws.WsCapabilities')
     def test_upload_file_no_put_txn(self, caps_mock, md5_file_mock):
         anon_subject = auth.Subject()
@@ -534,7 +541,7 @@ class TestListResources(unittest.TestCase):
             client.upload_file(url=target_url, src=src.name,
                                md5_checksum=content_md5)
 
-    @patch('cadcutils.net.ws.util.Md5File')
+    @patch('cadcutils.net.ws.util.Md5MappedFile')
     @patch('cadcutils.net.ws.WsCapabilities')
     def test_upload_file_put_txn(self, caps_mock, md5_file_mock):
         anon_subject = auth.Subject()
@@ -743,7 +750,8 @@ class TestListResources(unittest.TestCase):
                     assert headers[ws.PUT_TXN_TOTAL_LENGTH] == str(file_size)
                     assert headers[CONTENT_TYPE] == TEXT_TYPE
                 if data:
-                    data.read(100)
+                    for block in data:
+                        pass
                 rsp = put_responses[put_mock.put_num]
                 put_mock.put_num += 1
                 return rsp
@@ -814,6 +822,268 @@ class TestListResources(unittest.TestCase):
             ws.MAX_MD5_COMPUTE_SIZE = orig_max_md5_compute_size
             ws.PUT_TXN_MAX_SEGMENT = orig_max_file_segment_size
 
+    @patch('cadcutils.net.ws.WsCapabilities')
+    def test_upload_file_put_txn_parallel(self, caps_mock):
+        anon_subject = auth.Subject()
+        target_url = 'https://someurl/path/file'
+        cm = Mock()
+        cm.get_access_url.return_value = "http://host/availability"
+        caps_mock.return_value = cm
+        client = ws.BaseDataClient(resource_id='ivo://cadc.nrc.ca/resourceid',
+                                   subject=anon_subject, agent='TestApp')
+        session = Mock()
+        client._get_session = Mock(return_value=session)
+
+        orig_max_md5_compute_size = ws.MAX_MD5_COMPUTE_SIZE
+        orig_max_file_segment_size = ws.FILE_SEGMENT_THRESHOLD
+        try:
+            ws.MAX_MD5_COMPUTE_SIZE = 5  # force transaction
+            ws.FILE_SEGMENT_THRESHOLD = 10  # force segments
+            content = b'segment1segment2end3'
+            src = tempfile.NamedTemporaryFile()
+            with open(src.name, 'wb') as f:
+                f.write(content)
+            start_txn_headers = {ws.PUT_TXN_ID: '123',
+                                 ws.PUT_TXN_MIN_SEGMENT: '1',
+                                 ws.PUT_TXN_MAX_SEGMENT: '8'}
+            received = {}
+            sequential = []
+
+            def put_mock(url, data=None, **kwargs):
+                headers = kwargs['headers']
+                assert url == target_url
+                if ws.PUT_TXN_OP in headers:
+                    assert headers[ws.HTTP_LENGTH] == '0'
+                    return Mock(headers=start_txn_headers)
+                assert headers[ws.PUT_TXN_ID] == '123'
+                assert headers[CONTENT_TYPE] == TEXT_TYPE
+                if ws.HTTP_CONTENT_RANGE not in headers:
+                    # sequential segments
+                    sequential.append(b''.join([bytes(b) for b in data]))
+                    rsp_headers = {}
+                    net.add_md5_header(
+                        rsp_headers,
+                        hashlib.md5(b''.join(sequential)).hexdigest())
+                    return Mock(headers=rsp_headers)
+                if put_mock.error:
+                    raise put_mock.error
+                content_range = headers[ws.HTTP_CONTENT_RANGE]
+                offset = int(content_range.split(' ')[1].split('-')[0])
+                received[offset] = b''.join([bytes(b) for b in data])
+                assert headers[ws.HTTP_LENGTH] == \
+                    str(len(received[offset]))
+                return Mock(headers={})
+
+            put_mock.error = None
+            session.put = Mock(side_effect=put_mock)
+            head_headers = {}
+            net.add_md5_header(head_headers,
+                               hashlib.md5(content).hexdigest())
+            session.head.return_value = Mock(headers=head_headers)
+            caller_header = {CONTENT_TYPE: TEXT_TYPE}
+            result = client.upload_file(url=target_url, src=src.name,
+                                        segment_workers=3,
+                                        headers=caller_header)
+            assert hashlib.md5(content).hexdigest() == result[1]
+            assert [0, 8, 16] == sorted(received.keys())
+            assert content == b''.join(
+                [received[offset] for offset in sorted(received.keys())])
+            # start, 3 segments and commit
+            assert 5 == session.put.call_count
+            assert ws.PUT_TXN_COMMIT == \
+                session.put.call_args[1]['headers'][ws.PUT_TXN_OP]
+            assert not session.post.called
+
+            # md5 of the transaction does not match the file. The
+            # transaction is restarted with sequential segments
+            session.put.reset_mock()
+            wrong_headers = {}
+            net.add_md5_header(wrong_headers, 'beef' * 8)
+            session.head.return_value = Mock(headers=wrong_headers)
+            result = client.upload_file(url=target_url, src=src.name,
+                                        segment_workers=3,
+                                        headers=caller_header)
+            assert hashlib.md5(content).hexdigest() == result[1]
+            assert content == b''.join(sequential)
+            assert ws.PUT_TXN_ABORT == \
+                session.post.call_args[1]['headers'][ws.PUT_TXN_OP]
+            # start, 3 segments, restart, 3 segments and commit
+            assert 9 == session.put.call_count
+            assert ws.PUT_TXN_COMMIT == \
+                session.put.call_args[1]['headers'][ws.PUT_TXN_OP]
+
+            # failed segment and the transaction cannot be restarted
+            session.put.reset_mock()
+            session.post.reset_mock()
+            put_mock.error = exceptions.TransferException('reset')
+
+            def start_once(url, data=None, **kwargs):
+                if session.put.call_count > 1 and \
+                        kwargs['headers'].get(ws.PUT_TXN_OP) == \
+                        ws.PUT_TXN_START:
+                    return Mock(headers={})
+                return put_mock(url, data, **kwargs)
+            session.put.side_effect = start_once
+            with pytest.raises(exceptions.TransferException):
+                client.upload_file(url=target_url, src=src.name,
+                                   segment_workers=3,
+                                   headers=caller_header)
+            # failed segments are not sent again
+            ranges = [c[1]['headers'][ws.HTTP_CONTENT_RANGE]
+                      for c in session.put.call_args_list
+                      if ws.HTTP_CONTENT_RANGE in c[1]['headers']]
+            assert ranges and len(ranges) == len(set(ranges))
+            assert ws.PUT_TXN_ABORT == \
+                session.post.call_args[1]['headers'][ws.PUT_TXN_OP]
+            assert not [c for c in session.put.call_args_list
+                        if c[1]['headers'].get(ws.PUT_TXN_OP) ==
+                        ws.PUT_TXN_COMMIT]
+
+            # the transaction is checked after the first batch of segments
+            def head_mock(url, **kwargs):
+                offsets = sorted(received.keys(), reverse=head_mock.reverse)
+                rsp_headers = {}
+                net.add_md5_header(rsp_headers, hashlib.md5(b''.join(
+                    [received[offset] for offset in offsets])).hexdigest())
+                return Mock(headers=rsp_headers)
+
+            head_mock.reverse = False
+            session.head.reset_mock()
+            session.head.side_effect = head_mock
+            session.put.reset_mock()
+            session.put.side_effect = put_mock
+            session.post.reset_mock()
+            put_mock.error = None
+            received.clear()
+            result = client.upload_file(url=target_url, src=src.name,
+                                        segment_workers=2,
+                                        headers=caller_header)
+            assert hashlib.md5(content).hexdigest() == result[1]
+            assert [0, 8, 16] == sorted(received.keys())
+            assert 2 == session.head.call_count
+            assert not session.post.called
+
+            # service that does not place the segments by their
+            # Content-Range. The rest of the segments are sent sequentially
+            head_mock.reverse = True
+            session.put.reset_mock()
+            received.clear()
+            del sequential[:]
+            result = client.upload_file(url=target_url, src=src.name,
+                                        segment_workers=2,
+                                        headers=caller_header)
+            assert hashlib.md5(content).hexdigest() == result[1]
+            assert [0, 8] == sorted(received.keys())
+            assert content == b''.join(sequential)
+            assert ws.PUT_TXN_ABORT == \
+                session.post.call_args[1]['headers'][ws.PUT_TXN_OP]
+        finally:
+            ws.MAX_MD5_COMPUTE_SIZE = orig_max_md5_compute_size
+            ws.FILE_SEGMENT_THRESHOLD = orig_max_file_segment_size
+
+    @patch('cadcutils.net.ws.WsCapabilities')
+    def test_upload_file_put_txn_resume(self, caps_mock):
+        caps_mock.return_value.get_access_url.return_value = \
+            'http://host/availability'
+        client = ws.BaseDataClient(resource_id='ivo://cadc.nrc.ca/resourceid',
+                                   subject=auth.Subject(), agent='TestApp')
+        session = Mock()
+        client._get_session = Mock(return_value=session)
+        target_url = 'https://someurl/path/file'
+        content = b'segment1segment2end3'
+        src = tempfile.NamedTemporaryFile()
+        with open(src.name, 'wb') as f:
+            f.write(content)
+        received = []
+
+        def put_mock(url, data=None, **kwargs):
+            headers = kwargs['headers']
+            if headers.get(ws.PUT_TXN_OP) == ws.PUT_TXN_START:
+                received.clear()
+                return Mock(headers={ws.PUT_TXN_ID: put_mock.trans_id,
+                                     ws.PUT_TXN_MIN_SEGMENT: '1',
+                                     ws.PUT_TXN_MAX_SEGMENT: '8'})
+            assert put_mock.trans_id == headers[ws.PUT_TXN_ID]
+            if data is not None:
+                if put_mock.interrupt == len(received):
+                    put_mock.interrupt = None
+                    raise put_mock.error
+                received.append(b''.join([bytes(b) for b in data]))
+            rsp_headers = {}
+            net.add_md5_header(rsp_headers,
+                               hashlib.md5(b''.join(received)).hexdigest())
+            return Mock(headers=rsp_headers)
+
+        put_mock.trans_id = '123'
+        put_mock.interrupt = 1  # interrupt the second segment
+        put_mock.error = KeyboardInterrupt()
+        session.put = Mock(side_effect=put_mock)
+        journal_dir = TemporaryDirectory()
+        with patch('cadcutils.net.ws.MAX_MD5_COMPUTE_SIZE', 5), \
+                patch('cadcutils.net.ws.FILE_SEGMENT_THRESHOLD', 10), \
+                patch.dict(os.environ, {'CADC_PUT_JOURNAL': journal_dir.name}):
+            with pytest.raises(KeyboardInterrupt):
+                client.upload_file(url=target_url, src=src.name)
+            # transaction not aborted
+            assert not session.post.called
+            assert [b'segment1'] == received
+
+            # resume the transaction
+            session.put.reset_mock()
+            head_headers = {}
+            net.add_md5_header(head_headers,
+                               hashlib.md5(b'segment1').hexdigest())
+            session.head.return_value = Mock(headers=head_headers)
+            result = client.upload_file(url=target_url, src=src.name)
+            assert hashlib.md5(content).hexdigest() == result[1]
+            assert [b'segment1', b'segment2', b'end3'] == received
+            # 2 segments and commit
+            assert 3 == session.put.call_count
+            assert ws.PUT_TXN_COMMIT == \
+                session.put.call_args[1]['headers'][ws.PUT_TXN_OP]
+            assert '123' == \
+                session.head.call_args[1]['headers'][ws.PUT_TXN_ID]
+            assert not os.listdir(journal_dir.name)
+
+            # transaction that cannot be resumed is aborted and the upload
+            # starts over
+            put_mock.interrupt = 2
+            with pytest.raises(KeyboardInterrupt):
+                client.upload_file(url=target_url, src=src.name)
+            session.put.reset_mock()
+            wrong_headers = {}
+            net.add_md5_header(wrong_headers, 'beef' * 8)
+            session.head.return_value = Mock(headers=wrong_headers)
+            put_mock.trans_id = '456'
+            result = client.upload_file(url=target_url, src=src.name)
+            assert hashlib.md5(content).hexdigest() == result[1]
+            assert ws.PUT_TXN_ABORT == \
+                session.post.call_args[1]['headers'][ws.PUT_TXN_OP]
+            assert '123' == \
+                session.post.call_args[1]['headers'][ws.PUT_TXN_ID]
+            # start, 3 segments and commit
+            assert 5 == session.put.call_count
+
+            # failures that cannot be resumed abort the transaction
+            session.post.reset_mock()
+            put_mock.interrupt = 1
+            put_mock.error = exceptions.ForbiddenException('denied')
+            with pytest.raises(exceptions.ForbiddenException):
+                client.upload_file(url=target_url, src=src.name)
+            assert ws.PUT_TXN_ABORT == \
+                session.post.call_args[1]['headers'][ws.PUT_TXN_OP]
+            assert not os.listdir(journal_dir.name)
+
+            # transient errors do not
+            session.post.reset_mock()
+            put_mock.interrupt = 1
+            put_mock.error = exceptions.HttpException(
+                orig_exception=requests.ConnectionError('reset'))
+            with pytest.raises(exceptions.HttpException):
+                client.upload_file(url=target_url, src=src.name)
+            assert not session.post.called
+            assert os.listdir(journal_dir.name)
+
     def test_get_segment_size(self):
         get_segment = ws.BaseDataClient._get_segment_size  # shortcut
         # file size > preferred segment size
@@ -1152,6 +1422,220 @@ class TestRetrySession(unittest.TestCase):
         rs.post('https://someurl')
         time_mock.assert_called_with(DEFAULT_RETRY_DELAY)
 
+    def test_pool(self):
+        rs = ws.RetrySession()
+        adapter = rs.get_adapter('https://someurl')
+        self.assertEqual(ws.POOL_CONNECTIONS, adapter._pool_connections)
+        self.assertEqual(ws.POOL_MAXSIZE, adapter._pool_maxsize)
+        self.assertEqual(ws.POOL_BLOCK, adapter._pool_block)
+        self.assertTrue(adapter is rs.get_adapter('http://someurl'))
+        self.assertEqual('keep-alive', rs.headers['Connection'])
+        self.assertEqual({}, rs.connection_stats())
+
+        rs = ws.RetrySession(pool_connections=2, pool_maxsize=20,
+                             pool_block=True)
+        adapter = rs.get_adapter('https://someurl')
+        self.assertEqual(2, adapter._pool_connections)
+        self.assertEqual(20, adapter._pool_maxsize)
+        self.assertTrue(adapter._pool_block)
+        pool = adapter.poolmanager.connection_from_url('https://someurl')
+        pool.num_connections = 2
+        pool.num_requests = 5
+        pool = adapter.poolmanager.connection_from_url('http://otherurl')
+        pool.num_connections = 1
+        pool.num_requests = 1
+        self.assertEqual(
+            {'someurl': {'connections': 2, 'requests': 5, 'reused': 3},
+             'otherurl': {'connections': 1, 'requests': 1, 'reused': 0}},
+            rs.connection_stats())
+
+        # connections are not reused without keep alive
+        rs = ws.RetrySession(keep_alive=False)
+        self.assertEqual('close', rs.headers['Connection'])
+        pool = rs.get_adapter('https://someurl').poolmanager.\
+            connection_from_url('https://someurl')
+        pool.num_connections = 1
+        pool.num_requests = 5
+        self.assertEqual(
+            {'someurl': {'connections': 1, 'requests': 5, 'reused': 0}},
+            rs.connection_stats())
+
+        # session of a client
+        client = ws.BaseWsClient('https://someurl', auth.Subject(), 'TestApp',
+                                 pool_maxsize=30, keep_alive=False)
+        self.assertEqual({}, client.connection_stats())
+        session = client._get_session()
+        self.assertEqual(
+            30, session.get_adapter('https://someurl')._pool_maxsize)
+        self.assertEqual('close', session.headers['Connection'])
+        self.assertEqual({}, client.connection_stats())
+
+    @patch('time.sleep')
+    @patch('cadcutils.net.ws.requests.Session.send')
+    @patch('cadcutils.net.ws.requests.Session.merge_environment_settings',
+           Mock(return_value={}))
+    def test_listeners(self, send_mock, time_mock):
+        request = requests.Request('PUT', 'https://somehost/path',
+                                   data=b'0123456789').prepare()
+        unavailable = requests.Response()
+        unavailable.status_code = requests.codes.unavailable
+        unavailable.headers[ws.SERVICE_RETRY] = '3'
+        unavailable.elapsed = datetime.timedelta(seconds=0.5)
+        response = requests.Response()
+        response.status_code = requests.codes.created
+        response.headers['Server'] = 'minoc-1.2'
+        response.headers['Content-Length'] = '5'
+        response.elapsed = datetime.timedelta(seconds=0.2)
+        send_mock.side_effect = [unavailable, response]
+        events = []
+        global_events = []
+        rs = ws.RetrySession()
+        rs.listeners.append(events.append)
+        ws.add_request_listener(global_events.append)
+        try:
+            self.assertEqual(response, rs.send(request))
+        finally:
+            ws.remove_request_listener(global_events.append)
+        self.assertEqual(1, len(events))
+        self.assertEqual(events, global_events)
+        event = events[0]
+        self.assertEqual('PUT', event.method)
+        self.assertEqual('somehost', event.host)
+        self.assertEqual(201, event.status)
+        self.assertEqual(10, event.bytes_sent)
+        self.assertEqual(5, event.bytes_received)
+        self.assertEqual(0.2, event.latency)
+        self.assertEqual(1, event.retries)
+        self.assertEqual(3, event.backoff)
+        self.assertEqual('minoc-1.2', event.server)
+        self.assertIsNone(event.error)
+        self.assertTrue(event.duration >= 0)
+
+        # failed requests and listeners errors
+        events.clear()
+        rs.listeners.insert(0, Mock(side_effect=RuntimeError('boom')))
+        send_mock.side_effect = [requests.exceptions.ConnectionError('err')]
+        with self.assertRaises(exceptions.HttpException):
+            rs.send(request)
+        self.assertEqual(1, len(events))
+        self.assertIsNone(events[0].status)
+        self.assertTrue(isinstance(events[0].error, exceptions.HttpException))
+        self.assertFalse(global_events[1:])
+
+        # listeners from the environment
+        with patch.dict(os.environ, {ws.REQUEST_METRICS_ENV: 'log'}):
+            with self.assertLogs('cadcutils.requests', 'INFO') as logs:
+                send_mock.side_effect = [response]
+                rs.send(request)
+        self.assertEqual(1, len(logs.records))
+        self.assertEqual(201, json.loads(logs.records[0].getMessage())['status'])
+        with self.assertRaises(ValueError):
+            metrics.listeners_from_config('log,unknown')
+
+        # invalid listeners from the environment do not fail the requests
+        # and are built only once
+        with patch.dict(os.environ, {ws.REQUEST_METRICS_ENV: 'log,bogus'}):
+            with patch('cadcutils.net.metrics.listeners_from_config',
+                       side_effect=ValueError('bogus')) as config_mock:
+                with self.assertLogs('RetrySession', 'WARNING') as logs:
+                    for _ in range(2):
+                        send_mock.side_effect = [response]
+                        self.assertEqual(response, rs.send(request))
+        config_mock.assert_called_once_with('log,bogus')
+        self.assertEqual(1, len([r for r in logs.records
+                                 if ws.REQUEST_METRICS_ENV in r.getMessage()]))
+        self.assertEqual([], ws.get_env_listeners.caches['log,bogus'])
+
+    @patch('time.sleep')
+    @patch('cadcutils.net.ws.requests.Session.send')
+    @patch('cadcutils.net.ws.requests.Session.merge_environment_settings',
+           Mock(return_value={}))
+    def test_retry_policies(self, send_mock, time_mock):
+        request = requests.Request('GET', 'https://somehost/path').prepare()
+        unavailable = requests.Response()
+        unavailable.status_code = requests.codes.unavailable
+        ok = requests.Response()
+        ok.status_code = requests.codes.ok
+
+        # start delay without the minimum and full jitter from the environment
+        with patch.dict(os.environ, {ws.RETRY_START_DELAY_ENV: '1',
+                                     ws.RETRY_JITTER_ENV: 'full'}):
+            rs = ws.RetrySession()
+        self.assertEqual(1, rs.retry_policy.start_delay)
+        send_mock.side_effect = [unavailable, unavailable, unavailable, ok]
+        with patch('cadcutils.net.ws.random.uniform') as uniform_mock:
+            uniform_mock.side_effect = lambda a, b: b / 2
+            rs.send(request)
+        time_mock.assert_has_calls([call(0.5), call(1), call(2)])
+        self.assertIsNone(rs.retry_budget)
+        self.assertIsNone(rs.circuit_breaker)
+        with self.assertRaises(ValueError):
+            ws.BackoffPolicy(jitter='unknown')
+
+        # retry budget
+        time_mock.reset_mock()
+        rs = ws.RetrySession(
+            retry_policy=ws.BackoffPolicy(start_delay=1),
+            retry_budget=ws.RetryBudget(ratio=0.5, min_retries=1))
+        send_mock.side_effect = [unavailable] * 4
+        with self.assertRaises(exceptions.HttpException):
+            rs.send(request)
+        # 1 + 0.5 retries for 1 request
+        time_mock.assert_called_once_with(1)
+        send_mock.side_effect = [ok]
+        rs.send(request)
+        # 1 + 0.5 * 3 retries for 3 requests
+        time_mock.reset_mock()
+        send_mock.side_effect = [unavailable, unavailable]
+        with self.assertRaises(exceptions.HttpException):
+            rs.send(request)
+        time_mock.assert_called_once_with(1)
+
+        # circuit breaker fails fast and let requests through after a while
+        time_mock.reset_mock()
+        breaker = ws.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        rs = ws.RetrySession(
+            retry_policy=ws.BackoffPolicy(start_delay=1, max_retries=2),
+            circuit_breaker=breaker)
+        # one failure per request regardless of its retries
+        send_mock.reset_mock()
+        send_mock.side_effect = [unavailable] * 3
+        with self.assertRaises(exceptions.HttpException):
+            rs.send(request)
+        self.assertEqual(3, send_mock.call_count)
+        self.assertFalse(breaker.is_open('somehost'))
+        send_mock.side_effect = [unavailable] * 3
+        with self.assertRaises(exceptions.HttpException):
+            rs.send(request)
+        self.assertEqual(6, send_mock.call_count)
+        self.assertTrue(breaker.is_open('somehost'))
+        self.assertFalse(breaker.is_open('otherhost'))
+        send_mock.reset_mock()
+        with self.assertRaises(exceptions.CircuitOpenException):
+            rs.send(request)
+        send_mock.assert_not_called()
+        with patch('cadcutils.net.ws.time.time',
+                   Mock(return_value=time.time() + 61)):
+            self.assertFalse(breaker.is_open('somehost'))
+            send_mock.side_effect = [ok]
+            rs.send(request)
+        self.assertFalse(breaker.is_open('somehost'))
+        # a success resets the consecutive failures
+        send_mock.side_effect = [unavailable] * 3 + [ok]
+        with self.assertRaises(exceptions.HttpException):
+            rs.send(request)
+        rs.send(request)
+        send_mock.side_effect = [unavailable] * 3
+        with self.assertRaises(exceptions.HttpException):
+            rs.send(request)
+        self.assertFalse(breaker.is_open('somehost'))
+        with patch.dict(os.environ, {ws.CIRCUIT_BREAKER_ENV: '4'}):
+            self.assertEqual(4, ws.get_circuit_breaker().failure_threshold)
+            self.assertTrue(
+                ws.get_circuit_breaker() is
+                ws.RetrySession().circuit_breaker)
+        self.assertIsNone(ws.get_circuit_breaker())
+
 
 capabilities_content = \
     """
@@ -1202,6 +1686,11 @@ capabilities_content = \
 class TestWsCapabilities(unittest.TestCase):
     """Class for testing the webservie client"""
 
+    def setUp(self):
+        # start with an empty in-process cache
+        ws._registry_cache.clear()
+        ws._capabilities_cache.clear()
+
     @patch('cadcutils.net.ws.util.get_url_content')
     def test_get_reg(self, get_content_mock):
         """
@@ -1287,6 +1776,48 @@ class TestWsCapabilities(unittest.TestCase):
                          caps.get_access_url(
                              'vos://cadc.nrc.ca~service/CADC/mystnd01'))
 
+    @patch('cadcutils.net.ws.util.get_url_content')
+    def test_shared_caps(self, get_content_mock):
+        """
+        Tests that the registry and capabilities are shared by clients
+        """
+        service = 'myservice'
+        resource_id = 'ivo://canfar.phys.uvic.ca/{}'.format(service)
+        resource_cap_url = 'www.canfar.net/myservice'
+        cadcreg_content = '{} = http://{}/capabilities\n'.format(
+            resource_id, resource_cap_url)
+        caps_content = capabilities_content.replace('WS_URL',
+                                                    resource_cap_url)
+        get_content_mock.side_effect = [cadcreg_content, caps_content]
+        for _ in range(3):
+            caps = ws.WsCapabilities(Mock(resource_id=resource_id,
+                                          subject=auth.Subject()))
+            self.assertEqual('http://{}/availability'.format(
+                resource_cap_url), caps.get_access_url(
+                    'ivo://ivoa.net/std/VOSI#availability'))
+        # registry and capabilities read and parsed once
+        self.assertEqual(2, get_content_mock.call_count)
+
+        # different host has its own registry and capabilities
+        get_content_mock.side_effect = [cadcreg_content, caps_content]
+        caps = ws.WsCapabilities(Mock(resource_id=resource_id,
+                                      subject=auth.Subject()),
+                                 host='some.host')
+        caps.get_access_url('ivo://ivoa.net/std/VOSI#availability')
+        self.assertEqual(4, get_content_mock.call_count)
+        self.assertEqual('https://some.host/reg/resource-caps',
+                         get_content_mock.call_args_list[2][1]['url'])
+
+        # stale entries are refreshed
+        get_content_mock.side_effect = [cadcreg_content, caps_content]
+        with patch('cadcutils.net.ws.time.time',
+                   Mock(return_value=time.time() +
+                        2 * ws.REG_REFRESH_INTERVAL)):
+            caps = ws.WsCapabilities(Mock(resource_id=resource_id,
+                                          subject=auth.Subject()))
+            caps.get_access_url('ivo://ivoa.net/std/VOSI#availability')
+        self.assertEqual(6, get_content_mock.call_count)
+
 
 class TestWsOutsideCalls(unittest.TestCase):
     """ Class to test Ws with calls to outside sites"""
@@ -1314,6 +1845,63 @@ class TestWsOutsideCalls(unittest.TestCase):
         time_mock.assert_has_calls(calls)
 
 
+def test_thread_safe_client():
+    client = ws.BaseWsClient('https://someurl', auth.Subject(), 'TestApp',
+                             session_headers={'X-Test': 'yes'})
+
+    create_session = client._create_session
+
+    def slow_create_session():
+        # give the other threads a chance to race
+        time.sleep(0.1)
+        return create_session()
+
+    with patch.object(client, '_create_session') as session_mock:
+        session_mock.side_effect = slow_create_session
+        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+            sessions = list(executor.map(lambda _: client._get_session(),
+                                         range(10)))
+    assert 1 == session_mock.call_count
+    assert all([s is sessions[0] for s in sessions])
+    assert 'yes' == sessions[0].headers['X-Test']
+    assert client._get_session() is sessions[0]
+
+
+@patch('cadcutils.net.ws.util.get_url_content')
+def test_caps_snapshots(get_content_mock):
+    resource_id = 'ivo://canfar.phys.uvic.ca/snapshotservice'
+    resource_cap_url = 'www.canfar.net/snapshotservice'
+    get_content_mock.side_effect = [
+        '{} = http://{}/capabilities\n'.format(resource_id, resource_cap_url),
+        capabilities_content.replace('WS_URL', resource_cap_url)]
+    caps = ws.WsCapabilities(Mock(resource_id=resource_id,
+                                  subject=auth.Subject()),
+                             host='snapshot.host')
+    assert 0 == caps.last_regtime
+    assert 0 == caps.last_capstime
+    assert 'http://{}/availability'.format(resource_cap_url) == \
+        caps.get_access_url('ivo://ivoa.net/std/VOSI#availability')
+    assert caps.last_regtime > 0
+    assert caps.last_capstime > 0
+    # the registry snapshot shared with the other clients is read only
+    with pytest.raises(TypeError):
+        caps.caps_urls[resource_id] = 'https://other.url/capabilities'
+
+    # assignments replace the snapshots
+    caps.caps_urls = {resource_id: 'https://other.url/capabilities'}
+    assert 'https://other.url/capabilities' == caps._get_capability_url()
+    preloaded = Mock()
+    caps.capabilities = preloaded
+    assert preloaded.get_access_url.return_value == \
+        caps.get_access_url('ivo://ivoa.net/std/VOSI#availability')
+    # reset
+    caps.last_capstime = 0
+    caps.last_regtime = 0
+    assert preloaded is caps.capabilities
+    assert 0 == caps.last_capstime
+    assert 0 == caps.last_regtime
+
+
 def test_resolve_name():
     client = ws.BaseDataClient('https://httpbin.org', net.Subject(), 'FOO')
     dest = NamedTemporaryFile()
@@ -1353,7 +1941,7 @@ def test_download_file_method():
         {'digest': 'md5=YWI1NmI0ZDkyYjQwNzEzYWNjNWFmODk5ODVkNGI3ODY=',
          'Content-Length': '5',
          'content-disposition': 'attachment; filename={}'.format(file_name)}
-    response.raw.read.side_effect = [b'abc', b'de']
+    response.raw = io.BytesIO(b'abcde')
     client.get = Mock(return_value=response)
     temp_dir = TemporaryDirectory()
     # proxy _save_bytes through a mock to check when it's called
@@ -1380,7 +1968,7 @@ def test_download_file_method():
 
     # specify destination file name
     client.get.reset_mock()
-    response.raw.read.side_effect = [b'abc', b'de']
+    response.raw = io.BytesIO(b'abcde')
     client._save_bytes.reset_mock()
     client.get = Mock(return_value=response)
     # override file name
@@ -1401,7 +1989,7 @@ def test_download_file_method():
     os.rename(dest, temp_dest)
     open(temp_dest, 'ab').write(b'ghi')
     assert 5 < os.stat(temp_dest).st_size
-    response.raw.read.side_effect = [b'abc', b'de']
+    response.raw = io.BytesIO(b'abcde')
     rsp = client.download_file('https://dataservice/path/file', temp_dir.name)
     dest, temp_dest = client._resolve_destination_file(
         temp_dir.name, src_md5=md5, default_file_name=file_name)
@@ -1421,7 +2009,7 @@ def test_download_file_method():
         f.seek(0, os.SEEK_END)
         f.seek(f.tell() - 3, os.SEEK_SET)
         f.truncate()
-    response.raw.read.side_effect = [b'abc', b'de']
+    response.raw = io.BytesIO(b'abcde')
     client.get = Mock(return_value=response)
     rsp = client.download_file('https://dataservice/path/file', temp_dir.name)
     assert os.path.isfile(dest)
@@ -1438,10 +2026,11 @@ def test_download_file_method():
         f.seek(0, os.SEEK_END)
         f.seek(f.tell() - 3, os.SEEK_SET)
         f.truncate()
-    response.status_code = requests.codes.partial_content
     response.headers['Accept-Ranges'] = 'bytes '
-    response.raw.read.side_effect = [b'cde']
-    client.get = Mock(return_value=response)
+    response.raw = io.BytesIO(b'abcde')
+    range_response = Mock(status_code=requests.codes.partial_content,
+                          headers=response.headers, raw=io.BytesIO(b'cde'))
+    client.get = Mock(side_effect=[response, range_response])
     rsp = client.download_file('https://dataservice/path/file', temp_dir.name)
     assert os.path.isfile(dest)
     assert not os.path.isfile(temp_dest)
@@ -1455,6 +2044,215 @@ def test_download_file_method():
     assert md5 == rsp[1]
 
 
+@patch('cadcutils.net.ws.MIN_DOWNLOAD_RANGE_SIZE', 4)
+def test_download_file_ranges():
+    client = ws.BaseDataClient('https://httpbin.org', net.Subject(), 'FOO')
+    content = b'0123456789abcdefghij'
+    md5 = hashlib.md5(content).hexdigest()
+    file_name = 'filename.fits'
+    headers = {'Content-Length': str(len(content)),
+               'Accept-Ranges': 'bytes',
+               'content-disposition': 'attachment; filename={}'.format(
+                   file_name)}
+    net.add_md5_header(headers, md5)
+    ranges = []
+
+    def get_mock(url, stream=False, headers=None, **kwargs):
+        assert stream
+        response = Mock()
+        response.headers = dict(get_mock.headers)
+        if headers and 'Range' in headers:
+            first, last = [int(x) for x in
+                           headers['Range'].split('=')[1].split('-')]
+            ranges.append((first, last))
+            response.status_code = requests.codes.partial_content
+            response.raw = io.BytesIO(get_mock.content[first:last + 1])
+        else:
+            response.status_code = requests.codes.ok
+            response.raw = io.BytesIO(get_mock.content)
+        return response
+    get_mock.headers = headers
+    get_mock.content = content
+    client.get = Mock(side_effect=get_mock)
+    temp_dir = TemporaryDirectory()
+    rsp = client.download_file('https://dataservice/path/file', temp_dir.name,
+                               streams=3)
+    assert (file_name, md5, len(content)) == rsp
+    assert [(0, 6), (7, 13), (14, 19)] == sorted(ranges)
+    dest = os.path.join(temp_dir.name, file_name)
+    assert content == open(dest, 'rb').read()
+    assert not os.path.isfile(os.path.join(
+        temp_dir.name, '{}-{}.part'.format(file_name, md5)))
+
+    # corrupted content
+    os.remove(dest)
+    get_mock.content = b'X' * len(content)
+    with pytest.raises(exceptions.TransferException):
+        client.download_file('https://dataservice/path/file', temp_dir.name,
+                             streams=3)
+    assert not os.listdir(temp_dir.name)
+
+    # resume a partial download
+    ranges.clear()
+    get_mock.content = content
+    with open(os.path.join(temp_dir.name, '{}-{}.part'.format(
+            file_name, md5)), 'wb') as f:
+        f.write(content[:8])
+    rsp = client.download_file('https://dataservice/path/file', temp_dir.name,
+                               streams=3)
+    assert (file_name, md5, len(content)) == rsp
+    assert [(8, 11), (12, 15), (16, 19)] == sorted(ranges)
+    assert content == open(dest, 'rb').read()
+
+    # a failed range stops the others
+    os.remove(dest)
+    ranges.clear()
+    failed = threading.Event()
+
+    reads = []
+
+    class BlockingRaw(io.BytesIO):
+        def readinto(self, buffer):
+            failed.wait(5)
+            reads.append(buffer)
+            return super().readinto(buffer)
+
+    def failing_get_mock(url, stream=False, headers=None, **kwargs):
+        response = get_mock(url, stream, headers, **kwargs)
+        if headers and 'Range' in headers:
+            if ranges[-1][0] == 14:
+                # let the other ranges go on once this one failed
+                threading.Timer(0.1, failed.set).start()
+                raise exceptions.TransferException('reset')
+            response.raw = BlockingRaw(response.raw.getvalue())
+        return response
+    client.get = Mock(side_effect=failing_get_mock)
+    with patch('cadcutils.net.ws.READ_BLOCK_SIZE', 1), \
+            pytest.raises(exceptions.TransferException):
+        client.download_file('https://dataservice/path/file', temp_dir.name,
+                             streams=3)
+    assert not os.listdir(temp_dir.name)
+    # the other ranges stopped after their first block
+    assert [(0, 6), (7, 13), (14, 19)] == sorted(ranges)
+    assert 2 == len(reads)
+    client.get = Mock(side_effect=get_mock)
+
+    # no support for ranges - single stream
+    ranges.clear()
+    get_mock.content = content
+    get_mock.headers = dict(headers)
+    del get_mock.headers['Accept-Ranges']
+    rsp = client.download_file('https://dataservice/path/file', temp_dir.name,
+                               streams=3)
+    assert (file_name, md5, len(content)) == rsp
+    assert not ranges
+    assert content == open(dest, 'rb').read()
+
+
+def test_download_file_stream():
+    client = ws.BaseDataClient('https://httpbin.org', net.Subject(), 'FOO')
+    response = Mock()
+    response.headers = \
+        {'digest': 'md5=YWI1NmI0ZDkyYjQwNzEzYWNjNWFmODk5ODVkNGI3ODY=',
+         'Content-Length': '5',
+         'content-disposition': 'attachment; filename=file.txt'}
+    response.raw = io.BytesIO(b'abcde')
+    client.get = Mock(return_value=response)
+    dest = io.BytesIO()
+    with patch('cadcutils.net.ws.READ_BLOCK_SIZE', 2):
+        assert ('file.txt', 'ab56b4d92b40713acc5af89985d4b786', 5) == \
+            client.download_file('https://dataservice/path/file', dest)
+    assert b'abcde' == dest.getvalue()
+
+    # destination that holds on to the written data and accepts at most
+    # one byte per write
+    class Collector(object):
+        def __init__(self):
+            self.data = []
+
+        def write(self, data):
+            self.data.append(data[:1])
+            return 1
+    collector = Collector()
+    response.raw = io.BytesIO(b'abcde')
+    with patch('cadcutils.net.ws.READ_BLOCK_SIZE', 2):
+        client.download_file('https://dataservice/path/file', collector)
+    assert b'abcde' == b''.join(collector.data)
+    assert all(isinstance(data, bytes) for data in collector.data)
+
+    # corrupted content
+    response.raw = io.BytesIO(b'abcdf')
+    with pytest.raises(exceptions.TransferException):
+        client.download_file('https://dataservice/path/file', io.BytesIO())
+
+    # truncated content
+    response.raw = io.BytesIO(b'abc')
+    with pytest.raises(exceptions.TransferException):
+        client.download_file('https://dataservice/path/file', io.BytesIO())
+
+    # errors after content has been written
+    response.raw = Mock()
+    response.raw.readinto.side_effect = [2, ConnectionError('reset')]
+    with pytest.raises(exceptions.TransferException):
+        client.download_file('https://dataservice/path/file', io.BytesIO())
+
+
+def test_iter_file():
+    client = ws.BaseDataClient('https://httpbin.org', net.Subject(), 'FOO')
+    headers = {'digest': 'md5=YWI1NmI0ZDkyYjQwNzEzYWNjNWFmODk5ODVkNGI3ODY=',
+               'Content-Length': '5', 'Accept-Ranges': 'bytes'}
+    response = Mock(headers=headers, raw=io.BytesIO(b'abcde'))
+    client.get = Mock(return_value=response)
+    assert [b'ab', b'cd', b'e'] == \
+        list(client.iter_file('https://dataservice/path/file', 2))
+    client.get.assert_called_once_with('https://dataservice/path/file',
+                                       stream=True)
+    response.close.assert_called_once_with()
+
+    # early close does not read the rest
+    response.reset_mock()
+    response.raw = io.BytesIO(b'abcde')
+    chunks = client.iter_file('https://dataservice/path/file', 2)
+    assert b'ab' == next(chunks)
+    chunks.close()
+    response.close.assert_called_once_with()
+    assert 2 == response.raw.tell()
+
+    # byte range and resume after errors
+    response.raw = Mock()
+    response.raw.readinto.side_effect = [2, ConnectionError('reset')]
+    range_response = Mock(status_code=requests.codes.partial_content,
+                          headers={}, raw=io.BytesIO(b'e'))
+    response.status_code = requests.codes.partial_content
+    headers['Content-Length'] = '3'
+    client.get = Mock(side_effect=[response, range_response])
+    assert 3 == len(b''.join(client.iter_file(
+        'https://dataservice/path/file', 2, byte_range=(2, None))))
+    assert [call('https://dataservice/path/file', stream=True,
+                 headers={'Range': 'bytes=2-'}),
+            call('https://dataservice/path/file', stream=True,
+                 headers={'Range': 'bytes=4-'})] == client.get.mock_calls
+
+    # service does not support ranges
+    response.status_code = requests.codes.ok
+    client.get = Mock(return_value=response)
+    with pytest.raises(exceptions.TransferException):
+        client.iter_file('https://dataservice/path/file',
+                         byte_range=(2, 3))
+
+    # corrupted content
+    headers['Content-Length'] = '5'
+    response.raw = io.BytesIO(b'abcdf')
+    with pytest.raises(exceptions.TransferException):
+        list(client.iter_file('https://dataservice/path/file'))
+
+
+def test_read_raw():
+    blocks = [bytes(block) for block in ws._read_raw(io.BytesIO(b'abcde'), 2)]
+    assert [b'ab', b'cd', b'e'] == blocks
+    assert [] == list(ws._read_raw(io.BytesIO(b'')))
+
+
 def test_save_bytes():
     client = ws.BaseDataClient('https://httpbin.org', net.Subject(), 'FOO')
     dest = NamedTemporaryFile()
@@ -1464,7 +2262,7 @@ def test_save_bytes():
         outer['bytes_count'] += len(bytes)
 
     response = Mock()
-    response.raw.read.side_effect = [b'abc', b'de']
+    response.raw = io.BytesIO(b'abcde')
     response.headers = \
         {'digest': 'md5=YWI1NmI0ZDkyYjQwNzEzYWNjNWFmODk5ODVkNGI3ODY='}
     client._save_bytes(response=response, src_length=5, dest_file=dest.name,
@@ -1476,7 +2274,7 @@ def test_save_bytes():
     # repeat the test but make szie of source and destination mismatch
     dest = NamedTemporaryFile()
     response = Mock()
-    response.raw.read.side_effect = [b'aaa', b'aa']  # different content
+    response.raw = io.BytesIO(b'aaaaa')  # different content
     response.headers = \
         {'digest': 'md5=YWI1NmI0ZDkyYjQwNzEzYWNjNWFmODk5ODVkNGI3ODY='}
     with pytest.raises(exceptions.TransferException):
@@ -1487,10 +2285,51 @@ def test_save_bytes():
     # repeat the test but make md5s of source and destination mismatch
     dest = NamedTemporaryFile()
     response = Mock()
-    response.raw.read.side_effect = [b'aaa', b'aa']  # different content
+    response.raw = io.BytesIO(b'aaaaa')  # different content
     response.headers = \
         {'digest': 'md5=YWI1NmI0ZDkyYjQwNzEzYWNjNWFmODk5ODVkNGI3ODY='}
     with pytest.raises(exceptions.TransferException):
         client._save_bytes(response=response, src_length=5,
                            dest_file=dest.name,
                            process_bytes=count_bytes)
+
+
+def test_md5_cache():
+    cache_dir = TemporaryDirectory()
+    client = ws.BaseDataClient('https://httpbin.org', net.Subject(), 'FOO')
+    src = NamedTemporaryFile()
+    with open(src.name, 'wb') as f:
+        f.write(b'abcde')
+    md5 = 'ab56b4d92b40713acc5af89985d4b786'
+    with patch.dict(os.environ, {'CADC_MD5_CACHE': os.path.join(
+            cache_dir.name, 'md5.db')}):
+        cache = util.get_md5_cache()
+        assert cache.get(src.name) is None
+        assert md5 == ws.BaseDataClient.compute_file_md5(src.name)
+        assert md5 == cache.get(src.name)
+        # undigested hashes are not cached
+        assert md5 == ws.BaseDataClient.compute_file_md5(
+            src.name, undigested=True).hexdigest()
+
+        # file too large to have its md5 computed but md5 in cache
+        session = Mock()
+        client._get_session = Mock(return_value=session)
+        head_headers = {}
+        net.add_md5_header(head_headers, md5)
+        session.head.return_value = Mock(headers=head_headers)
+        with patch('cadcutils.net.ws.MAX_MD5_COMPUTE_SIZE', 1):
+            assert (os.path.basename(src.name), md5, 5) == \
+                client.upload_file('https://dataservice/path/{}'.format(
+                    os.path.basename(src.name)), src.name)
+        assert not session.put.called
+
+
+# modules that are slow to load and that the command line tools import only
+# when they need them
+LAZY_MODULES = ['OpenSSL', 'lxml', 'packaging', 'sqlite3', 'distro',
+                'asyncio', 'httpx']
+
+
+def test_lazy_imports():
+    # guards the start up time of the command line tools
+    assert_lazy_imports('cadcutils.net', LAZY_MODULES)
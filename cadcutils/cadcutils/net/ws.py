@@ -80,24 +80,44 @@ import time
 import platform
 import os
 import hashlib
+import concurrent.futures
+import random
+import threading
+import types
+from collections import deque
 
 import requests
 from requests import Session
 from urllib.parse import urlparse
-import distro
 
 from cadcutils import exceptions, util, net
 from cadcutils import version as cadctools_version
 from . import wscapabilities, ssl_errors, cert_validation
 
 __all__ = ['BaseWsClient', 'BaseDataClient', 'get_resources', 'list_resources',
-           'DEFAULT_REGISTRY']
+           'DEFAULT_REGISTRY', 'RequestEvent', 'add_request_listener',
+           'remove_request_listener', 'BackoffPolicy', 'RetryBudget',
+           'CircuitBreaker', 'get_circuit_breaker']
 
 BUFSIZE = 8388608  # Size of read/write buffer
 MAX_RETRY_DELAY = 128  # maximum delay between retries
 # start delay between retries when Try_After not sent by server.
 DEFAULT_RETRY_DELAY = 30
 MAX_NUM_RETRIES = 6
+# Environment variables that configure the retries of the sessions:
+# jitter of the delays between retries (none, full or equal)
+RETRY_JITTER_ENV = 'CADC_RETRY_JITTER'
+# first delay between retries (sec). DEFAULT_RETRY_DELAY is a minimum
+# otherwise
+RETRY_START_DELAY_ENV = 'CADC_RETRY_START_DELAY'
+# ratio of retries to requests allowed for each client (e.g. 0.2)
+RETRY_BUDGET_ENV = 'CADC_RETRY_BUDGET'
+# consecutive failures of a host that open its circuit (fail fast)
+CIRCUIT_BREAKER_ENV = 'CADC_CIRCUIT_BREAKER'
+# sec before a request is let through to a host with an open circuit
+CIRCUIT_RESET_TIMEOUT = 30
+if os.getenv('CADC_CIRCUIT_RESET_TIMEOUT', None):
+    CIRCUIT_RESET_TIMEOUT = float(os.getenv('CADC_CIRCUIT_RESET_TIMEOUT'))
 
 SERVICE_RETRY = 'Retry-After'
 SERVICE_AVAILABILITY_ID = 'ivo://ivoa.net/std/VOSI#availability'
@@ -116,11 +136,43 @@ if os.getenv('CADC_MAX_MD5_COMPUTE_SIZE', None):
 GIB = 1024 * 1024 * 1024
 FILE_SEGMENT_THRESHOLD = 5 * GIB  # large files require segments
 PREFERRED_SEGMENT_SIZE = 2 * GIB
+# Number of segments of a PUT transaction that are sent at the same time.
+# Can be overriden by environment or in the call to upload_file
+MAX_SEGMENT_WORKERS = 1
+if os.getenv('CADC_SEGMENT_WORKERS', None):
+    MAX_SEGMENT_WORKERS = int(os.getenv('CADC_SEGMENT_WORKERS'))
+
+# Number of concurrent byte range requests used to download a file. Can be
+# overriden by environment or in the call to download_file
+DOWNLOAD_STREAMS = 1
+if os.getenv('CADC_DOWNLOAD_STREAMS', None):
+    DOWNLOAD_STREAMS = int(os.getenv('CADC_DOWNLOAD_STREAMS'))
+# Files are not split into byte ranges smaller than this
+MIN_DOWNLOAD_RANGE_SIZE = 64 * 1024 * 1024
 
 MD5_MISMATCH_RETRY = 3  # number of times to retry on md5 mismatch errors
 
+# Listeners of the requests sent by all the sessions. The environment
+# variable lists the listeners to install by default (see metrics module)
+REQUEST_METRICS_ENV = 'CADC_REQUEST_METRICS'
+_request_listeners = []
+
+# Connection pools of the sessions: number of hosts with pooled connections,
+# maximum number of connections kept alive for each host and whether
+# requests wait for a pooled connection to become available (pool block)
+# instead of opening extra connections that are discarded after use.
+# Can be overriden by environment or in the BaseWsClient constructor
+POOL_CONNECTIONS = 10
+if os.getenv('CADC_POOL_CONNECTIONS', None):
+    POOL_CONNECTIONS = int(os.getenv('CADC_POOL_CONNECTIONS'))
+POOL_MAXSIZE = 10
+if os.getenv('CADC_POOL_MAXSIZE', None):
+    POOL_MAXSIZE = int(os.getenv('CADC_POOL_MAXSIZE'))
+POOL_BLOCK = os.getenv('CADC_POOL_BLOCK', '').lower() in ['1', 'true', 'yes']
+
 # HTTP attribute names
 HTTP_LENGTH = 'Content-Length'
+HTTP_CONTENT_RANGE = 'Content-Range'
 
 # PUT transactions headers/values
 PUT_TXN_OP = 'x-put-txn-op'
@@ -136,8 +188,10 @@ PUT_TXN_REVERT = 'revert'
 
 HEADERS = 'headers'  # name of the kwargs headers arg
 
-# size of the read blocks in data transfers
-READ_BLOCK_SIZE = 8 * 1024
+# size of the read blocks in data transfers. Can be overriden by environment
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+if os.getenv('CADC_READ_BLOCK_SIZE', None):
+    READ_BLOCK_SIZE = int(os.getenv('CADC_READ_BLOCK_SIZE'))
 
 # try to disable the unverified HTTPS call warnings
 try:
@@ -220,7 +274,9 @@ class BaseWsClient(object):
 
     def __init__(self, resource_id, subject, agent, retry=True, host=None,
                  session_headers=None, insecure=False, idempotent_posts=False,
-                 server_versions=None):
+                 server_versions=None, pool_connections=None,
+                 pool_maxsize=None, pool_block=None, keep_alive=True,
+                 retry_policy=None, retry_budget=None, circuit_breaker=None):
         """
         Client constructor
         :param resource_id -- ID of the resource being accessed (URI format)
@@ -247,6 +303,19 @@ class BaseWsClient(object):
         and server using the `server` HTTP header. If the version is behind
         the server version, a RuntimeException is raised prompting user to
         upgrade the software.
+        :param pool_connections -- number of hosts with pooled connections.
+        Default is POOL_CONNECTIONS
+        :param pool_maxsize -- maximum number of connections kept alive for
+        each host. Should be at least the number of threads that use the
+        client concurrently. Default is POOL_MAXSIZE
+        :param pool_block -- True if requests wait for a pooled connection to
+        become available instead of opening a new one. Default is POOL_BLOCK
+        :param keep_alive -- False to close the connections after each
+        request
+        :param retry_policy -- BackoffPolicy of the retries (see RetrySession)
+        :param retry_budget -- RetryBudget of the client (see RetrySession)
+        :param circuit_breaker -- CircuitBreaker of the hosts (see
+        RetrySession)
         """
 
         self.logger = logging.getLogger('BaseWsClient')
@@ -258,6 +327,7 @@ class BaseWsClient(object):
             raise ValueError('agent is None or empty string')
 
         self._session = None
+        self._session_lock = threading.Lock()
         self.subject = subject
         self.resource_id = resource_id
         self.retry = retry
@@ -265,6 +335,13 @@ class BaseWsClient(object):
         self.verify = not insecure
         self.idempotent_posts = idempotent_posts
         self._server_versions = server_versions
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self.retry_policy = retry_policy
+        self.retry_budget = retry_budget
+        self.circuit_breaker = circuit_breaker
 
         # agent is / delimited key value pairs, separated by a space,
         # containing the application name and version,
@@ -282,6 +359,7 @@ class BaseWsClient(object):
                                           platform.version())
         o_s = sys.platform
         if o_s.lower().startswith('linux'):
+            import distro
             distname = distro.name()
             version = distro.version()
             self.os_info = "{} {}".format(distname, version)
@@ -330,7 +408,6 @@ class BaseWsClient(object):
            :returns response as received from the request library
         """
         session = self._get_session()
-        session.server_versions = self._server_versions
         return session.post(self._get_url(resource), verify=self.verify, **kwargs)
 
     def put(self, resource=None, **kwargs):
@@ -344,7 +421,6 @@ class BaseWsClient(object):
            :returns response as received from the request library
         """
         session = self._get_session()
-        session.server_versions = self._server_versions
         return session.put(self._get_url(resource), verify=self.verify, **kwargs)
 
     def get(self, resource, params=None, **kwargs):
@@ -358,7 +434,6 @@ class BaseWsClient(object):
            :returns response as received from the request library
         """
         session = self._get_session()
-        session.server_versions = self._server_versions
         return session.get(self._get_url(resource), params=params, verify=self.verify, **kwargs)
 
     def delete(self, resource=None, **kwargs):
@@ -371,7 +446,6 @@ class BaseWsClient(object):
            :returns response as received from the request library
         """
         session = self._get_session()
-        session.server_versions = self._server_versions
         return session.delete(self._get_url(resource), verify=self.verify, **kwargs)
 
     def head(self, resource=None, **kwargs):
@@ -384,7 +458,6 @@ class BaseWsClient(object):
            :returns response as received from the request library
         """
         session = self._get_session()
-        session.server_versions = self._server_versions
         return session.head(self._get_url(resource), verify=self.verify, **kwargs)
 
     def is_available(self):
@@ -404,12 +477,13 @@ class BaseWsClient(object):
             path = ''
             if (resource[1] is not None) and (len(resource[1]) > 0):
                 path = '/{}'.format(resource[1].strip('/'))
-            if (len(resource) > 2):
-                interface_type = resource[2]
-                base_url = self.caps.get_access_url(resource[0],
-                                                    interface_type)
-            else:
-                base_url = self.caps.get_access_url(resource[0])
+            with util.timing_phase('capabilities'):
+                if (len(resource) > 2):
+                    interface_type = resource[2]
+                    base_url = self.caps.get_access_url(resource[0],
+                                                        interface_type)
+                else:
+                    base_url = self.caps.get_access_url(resource[0])
             access_url = '{}{}'.format(base_url, path)
             return access_url
         else:
@@ -420,44 +494,70 @@ class BaseWsClient(object):
             return resource
 
     def _get_session(self):
+        # The session and its connection pool are created once and then
+        # shared by all the threads that use the client.
+        session = self._session
+        if session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+                session = self._session
+        return session
+
+    def _create_session(self):
         # Note that the cert goes into the adapter, but we can also
         # use name/password for the auth. We may want to enforce the
         # usage of only the cert in case both name/password and cert
         # are provided.
-        if self._session is None:
-            self.logger.debug('Creating session.')
-            self._session = RetrySession(
-                self.retry, idempotent_posts=self.idempotent_posts)
-            # prevent requests from using .netrc
-            self._session.trust_env = False
-            if self.subject.token:
-                self._session.token = self.subject.token
-            elif self.subject.certificate is not None:
-                if self.subject.validate_certificate:
-                    cert_validation.validate_client_certificate(
-                        self.subject.certificate)
-                self._session.cert = (
-                    self.subject.certificate, self.subject.certificate)
-            elif self.subject.cookies:
-                for cookie in self.subject.cookies:
-                    cookie_obj = requests.cookies.create_cookie(
-                        domain=cookie.domain, name=cookie.name,
-                        value=cookie.value)
-                    self._session.cookies.set_cookie(cookie_obj)
-            else:
-                if (not self.subject.anon) and (self.host is not None) and \
-                        (self.subject.get_auth(self.host) is not None):
-                    self._session.auth = self.subject.get_auth(self.host)
-
-        user_agent = "{} {} {} {} ({})".format(self.agent, self.package_info,
-                                               self.python_info,
-                                               self.system_info, self.os_info)
-        self._session.headers.update({"User-Agent": user_agent})
+        self.logger.debug('Creating session.')
+        session = RetrySession(
+            self.retry, idempotent_posts=self.idempotent_posts,
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize, pool_block=self.pool_block,
+            keep_alive=self.keep_alive, retry_policy=self.retry_policy,
+            retry_budget=self.retry_budget,
+            circuit_breaker=self.circuit_breaker)
+        # prevent requests from using .netrc
+        session.trust_env = False
+        if self.subject.token:
+            session.token = self.subject.token
+        elif self.subject.certificate is not None:
+            if self.subject.validate_certificate:
+                cert_validation.validate_client_certificate(
+                    self.subject.certificate)
+            session.cert = (
+                self.subject.certificate, self.subject.certificate)
+        elif self.subject.cookies:
+            for cookie in self.subject.cookies:
+                cookie_obj = requests.cookies.create_cookie(
+                    domain=cookie.domain, name=cookie.name,
+                    value=cookie.value)
+                session.cookies.set_cookie(cookie_obj)
+        else:
+            if (not self.subject.anon) and (self.host is not None) and \
+                    (self.subject.get_auth(self.host) is not None):
+                session.auth = self.subject.get_auth(self.host)
+
+        session.headers.update({"User-Agent": self._user_agent()})
         if self.session_headers is not None:
-            for header in self.session_headers:
-                self._session.headers.update(self.session_headers)
-        self._session.verify = self.verify
-        return self._session
+            session.headers.update(self.session_headers)
+        session.verify = self.verify
+        session.server_versions = self._server_versions
+        return session
+
+    def _user_agent(self):
+        return "{} {} {} {} ({})".format(self.agent, self.package_info,
+                                         self.python_info, self.system_info,
+                                         self.os_info)
+
+    def connection_stats(self):
+        """
+        Statistics of the connections to each host (see
+        RetrySession.connection_stats)
+        """
+        if self._session is None:
+            return {}
+        return self._session.connection_stats()
 
 
 class BaseDataClient(BaseWsClient):
@@ -466,7 +566,8 @@ class BaseDataClient(BaseWsClient):
     and vos). Provides utilities for uploading and downloading files
     """
 
-    def upload_file(self, url, src, md5_checksum=None, **kwargs):
+    def upload_file(self, url, src, md5_checksum=None, segment_workers=None,
+                    **kwargs):
         """Method to upload a file to CADC storage (archive or vospace). This
            method takes advantage of features in CADC services that uses
            PUTs with transactions in order to optimize and make the transfer
@@ -477,6 +578,15 @@ class BaseDataClient(BaseWsClient):
            :param md5_checksum: optional md5 checksum of the file content. If
            available, the caller should set the attribute, otherwise the method
            might compute it (for small files) and introduce overhead.
+           :param segment_workers: number of segments of a large file to be
+           sent at the same time. Default is MAX_SEGMENT_WORKERS. With more
+           than one worker, the md5 checksum of the file is computed
+           before the transfer starts and each segment carries its position
+           in the file in the Content-Range header. The state of the
+           transaction is checked after the first batch of segments. A
+           failed segment or a service that does not place the segments
+           by their Content-Range restarts the transaction with sequential
+           segments.
            :param kwargs: other http attributes
            :returns (name_of_uploaded_file, md5_checksum, file_size)
            :throws: HttpExceptions
@@ -484,6 +594,8 @@ class BaseDataClient(BaseWsClient):
         stat_info = os.stat(src)
         if stat_info.st_size == 0:
             raise ValueError('Cannot upload empty files')
+        if segment_workers is None:
+            segment_workers = MAX_SEGMENT_WORKERS
         if HEADERS not in kwargs:
             kwargs[HEADERS] = {}
         orig_headers = kwargs.get(HEADERS)
@@ -497,6 +609,10 @@ class BaseDataClient(BaseWsClient):
             return result
 
         src_md5 = md5_checksum
+        md5_cache = util.get_md5_cache()
+        if not src_md5 and md5_cache:
+            # checksum of a file that has already been digested
+            src_md5 = md5_cache.get(src)
         if not src_md5 and stat_info.st_size <= MAX_MD5_COMPUTE_SIZE:
             src_md5 = BaseDataClient.compute_file_md5(src)
 
@@ -505,7 +621,8 @@ class BaseDataClient(BaseWsClient):
         if src_md5:
             # try a HEAD first on the destination
             try:
-                response = self._get_session().head(url)
+                with util.timing_phase('head'):
+                    response = self._get_session().head(url)
                 response.raise_for_status()
                 dest_md5 = net.extract_md5(response.headers)
                 if dest_md5 and (dest_md5 == src_md5):
@@ -532,6 +649,7 @@ class BaseDataClient(BaseWsClient):
                             src, response.status_code))
                         dest_md5 = net.extract_md5(response.headers)
                         self._log_upload(src, start, stat_info.st_size)
+                        self._cache_md5(src, dest_md5, stat_info)
                         return dest_name, dest_md5, stat_info.st_size
                     except exceptions.PreconditionFailedException as e:
                         # retry as this is likely caused by md5 mismatch
@@ -544,7 +662,7 @@ class BaseDataClient(BaseWsClient):
             retries = MD5_MISMATCH_RETRY
             start = time.time()
             while retries:
-                with util.Md5File(src, 'rb') as reader:
+                with util.Md5MappedFile(src) as reader:
                     kwargs[HEADERS] = combine_headers(
                         {PUT_TXN_OP: PUT_TXN_START})
                     response = self._get_session().put(
@@ -581,134 +699,184 @@ class BaseDataClient(BaseWsClient):
                         PUT_TXN_ID: trans_id,
                         PUT_TXN_OP: PUT_TXN_COMMIT,
                         HTTP_LENGTH: '0'})
-                    self._get_session().put(url, verify=self.verify, **kwargs)
+                    with util.timing_phase('commit'):
+                        self._get_session().put(url, verify=self.verify,
+                                                **kwargs)
                 self._log_upload(src, start, stat_info.st_size)
+                self._cache_md5(src, dest_md5, stat_info)
                 return dest_name, dest_md5, stat_info.st_size
 
-        # large file that requires multiple segments
-        kwargs[HEADERS] = combine_headers({
-            HTTP_LENGTH: '0',
-            PUT_TXN_TOTAL_LENGTH: str(stat_info.st_size),
-            PUT_TXN_OP: PUT_TXN_START})
-        response = self._get_session().put(url,
-                                           verify=self.verify,
+        # large file that requires multiple segments. Transactions are
+        # resumable when the journal is enabled (sequential segments only)
+        journal = util.get_put_journal() if segment_workers <= 1 else None
+        resumed = None
+        if journal:
+            resumed = self._resume_put_txn(journal, url, src, combine_headers,
                                            **kwargs)
-        trans_id = response.headers.get(PUT_TXN_ID, None)
-        if trans_id is None:
-            # transactions not supported. Try the upload in one go.
-            kwargs[HEADERS] = combine_headers({HTTP_LENGTH: str(stat_info.st_size)})
-            retries = MD5_MISMATCH_RETRY
-            start = time.time()
-            while retries:
-                with util.Md5File(src, 'rb') as reader:
-                    response = self._get_session().put(
-                        url,
-                        data=reader,
-                        verify=self.verify, **kwargs)
-                # check the file made it OK
-                dest_md5 = net.extract_md5(response.headers)
-                if dest_md5 != reader.md5_checksum:
-                    msg = 'File {} not properly uploaded. ' \
-                          'Mismatched md5 src vs dest: {} vs {}'.format(
-                            src, reader.md5_checksum, dest_md5)
-                    # unfortunately, no way to remove the corrupted file on server
-                    self.logger.warning(msg)
-                    retries -= 1
-                    if retries:
-                        self.logger.warning('Retrying')
-                        continue
-                    else:
-                        raise exceptions.TransferException(msg)
-                self._log_upload(src, start, stat_info.st_size)
-                return dest_name, dest_md5, stat_info.st_size
-        print('Starting transaction {} on url {}'.format(
-            trans_id, url))
-        min_segment = response.headers.get(PUT_TXN_MIN_SEGMENT, None)
-        max_segment = response.headers.get(PUT_TXN_MAX_SEGMENT, None)
-        seg_size = self._get_segment_size(stat_info.st_size,
-                                          min_segment,
-                                          max_segment)
-        current_size = 0
-        last_digest = hashlib.md5()
-        start = time.time()
-        try:
-            # Obs -(-stat_info.st_size//seg_size) - ceiling division in PYTHON
-            for segment in range(0, -(-stat_info.st_size//seg_size)):
-                cur_seg_size = min(seg_size,
-                                   stat_info.st_size-segment*seg_size)
-                self.logger.debug('Sending segment {} of size {}'.format(
-                    segment, cur_seg_size))
-                # Note: setting the content length here is irrelevant as
-                # requests is going to override it according to the size
-                # of the data (as returned by Md5File file handler)
-                current_size += cur_seg_size
+        if resumed:
+            trans_id, seg_size, first_segment, last_digest = resumed
+            dest_md5 = last_digest.hexdigest()
+            self.logger.info(
+                'Resuming transaction {} on url {} from segment {}'.format(
+                    trans_id, url, first_segment))
+        else:
+            kwargs[HEADERS] = combine_headers({
+                HTTP_LENGTH: '0',
+                PUT_TXN_TOTAL_LENGTH: str(stat_info.st_size),
+                PUT_TXN_OP: PUT_TXN_START})
+            response = self._get_session().put(url,
+                                               verify=self.verify,
+                                               **kwargs)
+            trans_id = response.headers.get(PUT_TXN_ID, None)
+            if trans_id is None:
+                # transactions not supported. Try the upload in one go.
+                kwargs[HEADERS] = combine_headers({HTTP_LENGTH: str(stat_info.st_size)})
                 retries = MD5_MISMATCH_RETRY
+                start = time.time()
                 while retries:
-                    try:
-                        with util.Md5File(src, 'rb', segment*seg_size,
-                                          cur_seg_size) as reader:
-                            reader._md5_checksum = last_digest.copy()
-                            kwargs[HEADERS] = combine_headers({
-                                PUT_TXN_ID: trans_id,
-                                HTTP_LENGTH: str(cur_seg_size)})
-                            response = self._get_session().put(
-                                url,
-                                data=reader,
-                                verify=self.verify,
-                                **kwargs)
-                    except exceptions.TransferException as e:
-                        self.logger.warning('Errors transfering {} to {}: {}'.
-                                            format(src, url, e.msg))
-                        try:
-                            kwargs[HEADERS] = combine_headers(
-                                {PUT_TXN_ID: trans_id,
-                                 HTTP_LENGTH: '0'})
-                            response = self._get_session().head(
-                                url,
-                                **kwargs)
-                        except Exception as e:
-                            self.logger.error(
-                                'Could not retrieve transaction {} '
-                                'status from {}: {}'.format(trans_id, url,
-                                                            str(e)))
-                            raise e
+                    with util.Md5MappedFile(src) as reader:
+                        response = self._get_session().put(
+                            url,
+                            data=reader,
+                            verify=self.verify, **kwargs)
                     # check the file made it OK
-                    src_md5 = reader.md5_checksum
                     dest_md5 = net.extract_md5(response.headers)
-                    if src_md5 != dest_md5:
+                    if dest_md5 != reader.md5_checksum:
                         msg = 'File {} not properly uploaded. ' \
                               'Mismatched md5 src vs dest: {} vs {}'.format(
-                                src, src_md5, dest_md5)
+                                src, reader.md5_checksum, dest_md5)
+                        # unfortunately, no way to remove the corrupted file on server
                         self.logger.warning(msg)
                         retries -= 1
                         if retries:
-                            # dest_md5 == None is the start state
-                            if dest_md5 and \
-                                    (dest_md5 != last_digest.hexdigest()):
-                                self.logger.debug('Reverting transaction')
+                            self.logger.warning('Retrying')
+                            continue
+                        else:
+                            raise exceptions.TransferException(msg)
+                    self._log_upload(src, start, stat_info.st_size)
+                    self._cache_md5(src, dest_md5, stat_info)
+                    return dest_name, dest_md5, stat_info.st_size
+            print('Starting transaction {} on url {}'.format(
+                trans_id, url))
+            min_segment = response.headers.get(PUT_TXN_MIN_SEGMENT, None)
+            max_segment = response.headers.get(PUT_TXN_MAX_SEGMENT, None)
+            seg_size = self._get_segment_size(stat_info.st_size,
+                                              min_segment,
+                                              max_segment)
+            first_segment = 0
+            last_digest = hashlib.md5()
+        current_size = 0
+        start = time.time()
+        try:
+            parallel = segment_workers > 1 and \
+                -(-stat_info.st_size//seg_size) > 1
+            if parallel:
+                try:
+                    dest_md5 = self._put_segments_parallel(
+                        url, src, stat_info.st_size, seg_size, trans_id,
+                        combine_headers, segment_workers, **kwargs)
+                except exceptions.TransferException as e:
+                    # segments sent out of order cannot be reverted one by
+                    # one. Restart the transaction with sequential segments
+                    self.logger.warning(
+                        'Errors transfering segments of {} to {}: {}. '
+                        'Restarting transaction'.format(src, url, e.msg))
+                    trans_id = self._restart_put_txn(
+                        url, trans_id, stat_info.st_size, combine_headers,
+                        **kwargs)
+                    parallel = False
+            if not parallel:
+                # Obs -(-stat_info.st_size//seg_size) - ceiling division in PYTHON
+                for segment in range(first_segment,
+                                     -(-stat_info.st_size//seg_size)):
+                    cur_seg_size = min(seg_size,
+                                       stat_info.st_size-segment*seg_size)
+                    self.logger.debug('Sending segment {} of size {}'.format(
+                        segment, cur_seg_size))
+                    # Note: setting the content length here is irrelevant as
+                    # requests is going to override it according to the size
+                    # of the data (as returned by Md5MappedFile handler)
+                    current_size += cur_seg_size
+                    retries = MD5_MISMATCH_RETRY
+                    while retries:
+                        try:
+                            with util.Md5MappedFile(src, segment*seg_size,
+                                                    cur_seg_size) as reader:
+                                reader._md5_checksum = last_digest.copy()
+                                kwargs[HEADERS] = combine_headers({
+                                    PUT_TXN_ID: trans_id,
+                                    HTTP_LENGTH: str(cur_seg_size)})
+                                response = self._get_session().put(
+                                    url,
+                                    data=reader,
+                                    verify=self.verify,
+                                    **kwargs)
+                        except exceptions.TransferException as e:
+                            self.logger.warning('Errors transfering {} to {}: {}'.
+                                                format(src, url, e.msg))
+                            try:
                                 kwargs[HEADERS] = combine_headers(
                                     {PUT_TXN_ID: trans_id,
-                                     PUT_TXN_OP: PUT_TXN_REVERT,
                                      HTTP_LENGTH: '0'})
-                                response = self._get_session().post(
+                                response = self._get_session().head(
                                     url,
-                                    verify=self.verify,
                                     **kwargs)
-                                dest_md5 = net.extract_md5(response.headers)
-                            if dest_md5 is None or \
-                                    dest_md5 == last_digest.hexdigest():
-                                self.logger.warning('Retrying')
-                                continue
-                            else:
+                            except Exception as e:
                                 self.logger.error(
-                                    'BUG: reverted transaction does not match '
-                                    'last md5: {} != {}'.format(
-                                        dest_md5, last_digest.hexdigest()))
-                        raise exceptions.TransferException(msg)
-                    last_digest = reader._md5_checksum
-                    break
+                                    'Could not retrieve transaction {} '
+                                    'status from {}: {}'.format(trans_id, url,
+                                                                str(e)))
+                                raise e
+                        # check the file made it OK
+                        src_md5 = reader.md5_checksum
+                        dest_md5 = net.extract_md5(response.headers)
+                        if src_md5 != dest_md5:
+                            msg = 'File {} not properly uploaded. ' \
+                                  'Mismatched md5 src vs dest: {} vs {}'.format(
+                                    src, src_md5, dest_md5)
+                            self.logger.warning(msg)
+                            retries -= 1
+                            if retries:
+                                # dest_md5 == None is the start state
+                                if dest_md5 and \
+                                        (dest_md5 != last_digest.hexdigest()):
+                                    self.logger.debug('Reverting transaction')
+                                    kwargs[HEADERS] = combine_headers(
+                                        {PUT_TXN_ID: trans_id,
+                                         PUT_TXN_OP: PUT_TXN_REVERT,
+                                         HTTP_LENGTH: '0'})
+                                    response = self._get_session().post(
+                                        url,
+                                        verify=self.verify,
+                                        **kwargs)
+                                    dest_md5 = net.extract_md5(response.headers)
+                                if dest_md5 is None or \
+                                        dest_md5 == last_digest.hexdigest():
+                                    self.logger.warning('Retrying')
+                                    continue
+                                else:
+                                    self.logger.error(
+                                        'BUG: reverted transaction does not match '
+                                        'last md5: {} != {}'.format(
+                                            dest_md5, last_digest.hexdigest()))
+                            raise exceptions.TransferException(msg)
+                        last_digest = reader._md5_checksum
+                        if journal:
+                            self._journal_put_txn(
+                                journal, src, url, trans_id, seg_size,
+                                segment + 1, last_digest.hexdigest(),
+                                stat_info)
+                        break
         except BaseException as e:
+            if trans_id and journal and _is_interruption(e):
+                self.logger.warning(
+                    'Transaction {} of {} interrupted. Upload the file again '
+                    'to resume it.'.format(trans_id, src))
+                raise e
             if trans_id:
+                if journal:
+                    # the transaction cannot succeed
+                    journal.remove(src)
                 # abort transaction
                 self.logger.debug('Aborting transaction {}'.format(trans_id))
                 kwargs[HEADERS] = combine_headers({PUT_TXN_ID: trans_id,
@@ -724,10 +892,193 @@ class BaseDataClient(BaseWsClient):
             PUT_TXN_ID: trans_id,
             PUT_TXN_OP: PUT_TXN_COMMIT,
             HTTP_LENGTH: '0'})
-        self._get_session().put(url, verify=self.verify, **kwargs)
+        with util.timing_phase('commit'):
+            self._get_session().put(url, verify=self.verify, **kwargs)
+        if journal:
+            journal.remove(src)
         self._log_upload(src, start, stat_info.st_size)
+        self._cache_md5(src, dest_md5, stat_info)
         return dest_name, dest_md5, stat_info.st_size
 
+    def _resume_put_txn(self, journal, url, src, combine_headers, **kwargs):
+        # resumes the transaction of a previous upload of src to url as
+        # recorded in the journal. Returns (trans_id, seg_size, number of
+        # segments already sent, md5 hash of the segments already sent) or
+        # None when there is no transaction to resume
+        entry = journal.get(src, url)
+        if not entry:
+            return None
+        trans_id = entry['trans_id']
+        seg_size = entry['seg_size']
+        segments = entry['segments']
+        try:
+            kwargs[HEADERS] = combine_headers({PUT_TXN_ID: trans_id,
+                                               HTTP_LENGTH: '0'})
+            response = self._get_session().head(url, **kwargs)
+            dest_md5 = net.extract_md5(response.headers)
+            # the md5 of the segments has to be computed again since the md5
+            # hash state cannot be saved. The service might have received
+            # one more segment than the journal recorded
+            md5_hash = hashlib.md5()
+            with open(src, 'rb') as reader:
+                for segment in range(segments + 1):
+                    if (dest_md5 is None and segment == 0) or \
+                            dest_md5 == md5_hash.hexdigest():
+                        return trans_id, seg_size, segment, md5_hash
+                    remaining = seg_size
+                    while remaining:
+                        buffer = reader.read(min(remaining, BUFSIZE))
+                        if not buffer:
+                            break
+                        md5_hash.update(buffer)
+                        remaining -= len(buffer)
+                if dest_md5 == md5_hash.hexdigest():
+                    return trans_id, seg_size, segments + 1, md5_hash
+            raise exceptions.TransferException(
+                'md5 of transaction content does not match src: {}'.format(
+                    dest_md5))
+        except Exception as e:
+            self.logger.warning('Cannot resume transaction {} of {}: {}'.format(
+                trans_id, src, str(e)))
+        journal.remove(src)
+        try:
+            kwargs[HEADERS] = combine_headers({PUT_TXN_ID: trans_id,
+                                               PUT_TXN_OP: PUT_TXN_ABORT,
+                                               HTTP_LENGTH: '0'})
+            self._get_session().post(url, verify=self.verify, **kwargs)
+        except Exception as e:
+            self.logger.debug('Cannot abort transaction {}: {}'.format(
+                trans_id, str(e)))
+        return None
+
+    def _journal_put_txn(self, journal, src, url, trans_id, seg_size,
+                         segments, md5_checksum, stat_info):
+        # records the progress of a transaction. Errors are not fatal,
+        # the transaction is just not resumable
+        try:
+            journal.put(src, url, trans_id, seg_size, segments, md5_checksum,
+                        stat_info)
+        except Exception as e:
+            self.logger.warning('Cannot journal transaction {}: {}'.format(
+                trans_id, str(e)))
+
+    def _restart_put_txn(self, url, trans_id, file_size, combine_headers,
+                         **kwargs):
+        # aborts a transaction and starts a new one for the same file.
+        # Returns the id of the new transaction
+        kwargs[HEADERS] = combine_headers({PUT_TXN_ID: trans_id,
+                                           PUT_TXN_OP: PUT_TXN_ABORT,
+                                           HTTP_LENGTH: '0'})
+        self._get_session().post(url, verify=self.verify, **kwargs)
+        kwargs[HEADERS] = combine_headers({
+            HTTP_LENGTH: '0',
+            PUT_TXN_TOTAL_LENGTH: str(file_size),
+            PUT_TXN_OP: PUT_TXN_START})
+        response = self._get_session().put(url, verify=self.verify, **kwargs)
+        new_trans_id = response.headers.get(PUT_TXN_ID, None)
+        if new_trans_id is None:
+            raise exceptions.TransferException(
+                'Cannot restart transaction {} on {}'.format(trans_id, url))
+        self.logger.debug('Transaction {} restarted as {}'.format(
+            trans_id, new_trans_id))
+        return new_trans_id
+
+    def _put_segments_parallel(self, url, src, file_size, seg_size, trans_id,
+                               combine_headers, workers, **kwargs):
+        # sends the segments of a PUT transaction concurrently. Returns the
+        # md5 checksum of the entire file as reported by the server. The
+        # segments can arrive in any order as long as the server places
+        # them according to their Content-Range. Servers that do not are
+        # detected by checking the state of the transaction after the first
+        # batch of segments. A failed segment cannot be reverted without
+        # reverting the segments that arrived after it, hence the first
+        # error or mismatch stops the transfer (TransferException) and the
+        # caller restarts the transaction with sequential segments.
+        num_segments = -(-file_size//seg_size)
+        workers = min(workers, num_segments)
+        # md5 of the first batch of segments and of the entire file
+        batch_size = min(workers*seg_size, file_size)
+        md5_hash = hashlib.md5()
+        checkpoints = []
+        with open(src, 'rb') as reader:
+            for length in (batch_size, file_size - batch_size):
+                while length:
+                    buffer = reader.read(min(length, BUFSIZE))
+                    if not buffer:
+                        break
+                    md5_hash.update(buffer)
+                    length -= len(buffer)
+                checkpoints.append(md5_hash.hexdigest())
+        batch_md5, src_md5 = checkpoints
+        self.logger.debug('Sending {} segments with {} workers'.format(
+            num_segments, workers))
+        failed = threading.Event()
+
+        def put_segment(segment):
+            if failed.is_set():
+                return
+            offset = segment*seg_size
+            cur_seg_size = min(seg_size, file_size-offset)
+            seg_kwargs = dict(kwargs)
+            seg_kwargs[HEADERS] = combine_headers({
+                PUT_TXN_ID: trans_id,
+                HTTP_LENGTH: str(cur_seg_size),
+                HTTP_CONTENT_RANGE: 'bytes {}-{}/{}'.format(
+                    offset, offset + cur_seg_size - 1, file_size)})
+            try:
+                with util.Md5MappedFile(src, offset, cur_seg_size) as reader:
+                    self._get_session().put(url, data=reader,
+                                            verify=self.verify, **seg_kwargs)
+            except BaseException:
+                failed.set()
+                raise
+
+        def put_segments(executor, segments):
+            futures = [executor.submit(put_segment, segment)
+                       for segment in segments]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            except BaseException:
+                failed.set()
+                for future in futures:
+                    future.cancel()
+                raise
+
+        def check_txn(expected_md5):
+            # segments might have arrived in any order, hence the state of
+            # the transaction is only checked once all of them are in
+            kwargs[HEADERS] = combine_headers({PUT_TXN_ID: trans_id,
+                                               HTTP_LENGTH: '0'})
+            response = self._get_session().head(url, **kwargs)
+            dest_md5 = net.extract_md5(response.headers)
+            if dest_md5 != expected_md5:
+                raise exceptions.TransferException(
+                    'File {} not properly uploaded. Mismatched md5 src vs '
+                    'dest: {} vs {}'.format(src, expected_md5, dest_md5))
+            return dest_md5
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers) as executor:
+            put_segments(executor, range(workers))
+            if workers < num_segments:
+                # the server must have placed the first batch of segments
+                # according to their Content-Range before sending the rest
+                check_txn(batch_md5)
+                put_segments(executor, range(workers, num_segments))
+        return check_txn(src_md5)
+
+    @staticmethod
+    def _cache_md5(file_path, md5_checksum, stat_info=None):
+        # saves the checksum of a transferred file in the md5 cache (if used)
+        md5_cache = util.get_md5_cache()
+        if md5_cache and md5_checksum:
+            try:
+                md5_cache.put(file_path, md5_checksum, stat_info)
+            except Exception as e:
+                logging.getLogger('BaseWsClient').debug(
+                    'Cannot cache md5 of {}: {}'.format(file_path, str(e)))
+
     def _log_upload(self, src, start, size):
         duration = time.time() - start
         self.logger.info(
@@ -778,18 +1129,31 @@ class BaseDataClient(BaseWsClient):
 
         Returns:
             str: the md5 hash of the file.
+
+        The hexdigest is looked up in and saved to the persistent md5 cache
+        when the cache is enabled (see cadcutils.util.get_md5_cache).
         """
+        md5_cache = None if undigested else util.get_md5_cache()
+        if md5_cache:
+            md5_checksum = md5_cache.get(file_path)
+            if md5_checksum:
+                return md5_checksum
+            stat_info = os.stat(file_path)
         md5_hash = hashlib.md5()
         buffer_size = 8 * 1024
-        with open(file_path, 'rb') as file:
+        with util.timing_phase('md5'), open(file_path, 'rb') as file:
             while file_buffer := file.read(buffer_size):
                 md5_hash.update(file_buffer)
         if undigested:
             return md5_hash
         else:
+            if md5_cache:
+                BaseDataClient._cache_md5(file_path, md5_hash.hexdigest(),
+                                          stat_info)
             return md5_hash.hexdigest()
 
-    def download_file(self, url, dest=None, **kwargs):
+    def download_file(self, url, dest=None, streams=None, process_bytes=None,
+                      **kwargs):
         """Method to download a file from CADC storage (archive or vospace).
            This method takes advantage of the HTTP Range feature available
            with the CADC services to optimize and make the transfer more
@@ -798,19 +1162,29 @@ class BaseDataClient(BaseWsClient):
            :param dest: name of the file to store it to. If it's the name of
            the directory to save it to, it will use the Content-Disposition for
            the file name. By default, it saves the file in the current
-           directory.
+           directory. dest can also be a binary file-like object (anything
+           with a write method) in which case the content is streamed to it
+           in blocks.
+           :param streams: number of byte ranges of the file to be downloaded
+           at the same time. Default is DOWNLOAD_STREAMS. Only used for
+           large files when the service supports ranges.
+           :param process_bytes: function to be applied to the received bytes
+           (in order). Byte ranges are not downloaded concurrently when set.
            :param kwargs: other http attributes
            :return: (file_name, md5_checksum, file_size)
            :throws: HttpExceptions
 
         """
+        if streams is None:
+            streams = DOWNLOAD_STREAMS
         response = self.get(url, stream=True, **kwargs)
         src_md5 = net.extract_md5(response.headers)
         src_size = int(response.headers.get(HTTP_LENGTH, 0))
         content_disp = net.get_header_filename(response.headers)
-        if hasattr(dest, 'read'):
-            dest.write(response.raw.read())
-            return content_disp, src_md5, src_size
+        if hasattr(dest, 'write'):
+            dest_size = self._stream_bytes(response, src_md5, src_size, dest,
+                                           process_bytes)
+            return content_disp, src_md5, dest_size
         else:
             final_dest, temp_dest = self._resolve_destination_file(
                 dest=dest, src_md5=src_md5, default_file_name=content_disp)
@@ -821,6 +1195,16 @@ class BaseDataClient(BaseWsClient):
                 self.logger.info(
                     'Source and destination identical for {}. Skip transfer!'.format(final_dest))
                 return os.path.basename(final_dest), src_md5, src_size
+            if streams > 1 and src_md5 and process_bytes is None and \
+                    src_size > MIN_DOWNLOAD_RANGE_SIZE and \
+                    not kwargs.get('params') and \
+                    response.headers.get('Accept-Ranges', '').strip() == 'bytes':
+                response.raw.close()  # ranges are requested separately
+                dest_md5 = self._download_ranges(
+                    url, src_size, src_md5, temp_dest, streams, **kwargs)
+                os.rename(temp_dest, final_dest)
+                self._cache_md5(final_dest, dest_md5)
+                return os.path.basename(final_dest), dest_md5, src_size
             if src_md5 and src_size and os.path.isfile(temp_dest):
                 stat_info = os.stat(temp_dest)
                 if not stat_info.st_size or stat_info.st_size >= src_size:
@@ -854,50 +1238,239 @@ class BaseDataClient(BaseWsClient):
                                 'received {}'.format(exp_cr, actual_cr))
             # need to send the original file content-length. The Range response
             # contains the content-length of the range.
-            dest_md5, dest_size = self._save_bytes(response, src_size, temp_dest, None)
+            dest_md5, dest_size = self._save_bytes(response, src_size, temp_dest,
+                                                   process_bytes)
             os.rename(temp_dest, final_dest)
+            self._cache_md5(final_dest, dest_md5)
             return os.path.basename(final_dest), dest_md5, dest_size
 
+    def iter_file(self, url, chunk_size=None, byte_range=None, **kwargs):
+        """
+        Returns an iterator over the content of a file. The content is
+        retrieved as it is consumed and, if the service supports byte
+        ranges, the transfer is resumed from the last received byte after
+        errors. Closing the iterator before the end closes the connection
+        without reading the rest of the content.
+        :param url: URL to get the file from
+        :param chunk_size: size of the returned chunks (the last chunk might
+        be smaller). Default is READ_BLOCK_SIZE
+        :param byte_range: (first, last) tuple with the positions of the first
+        and last bytes (inclusive) to return. last can be None for the end of
+        the file. By default, the whole file is returned.
+        :param kwargs: other http attributes
+        :return: iterator of bytes objects
+        :throws: HttpExceptions when the file cannot be accessed. A
+        TransferException is raised after the last chunk if the size or the
+        md5 checksum of the received content does not match the source.
+        """
+        first, last = byte_range or (0, None)
+        response = self._get_from(url, first, last, **kwargs)
+        return self._iter_response(url, response, first, last, chunk_size,
+                                   **kwargs)
+
+    def _get_from(self, url, first, last, **kwargs):
+        # GETs the url content between positions first and last
+        if not first and last is None:
+            return self.get(url, stream=True, **kwargs)
+        range_kwargs = dict(kwargs)
+        range_kwargs[HEADERS] = dict(kwargs.get(HEADERS) or {})
+        range_kwargs[HEADERS]['Range'] = 'bytes={}-{}'.format(
+            first, '' if last is None else last)
+        response = self.get(url, stream=True, **range_kwargs)
+        if response.status_code != requests.codes.partial_content:
+            response.close()
+            raise exceptions.TransferException(
+                'Expected partial content for range request {}'.format(
+                    range_kwargs[HEADERS]['Range']))
+        return response
+
+    def _iter_response(self, url, response, first, last, chunk_size,
+                       **kwargs):
+        # generator of the response content. The md5 checksum can only be
+        # checked when the whole file is returned
+        src_md5 = None
+        if not first and last is None:
+            src_md5 = net.extract_md5(response.headers)
+        src_length = int(response.headers.get(HTTP_LENGTH, 0))
+        ranges = response.headers.get('Accept-Ranges', '').strip() == 'bytes'
+        hash_md5 = hashlib.md5()
+        position = first
+        retries = MD5_MISMATCH_RETRY
+        try:
+            while True:
+                try:
+                    for chunk in _read_raw(response.raw, chunk_size):
+                        if src_md5:
+                            hash_md5.update(chunk)
+                        position += len(chunk)
+                        yield chunk.tobytes()
+                    break
+                except Exception as e:
+                    retries -= 1
+                    if not retries or not ranges:
+                        raise exceptions.TransferException(
+                            'Transfer interrupted after {} bytes: {}'.format(
+                                position - first, str(e)))
+                    self.logger.warning(
+                        'Errors reading {}: {}. Resume from byte {}'.format(
+                            url, str(e), position))
+                    response.close()
+                    response = self._get_from(url, position, last, **kwargs)
+        finally:
+            response.close()
+        if src_length and src_length != position - first:
+            raise exceptions.TransferException(
+                'Sizes of source and received content do not match: '
+                '{} vs {}'.format(src_length, position - first))
+        if src_md5 and src_md5 != hash_md5.hexdigest():
+            raise exceptions.TransferException(
+                'Received content is corrupted: expected md5({}) != '
+                'actual md5({})'.format(src_md5, hash_md5.hexdigest()))
+
+    def _download_ranges(self, url, src_size, src_md5, dest_file, streams,
+                         **kwargs):
+        # downloads the file in byte ranges that are requested concurrently
+        # and written in place in the preallocated destination file. The
+        # content of a partial download (dest_file shorter than the source)
+        # is kept and only the rest of the file is requested.
+        # Returns the md5 checksum of the downloaded file. The ranges are
+        # received out of order so the md5 is computed by reading the file
+        # once it is complete. Large files are therefore read twice, but
+        # only once: the caller saves the checksum in the md5 cache.
+        resume_from = 0
+        if os.path.isfile(dest_file):
+            resume_from = os.stat(dest_file).st_size
+            if resume_from >= src_size:
+                resume_from = 0
+        range_size = max(-(-(src_size - resume_from)//streams),
+                         MIN_DOWNLOAD_RANGE_SIZE)
+        ranges = [(offset, min(offset + range_size, src_size) - 1)
+                  for offset in range(resume_from, src_size, range_size)]
+        self.logger.debug('Downloading {} in {} byte ranges from {}'.format(
+            url, len(ranges), resume_from))
+        with open(dest_file, 'r+b' if resume_from else 'wb') as f:
+            f.truncate(src_size)
+        # set when a range fails so that the others stop
+        failed = threading.Event()
+
+        def get_range(first, last):
+            position = first
+            retries = MD5_MISMATCH_RETRY
+            with open(dest_file, 'r+b') as f:
+                while position <= last and not failed.is_set():
+                    range_kwargs = dict(kwargs)
+                    range_kwargs[HEADERS] = dict(kwargs.get(HEADERS) or {})
+                    range_kwargs[HEADERS]['Range'] = 'bytes={}-{}'.format(
+                        position, last)
+                    response = self.get(url, stream=True, **range_kwargs)
+                    try:
+                        if response.status_code != \
+                                requests.codes.partial_content:
+                            raise exceptions.TransferException(
+                                'Expected partial content for range '
+                                'request {}'.format(
+                                    range_kwargs[HEADERS]['Range']))
+                        f.seek(position)
+                        for chunk in _read_raw(response.raw):
+                            if failed.is_set():
+                                return
+                            chunk = chunk[:last - position + 1]
+                            f.write(chunk)
+                            position += len(chunk)
+                            if position > last:
+                                break
+                        if position <= last:
+                            raise exceptions.TransferException(
+                                'Incomplete range {}-{}'.format(first, last))
+                    except (requests.exceptions.RequestException,
+                            exceptions.TransferException) as e:
+                        retries -= 1
+                        if not retries:
+                            raise e
+                        self.logger.warning(
+                            'Errors downloading range {}-{} from {}: {}. '
+                            'Retrying'.format(position, last, url, str(e)))
+                    finally:
+                        response.close()
+
+        start = time.time()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(ranges)) as executor:
+                futures = [executor.submit(get_range, first, last)
+                           for first, last in ranges]
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        future.result()
+                except BaseException:
+                    failed.set()
+                    for future in futures:
+                        future.cancel()
+                    raise
+            dest_md5 = BaseDataClient.compute_file_md5(
+                dest_file, undigested=True).hexdigest()
+        except BaseException as e:
+            os.remove(dest_file)
+            raise e
+        if dest_md5 != src_md5:
+            os.remove(dest_file)
+            raise exceptions.TransferException(
+                'Downloaded file is corrupted: expected md5({}) != '
+                'actual md5({})'.format(src_md5, dest_md5))
+        duration = time.time() - start
+        self.logger.info(
+            'Successfully downloaded file {} in {}s '
+            '(avg. speed: {}MB/s)'.format(
+                dest_file, round(duration, 2),
+                round((src_size - resume_from) / 1024 / 1024 / duration, 2)))
+        return dest_md5
+
+    def _stream_bytes(self, response, src_md5, src_length, dest,
+                      process_bytes=None):
+        # writes the content of the response to a file-like object and
+        # checks it against the source md5 and length. Since the content
+        # cannot be taken back from the stream, errors that occur after
+        # the first write are reported as TransferException
+        hash_md5 = hashlib.md5()
+        dest_length = 0
+        start = time.time()
+        try:
+            for chunk in _read_raw(response.raw):
+                if src_md5:
+                    hash_md5.update(chunk)
+                # the buffer of the chunk is reused by the next read and
+                # dest might hold on to what it is given
+                data = chunk.tobytes()
+                if process_bytes is not None:
+                    process_bytes(data)
+                _write_all(dest, data)
+                dest_length += len(data)
+        except Exception as e:
+            if not dest_length:
+                raise e
+            raise exceptions.TransferException(
+                'Transfer interrupted after {} bytes: {}'.format(dest_length,
+                                                                 str(e)))
+        if src_length and src_length != dest_length:
+            raise exceptions.TransferException(
+                'Sizes of source and streamed content do not match: '
+                '{} vs {}'.format(src_length, dest_length))
+        if src_md5 and src_md5 != hash_md5.hexdigest():
+            raise exceptions.TransferException(
+                'Streamed content is corrupted: expected md5({}) != '
+                'actual md5({})'.format(src_md5, hash_md5.hexdigest()))
+        duration = time.time() - start
+        self.logger.info(
+            'Successfully streamed {} bytes in {}s'.format(
+                dest_length, round(duration, 2)))
+        return dest_length
+
     def _save_bytes(self, response, src_length, dest_file, process_bytes=None):
         # requests automatically decompresses the data.
         # Tell it to do it only if it had to
         hash_md5 = hashlib.md5()
         src_md5 = net.extract_md5(response.headers)
 
-        class RawRange(object):
-            """
-            Wrapper class to make response.raw.read work as iterator and behave
-            the same way as the corresponding response.iter_content. Useful
-            with a progress bar.
-            """
-
-            def __init__(self, rsp):
-                """
-                :param rsp: HTTP response object
-                """
-                self._read = rsp.raw.read
-                self.block_size = 0
-
-            def __iter__(self):
-                return self
-
-            def __next__(self):
-                return self.next()
-
-            def next(self):
-                # reads the next raw block
-                data = self._read(self.block_size)
-                if len(data) > 0:
-                    if src_md5:
-                        hash_md5.update(data)
-                    return data
-                else:
-                    raise StopIteration()
-
-            def get_instance(self, block_size):
-                self.block_size = block_size
-                return self
-
         update_mode = 'wb'
         dest_length = 0
         if os.path.isfile(dest_file) and os.stat(dest_file).st_size > 0:
@@ -909,21 +1482,14 @@ class BaseDataClient(BaseWsClient):
             else:
                 os.remove(dest_file)
 
-        rr = RawRange(response)
-        reader = rr.get_instance
-        # TODO - progress bar
-        # if logger.isEnabledFor(logging.INFO) and total_length:
-        #     chunks = progress.bar(reader(
-        #         READ_BLOCK_SIZE),
-        #         expected_size=((total_length / READ_BLOCK_SIZE) + 1))
-        # else:
         dest_downloaded = 0
-        chunks = reader(READ_BLOCK_SIZE)
         start = time.time()
         with open(dest_file, update_mode) as dest:
-            for chunk in chunks:
+            for chunk in _read_raw(response.raw):
+                if src_md5:
+                    hash_md5.update(chunk)
                 if process_bytes is not None:
-                    process_bytes(chunk)
+                    process_bytes(chunk.tobytes())
                 dest.write(chunk)
                 dest_downloaded += len(chunk)
         dest_md5 = hash_md5.hexdigest()
@@ -948,6 +1514,57 @@ class BaseDataClient(BaseWsClient):
         raise exceptions.TransferException(error_msg)
 
 
+def _is_interruption(error):
+    # True if a transfer was interrupted by the user or by a transient
+    # transport error and can be resumed, False if it failed for good
+    # (e.g. 4xx errors or mismatched md5 after all the retries)
+    if not isinstance(error, Exception):
+        return True  # KeyboardInterrupt, SystemExit...
+    if isinstance(error, exceptions.SslException):
+        return False
+    if isinstance(error, exceptions.CircuitOpenException):
+        return True
+    if isinstance(error, exceptions.HttpException):
+        error = error.orig_exception
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and \
+        (response.status_code >= 500 or
+         response.status_code in RetrySession.retry_errors)
+
+
+def _write_all(dest, data):
+    """
+    Writes data to a file-like object. Raw (unbuffered) streams might write
+    only part of the data in one call.
+    :param dest: file-like object
+    :param data: bytes to write
+    """
+    while data:
+        written = dest.write(data)
+        if written is None or written >= len(data):
+            return
+        data = data[written:]
+
+
+def _read_raw(raw, block_size=None):
+    """
+    Iterates over the content of a raw HTTP response. The content is read
+    with readinto into a single buffer that is reused for all the blocks
+    so the returned blocks (memoryview slices of the buffer) are valid only
+    until the next iteration.
+    :param raw: raw response (or any other binary stream)
+    :param block_size: size of the buffer. Default is READ_BLOCK_SIZE
+    """
+    buffer = memoryview(bytearray(block_size or READ_BLOCK_SIZE))
+    while True:
+        size = raw.readinto(buffer)
+        if not size:
+            return
+        yield buffer[:size]
+
+
 def _check_server_version(supported_versions, server_header):
     if not supported_versions or not server_header:
         return
@@ -972,6 +1589,342 @@ def _check_server_version(supported_versions, server_header):
                 'Client and server software not compatible anymore. Please upgrade application.')
 
 
+class BackoffPolicy(object):
+    """
+    Exponential backoff between the retries of a request: the delay starts at
+    `start_delay` and doubles after every retry up to `max_delay`. The
+    Retry-After delay of a server (HTTP 503) replaces the current delay.
+
+    With jitter, the actual delays are random so that the clients that failed
+    at the same time do not retry at the same time either:
+        full - between 0 and the delay
+        equal - between half the delay and the delay
+    Retry-After delays are respected as minimums and spread over up to
+    half of their value.
+    """
+
+    JITTERS = ('none', 'full', 'equal')
+
+    def __init__(self, start_delay=None, max_delay=None, max_retries=None,
+                 jitter=None):
+        """
+        :param start_delay: first delay (sec). Default is DEFAULT_RETRY_DELAY
+        :param max_delay: maximum delay (sec). Default is MAX_RETRY_DELAY
+        :param max_retries: maximum number of retries. Default is
+        MAX_NUM_RETRIES
+        :param jitter: one of JITTERS. Default is none
+        """
+        if jitter not in (None,) + self.JITTERS:
+            raise ValueError('Unknown jitter {}. Expected one of {}'.format(
+                jitter, ', '.join(self.JITTERS)))
+        self.start_delay = start_delay
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.jitter = None if jitter == 'none' else jitter
+
+    @staticmethod
+    def from_env(start_delay=1):
+        """
+        Returns the policy configured in the environment (CADC_RETRY_JITTER
+        and CADC_RETRY_START_DELAY)
+        :param start_delay: start delay when not in the environment. It
+        cannot be less than DEFAULT_RETRY_DELAY.
+        """
+        env_delay = os.getenv(RETRY_START_DELAY_ENV, None)
+        if env_delay:
+            start_delay = float(env_delay)
+        else:
+            start_delay = max(start_delay, DEFAULT_RETRY_DELAY)
+        return BackoffPolicy(start_delay=start_delay,
+                             jitter=os.getenv(RETRY_JITTER_ENV, None))
+
+    def delays(self):
+        """
+        :return: the _Backoff delays of a request
+        """
+        max_delay = MAX_RETRY_DELAY if self.max_delay is None \
+            else self.max_delay
+        start_delay = DEFAULT_RETRY_DELAY if self.start_delay is None \
+            else self.start_delay
+        return _Backoff(self, min(start_delay, max_delay), max_delay)
+
+    @property
+    def retries(self):
+        return MAX_NUM_RETRIES if self.max_retries is None \
+            else self.max_retries
+
+    def _jittered(self, delay, retry_after):
+        if retry_after:
+            return delay + random.uniform(0, delay / 2) if self.jitter \
+                else delay
+        if self.jitter == 'full':
+            return random.uniform(0, delay)
+        elif self.jitter == 'equal':
+            return delay / 2 + random.uniform(0, delay / 2)
+        return delay
+
+
+class _Backoff(object):
+    # delays between the retries of a request
+
+    def __init__(self, policy, start_delay, max_delay):
+        self._policy = policy
+        self._delay = start_delay
+        self._max_delay = max_delay
+
+    def next_delay(self, retry_after=None):
+        """
+        :param retry_after: Retry-After delay sent by the server (if any)
+        :return: sec to wait before the next retry
+        """
+        if retry_after is not None:
+            self._delay = min(retry_after, self._max_delay)
+        delay = self._policy._jittered(self._delay, retry_after is not None)
+        self._delay = min(self._delay * 2, self._max_delay)
+        return delay
+
+
+class RetryBudget(object):
+    """
+    Limits the retries of a client to a ratio of its requests over a sliding
+    time window, with a minimum number of retries per window. Retries in
+    excess fail the requests immediately, which prevents clients from
+    overloading a struggling service with retries. Instances can be shared
+    between threads.
+    """
+
+    def __init__(self, ratio=0.2, min_retries=10, window=10):
+        """
+        :param ratio: retries allowed for each request
+        :param min_retries: retries allowed in a window regardless of the
+        number of requests
+        :param window: duration of the window (sec)
+        """
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        for times in (self._requests, self._retries):
+            while times and times[0] < now - self.window:
+                times.popleft()
+
+    def record_request(self):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            self._requests.append(now)
+
+    def try_retry(self):
+        """
+        Withdraws a retry from the budget
+        :return: True if the retry is allowed, False otherwise
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if len(self._retries) + 1 > \
+                    self.min_retries + self.ratio * len(self._requests):
+                return False
+            self._retries.append(now)
+            return True
+
+
+class CircuitBreaker(object):
+    """
+    Per host circuit breaker. The circuit of a host opens after a number of
+    consecutive failed requests (transient HTTP errors, timeouts, connection
+    errors that persist once the retries of a request are used up) and the
+    requests to the host fail immediately (CircuitOpenException)
+    for `reset_timeout` sec. A trial request is then let through: the circuit
+    closes when it succeeds and opens again otherwise. Instances can be
+    shared between threads.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=None):
+        """
+        :param failure_threshold: consecutive failures that open the circuit
+        :param reset_timeout: sec the circuit stays open. Default is
+        CIRCUIT_RESET_TIMEOUT
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = CIRCUIT_RESET_TIMEOUT if reset_timeout is None \
+            else reset_timeout
+        self._hosts = {}  # host -> [consecutive failures, time opened]
+        self._lock = threading.Lock()
+
+    def check(self, host):
+        """
+        Raises CircuitOpenException if requests to host are not allowed
+        :param host: host of the request
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state[1] is None:
+                return
+            now = time.time()
+            if now - state[1] < self.reset_timeout:
+                raise exceptions.CircuitOpenException(
+                    'Too many failures of {}. Requests suspended for {}s'.
+                    format(host, round(self.reset_timeout - now + state[1])))
+            # trial request. The circuit stays open for the other requests
+            # (they are raised on) until the outcome of the trial is recorded
+            state[1] = now
+
+    def is_open(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            return state is not None and state[1] is not None and \
+                time.time() - state[1] < self.reset_timeout
+
+    def record_success(self, host):
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def record_failure(self, host):
+        with self._lock:
+            state = self._hosts.setdefault(host, [0, None])
+            state[0] += 1
+            if state[0] >= self.failure_threshold:
+                if state[1] is None:
+                    logging.getLogger('CircuitBreaker').warning(
+                        'Too many failures of {}. Requests suspended for '
+                        '{}s'.format(host, self.reset_timeout))
+                state[1] = time.time()
+
+
+def get_circuit_breaker():
+    """
+    Returns the circuit breaker shared by the sessions of the process or
+    None when not enabled (CADC_CIRCUIT_BREAKER environment variable set to
+    the number of consecutive failures that open a circuit)
+    """
+    threshold = os.getenv(CIRCUIT_BREAKER_ENV, None)
+    if not threshold or int(threshold) <= 0:
+        return None
+    threshold = int(threshold)
+    with get_circuit_breaker.lock:
+        if threshold not in get_circuit_breaker.caches:
+            get_circuit_breaker.caches[threshold] = CircuitBreaker(threshold)
+        return get_circuit_breaker.caches[threshold]
+
+
+get_circuit_breaker.caches = {}  # circuit breakers by threshold
+get_circuit_breaker.lock = threading.Lock()
+
+
+class RequestEvent(object):
+    """
+    Outcome of a request sent by a RetrySession and passed to the request
+    listeners once the request completed, including all its retries.
+    Attributes:
+        method, url, host - the request
+        status - HTTP status of the last response or None if no response
+        bytes_sent - size of the request body
+        bytes_received - size of the response body (Content-Length) or None
+        if unknown
+        latency - sec between sending the last attempt and the response
+        headers (connection and TLS setup included)
+        duration - total sec of the request, retries and backoff included.
+        Streamed response bodies are read after the request completed and
+        are not included.
+        retries - number of retries
+        backoff - sec slept before the retries (Retry-After included)
+        server - Server header of the last response
+        error - the exception raised by the request or None
+    """
+
+    def __init__(self, request):
+        self.method = request.method
+        self.url = str(request.url)
+        self.status = None
+        try:
+            self.bytes_sent = int(request.headers.get('Content-Length', 0))
+        except (TypeError, ValueError):
+            self.bytes_sent = 0
+        self.bytes_received = None
+        self.latency = None
+        self.duration = None
+        self.retries = 0
+        self.backoff = 0
+        self.server = None
+        self.error = None
+
+    @property
+    def host(self):
+        return urlparse(self.url).netloc
+
+    def record_response(self, response, latency=None):
+        self.status = response.status_code
+        self.latency = response.elapsed.total_seconds() if latency is None \
+            else latency
+        self.server = response.headers.get('Server', None)
+        try:
+            self.bytes_received = int(response.headers['Content-Length'])
+        except (KeyError, TypeError, ValueError):
+            self.bytes_received = None
+
+    def __str__(self):
+        return ('{} {} status={} sent={} received={} latency={} duration={} '
+                'retries={} backoff={} server={} error={}').format(
+            self.method, self.url, self.status, self.bytes_sent,
+            self.bytes_received, self.latency, self.duration, self.retries,
+            self.backoff, self.server,
+            None if self.error is None else repr(self.error))
+
+
+def add_request_listener(listener):
+    """
+    Adds a listener to the requests of all the sessions.
+    :param listener: callable that receives a RequestEvent after each
+    request. It is called in the thread that sent the request and must not
+    block. Its exceptions are logged and ignored.
+    """
+    if listener not in _request_listeners:
+        _request_listeners.append(listener)
+
+
+def remove_request_listener(listener):
+    """
+    Removes a listener added with add_request_listener
+    :param listener: listener to remove
+    """
+    if listener in _request_listeners:
+        _request_listeners.remove(listener)
+
+
+def get_env_listeners():
+    """
+    Returns the request listeners listed in the CADC_REQUEST_METRICS
+    environment variable (see the metrics module for the format). The
+    listeners are built once per configuration. An invalid configuration
+    (e.g. unknown listener or missing optional package) is logged and
+    results in no listeners.
+    """
+    config = os.getenv(REQUEST_METRICS_ENV, None)
+    if not config:
+        return []
+    with get_env_listeners.lock:
+        if config not in get_env_listeners.caches:
+            try:
+                from . import metrics
+                listeners = metrics.listeners_from_config(config)
+            except Exception as e:
+                logging.getLogger('RetrySession').warning(
+                    'Cannot create the request listeners of {}={}: {}'.format(
+                        REQUEST_METRICS_ENV, config, e))
+                listeners = []
+            get_env_listeners.caches[config] = listeners
+        return get_env_listeners.caches[config]
+
+
+get_env_listeners.caches = {}  # listeners by config
+get_env_listeners.lock = threading.Lock()
+
+
 class RetrySession(Session):
     """ Session that automatically does a number of retries for failed
         transient errors. The time between retries double every time until a
@@ -1003,7 +1956,9 @@ class RetrySession(Session):
                     requests.codes.payment]
 
     def __init__(self, retry=True, start_delay=1, idempotent_posts=False,
-                 *args, **kwargs):
+                 pool_connections=None, pool_maxsize=None, pool_block=None,
+                 keep_alive=True, retry_policy=None, retry_budget=None,
+                 circuit_breaker=None, *args, **kwargs):
         """
         ::param retry: set to False if retries not required
         ::param start_delay: start delay interval between retries (default=1s).
@@ -1013,13 +1968,76 @@ class RetrySession(Session):
         and they are not automatically re-tried on failures. Setting this flag
         to true can override that, in case when a specific client-server
         implementation can handle duplicate POST requests at a higher level.
+        ::param pool_connections: number of hosts with pooled connections
+        (default=POOL_CONNECTIONS)
+        ::param pool_maxsize: maximum number of connections kept alive for
+        each host (default=POOL_MAXSIZE)
+        ::param pool_block: wait for a pooled connection to become available
+        instead of opening a new one (default=POOL_BLOCK)
+        ::param keep_alive: set to False to close the connections after
+        each request
+        ::param retry_policy: BackoffPolicy of the retries. Default is the
+        policy configured in the environment (see BackoffPolicy.from_env)
+        ::param retry_budget: RetryBudget of the session. Default is a budget
+        with the ratio in the CADC_RETRY_BUDGET environment variable (no
+        budget when not set)
+        ::param circuit_breaker: CircuitBreaker of the hosts. Default is the
+        one configured in the environment (see get_circuit_breaker)
+
+        Besides the listeners of all the sessions (add_request_listener),
+        callables in the `listeners` attribute receive the RequestEvent of
+        each request sent by this session.
         """
         self.logger = logging.getLogger('RetrySession')
+        self.listeners = []
         self.retry = retry
         self.start_delay = start_delay
         self.idempotent_posts = idempotent_posts
+        self.retry_policy = retry_policy or \
+            BackoffPolicy.from_env(start_delay)
+        if retry_budget is None and os.getenv(RETRY_BUDGET_ENV, None):
+            retry_budget = RetryBudget(float(os.getenv(RETRY_BUDGET_ENV)))
+        self.retry_budget = retry_budget
+        self.circuit_breaker = circuit_breaker if circuit_breaker \
+            is not None else get_circuit_breaker()
         super(RetrySession, self).__init__(*args, **kwargs)
         self._server_versions = None  # server versions that client supports
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_connections or POOL_CONNECTIONS,
+            pool_maxsize=pool_maxsize or POOL_MAXSIZE,
+            pool_block=POOL_BLOCK if pool_block is None else pool_block)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.keep_alive = keep_alive
+        if not keep_alive:
+            self.headers['Connection'] = 'close'
+
+    def connection_stats(self):
+        """
+        Statistics of the connections to each host that has a connection pool
+        :return: dictionary of the form {host: {'connections': number of
+        connections opened, 'requests': number of requests sent, 'reused':
+        number of requests that reused a connection}}
+        """
+        stats = {}
+        for adapter in set(self.adapters.values()):
+            pools = getattr(adapter, 'poolmanager', None)
+            if pools is None:
+                continue
+            for key in pools.pools.keys():
+                pool = pools.pools.get(key)
+                if pool is None:
+                    continue
+                host_stats = stats.setdefault(
+                    pool.host, {'connections': 0, 'requests': 0, 'reused': 0})
+                host_stats['connections'] += pool.num_connections
+                host_stats['requests'] += pool.num_requests
+                if self.keep_alive:
+                    # connections closed by the client are transparently
+                    # reopened and they are not reused
+                    host_stats['reused'] += \
+                        max(pool.num_requests - pool.num_connections, 0)
+        return stats
 
     @property
     def server_versions(self):
@@ -1062,6 +2080,27 @@ class RetrySession(Session):
         :return: the response
         :rtype: requests.Response
         """
+        event = RequestEvent(request)
+        start = time.time()
+        try:
+            return self._send(request, event, **kwargs)
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            event.duration = time.time() - start
+            self._notify(event)
+
+    def _notify(self, event):
+        for listener in self.listeners + _request_listeners + \
+                get_env_listeners():
+            try:
+                listener(event)
+            except Exception as e:
+                self.logger.warning(
+                    'Request listener {} failed: {}'.format(listener, e))
+
+    def _send(self, request, event, **kwargs):
         # merge kwargs with env
         proxies = kwargs.get('proxies') or {}
         settings = self.merge_environment_settings(
@@ -1078,18 +2117,29 @@ class RetrySession(Session):
             self.logger.debug(
                 'POST requests considered idempotent. re-tries enabled')
 
+        # host of the circuit breaker (if any)
+        host = None
+        if self.circuit_breaker is not None:
+            host = event.host
+            self.circuit_breaker.check(host)
+
         if (request.method.upper() != 'POST' or self.idempotent_posts) \
            and self.retry:
-            current_delay = max(self.start_delay, DEFAULT_RETRY_DELAY)
-            current_delay = min(current_delay, MAX_RETRY_DELAY)
+            delays = self.retry_policy.delays()
+            if self.retry_budget is not None:
+                self.retry_budget.record_request()
             num_retries = 0
             self.logger.debug(
                 "Sending request {0}  to server.".format(request))
             current_error = None
             while True:
+                retry_after = None
                 try:
                     response = super(RetrySession, self).send(request,
                                                               **kwargs)
+                    event.record_response(response)
+                    if response.status_code not in self.retry_errors:
+                        self._record_host(host, failed=False)
                     self.check_status(response)
                     return response
                 except requests.exceptions.ConnectTimeout as ct:
@@ -1099,6 +2149,7 @@ class RetrySession(Session):
                 except requests.exceptions.ReadTimeout as rt:
                     # this could happen after the request has made it to
                     # the server so it should be re-done
+                    self._record_host(host, failed=True)
                     raise exceptions.TransferException(
                         'Read timeout on {}'.format(request.url), rt)
                 except requests.HTTPError as e:
@@ -1108,37 +2159,62 @@ class RetrySession(Session):
                     if e.response.status_code == requests.codes.unavailable:
                         # is there a delay from the server (Retry-After)?
                         try:
-                            current_delay = int(
-                                e.response.headers.get(SERVICE_RETRY,
-                                                       current_delay))
-                            current_delay = min(current_delay, MAX_RETRY_DELAY)
+                            retry_after = int(
+                                e.response.headers[SERVICE_RETRY])
                         except Exception:
                             pass
                 except requests.ConnectionError as ce:
+                    self._record_host(host, failed=True)
                     raise ssl_errors.connection_error_to_exception(
                         ce, url=request.url,
                         cert=kwargs.get('cert') or getattr(self, 'cert', None))
-                if num_retries == MAX_NUM_RETRIES:
+                if num_retries == self.retry_policy.retries:
+                    break
+                if host is not None and self.circuit_breaker.is_open(host):
+                    # fail fast so that the caller can try another endpoint
+                    raise exceptions.CircuitOpenException(
+                        'Too many failures of {}: {}'.format(
+                            host, str(current_error)), current_error)
+                if self.retry_budget is not None and \
+                        not self.retry_budget.try_retry():
+                    self.logger.debug('Retry budget exhausted')
                     break
+                current_delay = delays.next_delay(retry_after)
                 self.logger.debug(
                     "Error {}. Resending request in {}s ...".format(
                         str(current_error), current_delay))
                 time.sleep(current_delay)
                 num_retries += 1
-                current_delay = min(current_delay * 2, MAX_RETRY_DELAY)
+                event.retries = num_retries
+                event.backoff += current_delay
+            # one failure per request, once its retries are used up
+            self._record_host(host, failed=True)
             raise exceptions.HttpException(current_error)
         else:
             try:
                 response = super(RetrySession, self).send(request, **kwargs)
+                event.record_response(response)
             except requests.ConnectionError as ce:
+                self._record_host(host, failed=True)
                 if isinstance(ce, requests.exceptions.ConnectTimeout):
                     raise
                 raise ssl_errors.connection_error_to_exception(
                     ce, url=request.url,
                     cert=kwargs.get('cert') or getattr(self, 'cert', None))
+            self._record_host(
+                host, failed=response.status_code in self.retry_errors)
             self.check_status(response, retry=False)
             return response
 
+    def _record_host(self, host, failed):
+        # outcome of a request for the circuit breaker
+        if host is None:
+            return
+        if failed:
+            self.circuit_breaker.record_failure(host)
+        else:
+            self.circuit_breaker.record_success(host)
+
     def check_status(self, response, retry=True):
         """
         Check the response status. Maps the application related requests
@@ -1151,28 +2227,32 @@ class RetrySession(Session):
         try:
             response.raise_for_status()
         except requests.HTTPError as e:
-            if e.response.status_code == requests.codes.not_found:
-                raise exceptions.NotFoundException(orig_exception=e)
-            elif e.response.status_code == requests.codes.unauthorized:
-                raise exceptions.UnauthorizedException(orig_exception=e)
-            elif e.response.status_code == requests.codes.forbidden:
-                raise exceptions.ForbiddenException(orig_exception=e)
-            elif e.response.status_code == requests.codes.bad_request:
-                raise exceptions.BadRequestException(orig_exception=e)
-            elif e.response.status_code == requests.codes.precondition_failed:
-                raise exceptions.PreconditionFailedException(orig_exception=e)
-            elif e.response.status_code == requests.codes.conflict:
-                raise exceptions.AlreadyExistsException(orig_exception=e)
-            elif e.response.status_code == \
-                    requests.codes.internal_server_error:
-                raise exceptions.InternalServerException(orig_exception=e)
-            elif e.response.status_code == \
-                    requests.codes.request_entity_too_large:
-                raise exceptions.ByteLimitException(orig_exception=e)
-            elif retry and e.response.status_code in self.retry_errors:
+            if retry and e.response.status_code in self.retry_errors:
                 raise e
-            else:
-                raise exceptions.UnexpectedException(orig_exception=e)
+            raise _status_exception(e)
+
+
+def _status_exception(error):
+    # maps the requests.HTTPError of an application related error status to
+    # the corresponding exception
+    status_code = error.response.status_code
+    if status_code == requests.codes.not_found:
+        return exceptions.NotFoundException(orig_exception=error)
+    elif status_code == requests.codes.unauthorized:
+        return exceptions.UnauthorizedException(orig_exception=error)
+    elif status_code == requests.codes.forbidden:
+        return exceptions.ForbiddenException(orig_exception=error)
+    elif status_code == requests.codes.bad_request:
+        return exceptions.BadRequestException(orig_exception=error)
+    elif status_code == requests.codes.precondition_failed:
+        return exceptions.PreconditionFailedException(orig_exception=error)
+    elif status_code == requests.codes.conflict:
+        return exceptions.AlreadyExistsException(orig_exception=error)
+    elif status_code == requests.codes.internal_server_error:
+        return exceptions.InternalServerException(orig_exception=error)
+    elif status_code == requests.codes.request_entity_too_large:
+        return exceptions.ByteLimitException(orig_exception=error)
+    return exceptions.UnexpectedException(orig_exception=error)
 
 
 DEFAULT_REGISTRY = \
@@ -1182,12 +2262,26 @@ CACHE_LOCATION = os.path.join(os.path.expanduser("~"), '.config',
                               'cadc-registry')
 REGISTRY_FILE = 'resource-caps'
 
+# Registry and capabilities information shared by all the WsCapabilities
+# instances of the process. Values are tuples of the parsed content and the
+# time it was refreshed.
+_registry_cache = {}  # registry URL -> {resource ID: capabilities URL}
+_capabilities_cache = {}  # (resource ID, host) -> Capabilities
+_cache_lock = threading.Lock()
+
 
 class WsCapabilities(object):
     """
     Contains the capabilities of Web Services. The most useful function is
     get_access_url that returns the url corresponding to a feature of a
     Web Service
+
+    The registry and the capabilities are kept as snapshots, tuples of the
+    parsed content and the time it was refreshed, that are never modified
+    once built and are replaced as a whole on refresh. Threads can therefore
+    use the same instance without locking. Assigning `capabilities`,
+    `last_capstime`, `caps_urls` or `last_regtime` (for instance to preload
+    or reset them) replaces the corresponding snapshot.
     """
 
     def __init__(self, ws_client, host=None):
@@ -1220,12 +2314,12 @@ class WsCapabilities(object):
         # prefix the name of the file with '.' to avoid collisions with
         # subdirectory names
         self.caps_file = '/.'.join(self.caps_file.rsplit('/', 1))
-        self.last_regtime = 0
-        self.last_capstime = 0
         self._caps_reader = wscapabilities.CapabilitiesReader()
-        self.caps_urls = {}
+        self._registry = ({}, 0)
+        self._capabilities = ({}, 0)
+        # serializes the assignments of the snapshot attributes
+        self._lock = threading.Lock()
         self.features = {}
-        self.capabilities = {}
 
     def get_access_url(self, feature, interface_type='vs:ParamHTTP'):
         """
@@ -1237,26 +2331,101 @@ class WsCapabilities(object):
         :return: corresponding access URL
         """
 
-        if (time.time() - self.last_capstime) > REG_REFRESH_INTERVAL:
-            caps = util.get_url_content(url=self._get_capability_url(),
-                                        cache_file=self.caps_file,
-                                        refresh_interval=REG_REFRESH_INTERVAL,
-                                        verify=self.ws.verify)
-            # caps is a string but it's xml content claims it's utf-8 encode,
-            # hence need to encode it before
-            # parsing it.
-            self.capabilities = self._caps_reader.parsexml(
-                caps.encode('utf-8'))
-            if (time.time() - self.last_capstime) > REG_REFRESH_INTERVAL:
-                self.last_capstime = time.time()
+        capabilities, capstime = self._capabilities
+        if (time.time() - capstime) > REG_REFRESH_INTERVAL:
+            self._capabilities = self._get_capabilities()
+            capabilities = self._capabilities[0]
         sms = self.ws.subject.get_security_methods()
 
-        return self.capabilities.get_access_url(feature, sms, interface_type)
+        return capabilities.get_access_url(feature, sms, interface_type)
 
     @property
     def host(self):
         return self._host
 
+    @property
+    def capabilities(self):
+        return self._capabilities[0]
+
+    @capabilities.setter
+    def capabilities(self, capabilities):
+        with self._lock:
+            self._capabilities = (capabilities, self._capabilities[1])
+
+    @property
+    def last_capstime(self):
+        return self._capabilities[1]
+
+    @last_capstime.setter
+    def last_capstime(self, capstime):
+        with self._lock:
+            self._capabilities = (self._capabilities[0], capstime)
+
+    @property
+    def caps_urls(self):
+        return self._registry[0]
+
+    @caps_urls.setter
+    def caps_urls(self, caps_urls):
+        with self._lock:
+            self._registry = (caps_urls, self._registry[1])
+
+    @property
+    def last_regtime(self):
+        return self._registry[1]
+
+    @last_regtime.setter
+    def last_regtime(self, regtime):
+        with self._lock:
+            self._registry = (self._registry[0], regtime)
+
+    def _get_capabilities(self):
+        # returns the capabilities of the service and the time they were
+        # refreshed. Parsed capabilities are shared by all the clients of
+        # the service in the process.
+        caps_url = self._get_capability_url()
+        key = (self.ws.resource_id, self._host)
+        with _cache_lock:
+            cached = _capabilities_cache.get(key)
+        if cached and (time.time() - cached[1]) <= REG_REFRESH_INTERVAL:
+            return cached
+        caps = util.get_url_content(url=caps_url,
+                                    cache_file=self.caps_file,
+                                    refresh_interval=REG_REFRESH_INTERVAL,
+                                    verify=self.ws.verify)
+        # caps is a string but it's xml content claims it's utf-8 encode,
+        # hence need to encode it before
+        # parsing it.
+        cached = (self._caps_reader.parsexml(caps.encode('utf-8')),
+                  _get_refresh_time(self.caps_file))
+        with _cache_lock:
+            _capabilities_cache[key] = cached
+        return cached
+
+    def _get_registry(self, registry_url):
+        # returns the resource IDs and corresponding capabilities URLs in the
+        # registry and the time they were refreshed. They are shared by all
+        # the clients in the process.
+        with _cache_lock:
+            cached = _registry_cache.get(registry_url)
+        if cached and (time.time() - cached[1]) <= REG_REFRESH_INTERVAL:
+            return cached
+        reg = util.get_url_content(url=registry_url,
+                                   cache_file=self.reg_file,
+                                   refresh_interval=REG_REFRESH_INTERVAL,
+                                   verify=self.ws.verify)
+        caps_urls = {}
+        # parse it
+        for line in reg.split('\n'):
+            if not line.startswith('#') and (len(line) > 0):
+                feature, url = line.split('=')
+                caps_urls[feature.strip()] = url.strip()
+        cached = (types.MappingProxyType(caps_urls),
+                  _get_refresh_time(self.reg_file))
+        with _cache_lock:
+            _registry_cache[registry_url] = cached
+        return cached
+
     def _get_capability_url(self):
         """
         Parses the registry information and returns the url of the
@@ -1265,15 +2434,8 @@ class WsCapabilities(object):
         """
         if self.ws.resource_id.startswith('http'):
             return '{}/capabilities'.format(self.ws.resource_id)
-        if (time.time() - self.last_regtime) > REG_REFRESH_INTERVAL:
-            if self.last_regtime == 0:
-                # startup
-                try:
-                    self.last_regtime = os.path.getmtime(self.reg_file)
-                except OSError:
-                    # cannot read the cache file for whatever reason
-                    pass
-
+        caps_urls, regtime = self._registry
+        if (time.time() - regtime) > REG_REFRESH_INTERVAL:
             # replace registry host name if necessary
             registry_url = DEFAULT_REGISTRY
             url = urlparse(registry_url)
@@ -1281,21 +2443,18 @@ class WsCapabilities(object):
                 registry_url = '{}://{}{}'.format(url.scheme, self._host,
                                                   url.path)
             self.logger.debug('Resolved URL: {}'.format(registry_url))
-
-            reg = util.get_url_content(url=registry_url,
-                                       cache_file=self.reg_file,
-                                       refresh_interval=REG_REFRESH_INTERVAL,
-                                       verify=self.ws.verify)
-            self.caps_urls = {}
-            if (time.time() - self.last_regtime) > REG_REFRESH_INTERVAL:
-                self.last_regtime = time.time()
-            # parse it
-            for line in reg.split('\n'):
-                if not line.startswith('#') and (len(line) > 0):
-                    feature, url = line.split('=')
-                    self.caps_urls[feature.strip()] = url.strip()
-        if self.ws.resource_id not in self.caps_urls:
+            self._registry = self._get_registry(registry_url)
+            caps_urls = self._registry[0]
+        if self.ws.resource_id not in caps_urls:
             raise AttributeError(
                 'Resource ID {} not found. Available resource IDs: {}'.
-                format(self.ws.resource_id, self.caps_urls.keys()))
-        return self.caps_urls[self.ws.resource_id]
+                format(self.ws.resource_id, caps_urls.keys()))
+        return caps_urls[self.ws.resource_id]
+
+
+def _get_refresh_time(cache_file):
+    # time the content of a cache file was refreshed
+    try:
+        return min(time.time(), os.path.getmtime(cache_file))
+    except OSError:
+        return time.time()
@@ -71,7 +71,6 @@ Web Service capabilities information
 """
 
 import logging
-from lxml import etree
 
 from urllib.parse import urlparse
 
@@ -240,6 +239,7 @@ class CapabilitiesReader(object):
             raise ValueError(
                 'Cannot access remote service info (capabilities). Likely '
                 'due to network error. Please re-try.')
+        from lxml import etree
         try:
             doc = etree.fromstring(content)
         except Exception as e:
@@ -9,7 +9,14 @@ The following functions are meant to be imported directly from cadcutils.util:
     - get_logger: returns a logger that logs in CADC format
     - get_log_level: returns the logger level
     - get_base_parser: creates a basic parser for CADC web app applications
+    - get_md5_cache: returns the persistent cache of md5 checksums of files
+    - get_put_journal: returns the journal of resumable PUT transactions
+    - TimingReport, transfer_timing, timing_phase: breakdown of the time
+    spent in the phases of transfers
 
 """
 from .utils import *  # noqa
 from .config import *  # noqa
+from .md5_cache import *  # noqa
+from .put_journal import *  # noqa
+from .timing import *  # noqa
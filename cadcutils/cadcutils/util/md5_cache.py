@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#
+# ***********************************************************************
+"""
+Persistent cache of the md5 checksums of local files. Checksums are stored in
+a SQLite database and are keyed by the device and inode of the file. An entry
+is only valid as long as the size and the modification time of the file
+are the same as when the checksum was computed.
+
+The cache is not used unless the CADC_MD5_CACHE environment variable is set,
+either to the location of the database file or to "1" for the default
+location.
+"""
+
+import logging
+import os
+import threading
+
+__all__ = ['Md5Cache', 'get_md5_cache']
+
+DEFAULT_MD5_CACHE = os.path.join(os.path.expanduser("~"), '.config',
+                                 'cadcutils', 'caches', 'md5_cache.db')
+MD5_CACHE_ENV = 'CADC_MD5_CACHE'
+
+logger = logging.getLogger(__name__)
+
+
+class Md5Cache(object):
+    """
+    Cache of the md5 checksums of local files. Instances can be shared
+    between threads and the same database can be used by multiple processes.
+    """
+
+    def __init__(self, location=DEFAULT_MD5_CACHE):
+        """
+        :param location: location of the SQLite database file
+        """
+        self.location = location
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        self._lock = threading.Lock()
+        import sqlite3
+        self._conn = sqlite3.connect(location, timeout=30,
+                                     check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS md5 ('
+                'device INTEGER, inode INTEGER, size INTEGER, '
+                'mtime_ns INTEGER, path TEXT, md5 TEXT, '
+                'PRIMARY KEY (device, inode))')
+
+    def get(self, file_path):
+        """
+        Returns the cached md5 checksum of a file
+        :param file_path: location of the file
+        :return: md5 checksum (hex) or None if not cached or file changed
+        """
+        stat_info = os.stat(file_path)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT md5 FROM md5 WHERE device=? AND inode=? AND size=? '
+                'AND mtime_ns=?',
+                (stat_info.st_dev, stat_info.st_ino, stat_info.st_size,
+                 stat_info.st_mtime_ns)).fetchone()
+        if row:
+            logger.debug('Cached md5 of {}: {}'.format(file_path, row[0]))
+            return row[0]
+        return None
+
+    def put(self, file_path, md5_checksum, stat_info=None):
+        """
+        Saves the md5 checksum of a file
+        :param file_path: location of the file
+        :param md5_checksum: md5 checksum (hex) of the content of the file
+        :param stat_info: the os.stat of the file at the time the checksum
+        was computed. The entry is not saved if the file has changed since.
+        """
+        current = os.stat(file_path)
+        if stat_info is not None and \
+                (stat_info.st_dev, stat_info.st_ino, stat_info.st_size,
+                 stat_info.st_mtime_ns) != \
+                (current.st_dev, current.st_ino, current.st_size,
+                 current.st_mtime_ns):
+            logger.debug('{} changed while computing md5'.format(file_path))
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO md5 VALUES (?, ?, ?, ?, ?, ?)',
+                (current.st_dev, current.st_ino, current.st_size,
+                 current.st_mtime_ns, os.path.abspath(file_path),
+                 md5_checksum))
+
+
+def get_md5_cache():
+    """
+    Returns the md5 cache of the process or None when the cache is not
+    enabled (CADC_MD5_CACHE environment variable)
+    """
+    location = os.getenv(MD5_CACHE_ENV, None)
+    if not location or location.lower() in ['0', 'false', 'no']:
+        return None
+    if location.lower() in ['1', 'true', 'yes']:
+        location = DEFAULT_MD5_CACHE
+    with get_md5_cache.lock:
+        if location not in get_md5_cache.caches:
+            try:
+                get_md5_cache.caches[location] = Md5Cache(location)
+            except Exception as e:
+                logger.warning(
+                    'Cannot use md5 cache {}: {}'.format(location, str(e)))
+                get_md5_cache.caches[location] = None
+        return get_md5_cache.caches[location]
+
+
+get_md5_cache.caches = {}  # caches by location
+get_md5_cache.lock = threading.Lock()
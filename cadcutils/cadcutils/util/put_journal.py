@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#
+# ***********************************************************************
+
+"""
+Journal of the segmented PUT transactions in progress. An entry records the
+transaction of a local file and the number of segments that the service
+has acknowledged so that a later upload of the same (unchanged) file to the
+same URL can resume the transaction instead of starting over.
+
+Entries are JSON files (one per source file) in the journal directory. The
+journal is not used unless the CADC_PUT_JOURNAL environment variable is set,
+either to the location of the journal directory or to "1" for the default
+location.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from .utils import _write_file_atomically
+
+__all__ = ['PutJournal', 'get_put_journal']
+
+DEFAULT_PUT_JOURNAL = os.path.join(os.path.expanduser("~"), '.config',
+                                   'cadcutils', 'put_journal')
+PUT_JOURNAL_ENV = 'CADC_PUT_JOURNAL'
+
+logger = logging.getLogger(__name__)
+
+
+class PutJournal(object):
+    """
+    Journal of PUT transactions. Instances can be shared between threads.
+    """
+
+    def __init__(self, location=DEFAULT_PUT_JOURNAL):
+        """
+        :param location: directory of the journal entries
+        """
+        self.location = location
+        os.makedirs(location, exist_ok=True)
+
+    def _entry_file(self, file_path):
+        key = hashlib.sha1(os.path.realpath(file_path).encode()).hexdigest()
+        return os.path.join(self.location, '{}.json'.format(key))
+
+    def get(self, file_path, url):
+        """
+        Returns the journal entry of the transaction of a file
+        :param file_path: location of the file
+        :param url: destination URL of the file
+        :return: dictionary with the url, trans_id, seg_size, segments (number
+        of acknowledged segments) and md5 (checksum of the acknowledged
+        segments) of the transaction or None if the journal does not have a
+        valid entry for the file. Entries of files that changed since are
+        removed.
+        """
+        entry_file = self._entry_file(file_path)
+        try:
+            with open(entry_file) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning('Cannot read journal entry {} of {}: {}'.format(
+                entry_file, file_path, str(e)))
+            return None
+        stat_info = os.stat(file_path)
+        if (entry.get('size'), entry.get('mtime_ns')) != \
+                (stat_info.st_size, stat_info.st_mtime_ns):
+            logger.debug('{} changed since transaction {}'.format(
+                file_path, entry.get('trans_id')))
+            self.remove(file_path)
+            return None
+        if entry.get('url') != url:
+            return None
+        return entry
+
+    def put(self, file_path, url, trans_id, seg_size, segments, md5_checksum,
+            stat_info=None):
+        """
+        Saves the state of the transaction of a file
+        :param file_path: location of the file
+        :param url: destination URL of the file
+        :param trans_id: ID of the PUT transaction
+        :param seg_size: size of the segments of the transaction
+        :param segments: number of segments acknowledged by the service
+        :param md5_checksum: md5 checksum (hex) of the acknowledged segments
+        :param stat_info: the os.stat of the file at the start of the
+        transaction. Default is the current one.
+        """
+        if stat_info is None:
+            stat_info = os.stat(file_path)
+        entry = {'path': os.path.realpath(file_path),
+                 'size': stat_info.st_size,
+                 'mtime_ns': stat_info.st_mtime_ns,
+                 'url': url,
+                 'trans_id': trans_id,
+                 'seg_size': seg_size,
+                 'segments': segments,
+                 'md5': md5_checksum}
+        _write_file_atomically(self._entry_file(file_path), json.dumps(entry))
+
+    def remove(self, file_path):
+        """
+        Removes the journal entry of a file (if any)
+        :param file_path: location of the file
+        """
+        try:
+            os.remove(self._entry_file(file_path))
+        except FileNotFoundError:
+            pass
+
+
+def get_put_journal():
+    """
+    Returns the PUT transactions journal of the process or None when the
+    journal is not enabled (CADC_PUT_JOURNAL environment variable)
+    """
+    location = os.getenv(PUT_JOURNAL_ENV, None)
+    if not location or location.lower() in ['0', 'false', 'no']:
+        return None
+    if location.lower() in ['1', 'true', 'yes']:
+        location = DEFAULT_PUT_JOURNAL
+    with get_put_journal.lock:
+        if location not in get_put_journal.journals:
+            try:
+                get_put_journal.journals[location] = PutJournal(location)
+            except Exception as e:
+                logger.warning(
+                    'Cannot use PUT journal {}: {}'.format(location, str(e)))
+                get_put_journal.journals[location] = None
+        return get_put_journal.journals[location]
+
+
+get_put_journal.journals = {}  # journals by location
+get_put_journal.lock = threading.Lock()
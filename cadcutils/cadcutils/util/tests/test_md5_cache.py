@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#
+# ***********************************************************************
+import os
+import time
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from unittest.mock import Mock, patch
+
+from cadcutils.util import md5_cache
+from cadcutils.util.md5_cache import Md5Cache, get_md5_cache
+
+
+def test_md5_cache():
+    cache_dir = TemporaryDirectory()
+    cache = Md5Cache(os.path.join(cache_dir.name, 'subdir', 'md5.db'))
+    src = NamedTemporaryFile()
+    with open(src.name, 'wb') as f:
+        f.write(b'abcde')
+    assert cache.get(src.name) is None
+    cache.put(src.name, 'ab56b4d92b40713acc5af89985d4b786')
+    assert 'ab56b4d92b40713acc5af89985d4b786' == cache.get(src.name)
+
+    # persisted
+    cache = Md5Cache(os.path.join(cache_dir.name, 'subdir', 'md5.db'))
+    assert 'ab56b4d92b40713acc5af89985d4b786' == cache.get(src.name)
+
+    # modified file invalidates the entry
+    stat_info = os.stat(src.name)
+    time.sleep(0.01)
+    with open(src.name, 'ab') as f:
+        f.write(b'f')
+    assert cache.get(src.name) is None
+
+    # file modified while md5 computed is not saved
+    cache.put(src.name, 'beef' * 8, stat_info)
+    assert cache.get(src.name) is None
+    cache.put(src.name, 'beef' * 8, os.stat(src.name))
+    assert 'beef' * 8 == cache.get(src.name)
+
+    # same inode number on a different device is a different file
+    current = os.stat(src.name)
+    other_device = Mock(st_dev=current.st_dev + 1, st_ino=current.st_ino,
+                        st_size=current.st_size,
+                        st_mtime_ns=current.st_mtime_ns)
+    cache.put(src.name, 'dead' * 8, other_device)
+    assert 'beef' * 8 == cache.get(src.name)
+
+
+def test_get_md5_cache():
+    cache_dir = TemporaryDirectory()
+    location = os.path.join(cache_dir.name, 'md5.db')
+    with patch.dict(os.environ, {}, clear=True):
+        assert get_md5_cache() is None
+    with patch.dict(os.environ, {md5_cache.MD5_CACHE_ENV: '0'}):
+        assert get_md5_cache() is None
+    with patch.dict(os.environ, {md5_cache.MD5_CACHE_ENV: location}):
+        cache = get_md5_cache()
+        assert location == cache.location
+        assert cache is get_md5_cache()
+    with patch.dict(os.environ, {md5_cache.MD5_CACHE_ENV: '1'}):
+        with patch('cadcutils.util.md5_cache.DEFAULT_MD5_CACHE', location):
+            assert get_md5_cache() is cache
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#
+# ***********************************************************************
+import os
+import time
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from unittest.mock import patch
+
+from cadcutils.util import put_journal
+from cadcutils.util.put_journal import PutJournal, get_put_journal
+
+URL = 'https://someurl/path/file'
+
+
+def test_put_journal():
+    journal_dir = TemporaryDirectory()
+    journal = PutJournal(os.path.join(journal_dir.name, 'subdir'))
+    src = NamedTemporaryFile()
+    with open(src.name, 'wb') as f:
+        f.write(b'abcde')
+    assert journal.get(src.name, URL) is None
+    journal.put(src.name, URL, '123', 2, 1, 'beef' * 8)
+    entry = journal.get(src.name, URL)
+    assert '123' == entry['trans_id']
+    assert 2 == entry['seg_size']
+    assert 1 == entry['segments']
+    assert 'beef' * 8 == entry['md5']
+
+    # persisted
+    journal = PutJournal(os.path.join(journal_dir.name, 'subdir'))
+    assert entry == journal.get(src.name, URL)
+
+    # different destination
+    assert journal.get(src.name, 'https://someurl/path/other') is None
+
+    journal.remove(src.name)
+    assert journal.get(src.name, URL) is None
+    journal.remove(src.name)
+
+    # modified file invalidates the entry
+    journal.put(src.name, URL, '123', 2, 1, 'beef' * 8)
+    time.sleep(0.01)
+    with open(src.name, 'ab') as f:
+        f.write(b'f')
+    assert journal.get(src.name, URL) is None
+    assert not os.listdir(os.path.join(journal_dir.name, 'subdir'))
+
+
+def test_get_put_journal():
+    journal_dir = TemporaryDirectory()
+    with patch.dict(os.environ, {}, clear=True):
+        assert get_put_journal() is None
+    with patch.dict(os.environ, {put_journal.PUT_JOURNAL_ENV: 'no'}):
+        assert get_put_journal() is None
+    with patch.dict(os.environ,
+                    {put_journal.PUT_JOURNAL_ENV: journal_dir.name}):
+        journal = get_put_journal()
+        assert journal_dir.name == journal.location
+        assert journal is get_put_journal()
+    with patch.dict(os.environ, {put_journal.PUT_JOURNAL_ENV: 'yes'}):
+        with patch('cadcutils.util.put_journal.DEFAULT_PUT_JOURNAL',
+                   journal_dir.name):
+            assert get_put_journal() is journal
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#
+# ***********************************************************************
+import json
+from unittest.mock import patch
+
+import pytest
+
+from cadcutils.util import timing
+from cadcutils.util.timing import TimingReport, transfer_timing, \
+    timing_phase, current_timing
+
+
+@patch('cadcutils.util.timing.time.perf_counter')
+def test_transfer_timing(clock_mock):
+    clock_mock.side_effect = [0, 1, 3, 3, 4, 8, 9, 10, 10, 12]
+    report = TimingReport()
+    with timing_phase('negotiate'):
+        # nothing timed
+        pass
+    t = report.new_timing('cadc:TEST/file', 'get')
+    with transfer_timing(t):
+        assert t is current_timing()
+        # 0 start, 1-3 negotiate, 3-4 transfer, 4-8 md5, 8-9 transfer, 10 end
+        with timing_phase('negotiate'):
+            pass
+        with timing_phase('transfer'):
+            with timing_phase('md5'):
+                pass
+            # nested transfers are not timed separately
+            with transfer_timing(report.new_timing('other', 'get')):
+                pass
+        t.size = 100
+    assert current_timing() is None
+    assert {'id': 'cadc:TEST/file', 'operation': 'get', 'size': 100,
+            'duration': 10, 'error': None,
+            'phases': {'negotiate': 2, 'transfer': 2, 'md5': 4,
+                       'other': 2}} == t.to_dict()
+
+    t = report.new_timing('cadc:TEST/file2', 'get')
+    with pytest.raises(RuntimeError):
+        with transfer_timing(t):
+            raise RuntimeError('failed')
+    assert 2 == t.duration
+    summary = report.summary()
+    assert 2 == summary['transfers']
+    assert 1 == summary['failed']
+    assert 100 == summary['bytes']
+    assert {'total': 12, 'max': 10, 'p50': 2, 'p90': 10, 'p99': 10} == \
+        summary['duration']
+    assert {'total': 4, 'max': 4, 'p50': 0, 'p90': 4, 'p99': 4} == \
+        summary['phases']['md5']
+    report = json.loads(report.to_json())
+    assert ['cadc:TEST/file', 'cadc:TEST/file2'] == \
+        [t['id'] for t in report['transfers']]
+    assert 'RuntimeError: failed' == report['transfers'][1]['error']
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert 50 == timing._percentile(values, 50)
+    assert 99 == timing._percentile(values, 99)
+    assert 1 == timing._percentile([1], 90)
@@ -76,11 +76,15 @@ import os
 import sys
 import logging
 import hashlib
+import mmap
+import time
 from cadcutils.util import date2ivoa, str2ivoa, get_base_parser, \
-    get_log_level, get_logger, Md5File, get_url_content, VersionWarning, check_version
+    get_log_level, get_logger, Md5File, Md5MappedFile, get_url_content, \
+    VersionWarning, check_version
 from cadcutils import exceptions, util
+from cadcutils.util.tests.import_helpers import assert_lazy_imports
 import pytest
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 import warnings
 
 THIS_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -320,6 +324,29 @@ class UtilTests(unittest.TestCase):
                 util.check_version.checked = []
                 check_version('cadc-application 1.0.1')
 
+    @patch('cadcutils.util.utils.VERSION_CHECK_TIMEOUT', 0.1)
+    def test_check_version_nonblocking(self):
+        # slow PyPI does not hold back the caller
+        def slow_content(*args, **kwargs):
+            time.sleep(1)
+            return '{"releases": {"9.9.9": []}}'
+
+        with patch('cadcutils.util.utils.get_url_content') as mock_content:
+            mock_content.side_effect = slow_content
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", category=VersionWarning)
+                util.check_version.checked = []
+                start = time.time()
+                check_version('cadc-application 0.2')
+                assert time.time() - start < 0.5
+
+            # check turned off through the environment
+            mock_content.reset_mock()
+            util.check_version.checked = []
+            with patch.dict(os.environ, {'CADC_VERSION_CHECK': 'false'}):
+                check_version('cadc-application 0.2')
+            mock_content.assert_not_called()
+
 
 def test_get_url_content():
     cache_file = NamedTemporaryFile()
@@ -374,6 +401,106 @@ def test_get_url_content():
                                                   refresh_interval=0)
 
 
+def test_get_url_content_conditional():
+    cache_dir = TemporaryDirectory()
+    cache_file = os.path.join(cache_dir.name, 'subdir', 'content')
+    content = 'TEST CACHE'
+    with patch('cadcutils.util.utils.requests.Session') as mock_session:
+        response = Mock(status_code=200, text=content,
+                        headers={'ETag': '"abc"',
+                                 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+        msession = Mock()
+        msession.get.return_value = response
+        mock_session.return_value = msession
+        assert content == get_url_content('https://some.site',
+                                          cache_file=cache_file,
+                                          refresh_interval=10)
+        msession.get.assert_called_once_with('https://some.site', verify=True,
+                                             headers={}, timeout=None)
+        # only the cache and validators files are left behind
+        assert ['content', 'content.validators'] == \
+            sorted(os.listdir(os.path.dirname(cache_file)))
+
+        # stale cache is revalidated with a conditional request
+        os.utime(cache_file, (0, 0))
+        msession.get.reset_mock()
+        msession.get.return_value = Mock(status_code=304, text='', headers={})
+        assert content == get_url_content('https://some.site',
+                                          cache_file=cache_file,
+                                          refresh_interval=10)
+        msession.get.assert_called_once_with(
+            'https://some.site', verify=True,
+            headers={'If-None-Match': '"abc"',
+                     'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'},
+            timeout=None)
+        # freshness bumped
+        assert time.time() - os.path.getmtime(cache_file) < 10
+        msession.get.reset_mock()
+        assert content == get_url_content('https://some.site',
+                                          cache_file=cache_file,
+                                          refresh_interval=10)
+        assert not msession.get.called
+
+        # modified content without validators
+        os.utime(cache_file, (0, 0))
+        new_content = 'TEST CACHE AGAIN'
+        msession.get.return_value = Mock(status_code=200, text=new_content,
+                                         headers={})
+        assert new_content == get_url_content('https://some.site',
+                                              cache_file=cache_file,
+                                              refresh_interval=10)
+        with open(cache_file, 'r') as f:
+            assert new_content == f.read()
+        assert ['content'] == os.listdir(os.path.dirname(cache_file))
+
+
+def test_get_url_content_atomic():
+    cache_dir = TemporaryDirectory()
+    cache_file = os.path.join(cache_dir.name, 'content')
+    umask = os.umask(0o022)
+    try:
+        with patch('cadcutils.util.utils.requests.Session') as mock_session:
+            msession = Mock()
+            msession.get.return_value = Mock(status_code=200, text='TEST V1',
+                                             headers={'ETag': '"v1"'})
+            mock_session.return_value = msession
+            assert 'TEST V1' == get_url_content('https://some.site',
+                                                cache_file=cache_file,
+                                                refresh_interval=10)
+            # umask applied rather than the 0600 of a temporary file
+            assert 0o644 == os.stat(cache_file).st_mode & 0o777
+
+            # the content changes but the validators are not updated (e.g.
+            # the process died in between): they are not used anymore
+            with open(cache_file, 'w') as f:
+                f.write('TEST V2')
+            os.utime(cache_file, (0, 0))
+            msession.get.return_value = Mock(status_code=200, text='TEST V3',
+                                             headers={'ETag': '"v3"'})
+            assert 'TEST V3' == get_url_content('https://some.site',
+                                                cache_file=cache_file,
+                                                refresh_interval=10)
+            msession.get.assert_called_with('https://some.site', verify=True,
+                                            headers={}, timeout=None)
+
+            # the mode of the replaced file is kept
+            os.chmod(cache_file, 0o640)
+            os.utime(cache_file, (0, 0))
+            msession.get.return_value = Mock(status_code=200, text='TEST V4',
+                                             headers={'ETag': '"v4"'})
+            assert 'TEST V4' == get_url_content('https://some.site',
+                                                cache_file=cache_file,
+                                                refresh_interval=10)
+            msession.get.assert_called_with(
+                'https://some.site', verify=True,
+                headers={'If-None-Match': '"v3"'}, timeout=None)
+            assert 0o640 == os.stat(cache_file).st_mode & 0o777
+            assert ['content', 'content.validators'] == \
+                sorted(os.listdir(cache_dir.name))
+    finally:
+        os.umask(umask)
+
+
 class TestMd5File(unittest.TestCase):
     """Test the vos Md5File class.
     """
@@ -437,3 +564,61 @@ class TestMd5File(unittest.TestCase):
 
         with pytest.raises(AttributeError):
             Md5File(tmpfile.name, 'rb', offset=1000)
+
+
+class TestMd5MappedFile(unittest.TestCase):
+    """Test the Md5MappedFile class.
+    """
+    def test_operations(self):
+        tmpfile = tempfile.NamedTemporaryFile()
+        binary_content = os.urandom(mmap.ALLOCATIONGRANULARITY + 100)
+        with open(tmpfile.name, 'wb') as f:
+            f.write(binary_content)
+
+        for offset, length in [(0, None), (4, None), (5, 6),
+                               (mmap.ALLOCATIONGRANULARITY + 3, 1000),
+                               (len(binary_content), None)]:
+            expected = binary_content[offset:][:length]
+            with Md5MappedFile(tmpfile.name, offset, length,
+                               block_size=7) as f:
+                assert len(expected) == len(f)
+                blocks = [bytes(block) for block in f]
+            assert expected == b''.join(blocks)
+            assert all(len(block) <= 7 for block in blocks)
+            assert hashlib.md5(expected).hexdigest() == f.md5_checksum
+
+        # blocks are not copies of the file content
+        with Md5MappedFile(tmpfile.name) as f:
+            assert isinstance(next(iter(f)), memoryview)
+            assert not hasattr(f, 'read')
+
+        with pytest.raises(AttributeError):
+            Md5MappedFile(tmpfile.name, offset=len(binary_content) + 1)
+
+    def test_iterate_twice(self):
+        # e.g. body resent after a connection error
+        tmpfile = tempfile.NamedTemporaryFile()
+        binary_content = os.urandom(1000)
+        with open(tmpfile.name, 'wb') as f:
+            f.write(binary_content)
+        with Md5MappedFile(tmpfile.name, 10, 100, block_size=7) as f:
+            list(f)  # sent and then resent
+            assert binary_content[10:110] == b''.join(bytes(b) for b in f)
+        assert hashlib.md5(binary_content[10:110]).hexdigest() == \
+            f.md5_checksum
+
+        # chained with the md5 of the preceding content
+        preceding = hashlib.md5(binary_content[:10])
+        with Md5MappedFile(tmpfile.name, 10, 100) as f:
+            f._md5_checksum = preceding.copy()
+            list(f)
+            list(f)
+        assert hashlib.md5(binary_content[:110]).hexdigest() == \
+            f.md5_checksum
+
+
+def test_assert_lazy_imports():
+    assert_lazy_imports('json', ['sqlite3'])
+    with pytest.raises(AssertionError) as e:
+        assert_lazy_imports('json', ['sqlite3', 'json.decoder'])
+    assert 'json.decoder imported by json' == str(e.value)
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#
+# ***********************************************************************
+
+"""
+Breakdown of the time spent in the phases of file transfers (scheme
+resolution, capabilities lookup, transfer negotiation, checks, md5
+computation, bytes on the wire, commit...).
+
+A TransferTiming is made current in a thread with `transfer_timing` and the
+code of the clients marks its phases with `timing_phase`, which does nothing
+when there is no current timing. Phases are exclusive: the time of a phase
+nested in another one is only counted in the nested phase. The time that is
+not in any phase is reported as "other".
+
+Example:
+    report = TimingReport()
+    with transfer_timing(report.new_timing('cadc:TEST/file', 'get')):
+        with timing_phase('negotiate'):
+            ...
+    print(report.to_json())
+"""
+
+import contextlib
+import json
+import threading
+import time
+
+__all__ = ['TransferTiming', 'TimingReport', 'transfer_timing',
+           'timing_phase', 'current_timing']
+
+OTHER_PHASE = 'other'
+PERCENTILES = (50, 90, 99)
+
+_local = threading.local()
+
+
+class TransferTiming(object):
+    """
+    Times (sec) spent in the phases of a transfer. Not thread safe: phases
+    are recorded by the thread that made the timing current.
+    """
+
+    def __init__(self, id, operation):
+        """
+        :param id: identifier of the transferred file
+        :param operation: type of transfer (e.g. get, put)
+        """
+        self.id = id
+        self.operation = operation
+        self.phases = {}
+        self.size = None
+        self.error = None
+        self.duration = None
+        self._start = None
+        self._stack = []  # [phase, time the phase was (re)started]
+
+    def start(self):
+        self._start = time.perf_counter()
+
+    def stop(self, error=None):
+        self.duration = time.perf_counter() - self._start
+        self.error = error
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            # pause the enclosing phase
+            self._add(self._stack[-1][0], now - self._stack[-1][1])
+        self._stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._add(name, now - self._stack.pop()[1])
+            if self._stack:
+                self._stack[-1][1] = now
+
+    def _add(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0) + duration
+
+    def to_dict(self):
+        phases = dict(self.phases)
+        if self.duration is not None:
+            phases[OTHER_PHASE] = max(
+                self.duration - sum(self.phases.values()), 0)
+        return {'id': self.id,
+                'operation': self.operation,
+                'size': self.size,
+                'duration': self.duration,
+                'error': None if self.error is None else '{}: {}'.format(
+                    type(self.error).__name__, self.error),
+                'phases': phases}
+
+
+def _percentile(sorted_values, percentile):
+    # nearest rank percentile
+    index = max(-(-len(sorted_values) * percentile // 100) - 1, 0)
+    return sorted_values[index]
+
+
+class TimingReport(object):
+    """
+    Timings of a number of transfers with aggregate statistics. Instances
+    can be shared between threads.
+    """
+
+    def __init__(self):
+        self.timings = []
+        self._lock = threading.Lock()
+
+    def new_timing(self, id, operation):
+        """
+        Creates the timing of a transfer that is part of the report
+        :param id: identifier of the transferred file
+        :param operation: type of transfer
+        :return: TransferTiming
+        """
+        timing = TransferTiming(id, operation)
+        with self._lock:
+            self.timings.append(timing)
+        return timing
+
+    def summary(self):
+        """
+        Aggregates of the completed transfers
+        :return: dictionary with the number of transfers, failures and
+        bytes and the total, percentiles (p50, p90, p99) and max of the
+        durations of the transfers and of each of their phases
+        """
+        with self._lock:
+            timings = [t.to_dict() for t in self.timings
+                       if t.duration is not None]
+        durations = {'duration': [t['duration'] for t in timings]}
+        for t in timings:
+            for name, duration in t['phases'].items():
+                durations.setdefault(name, []).append(duration)
+        stats = {}
+        for name, values in durations.items():
+            if not values:
+                continue
+            # transfers without the phase spent no time in it
+            values = sorted(values + [0] * (len(timings) - len(values)))
+            stats[name] = {'total': sum(values), 'max': values[-1]}
+            for p in PERCENTILES:
+                stats[name]['p{}'.format(p)] = _percentile(values, p)
+        return {'transfers': len(timings),
+                'failed': len([t for t in timings if t['error']]),
+                'bytes': sum([t['size'] or 0 for t in timings]),
+                'duration': stats.pop('duration', None),
+                'phases': stats}
+
+    def to_dict(self):
+        with self._lock:
+            timings = [t.to_dict() for t in self.timings
+                       if t.duration is not None]
+        return {'transfers': timings, 'summary': self.summary()}
+
+    def to_json(self, **kwargs):
+        """
+        :param kwargs: arguments of json.dumps
+        :return: the report as JSON
+        """
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+def current_timing():
+    """
+    :return: the TransferTiming current in the thread or None
+    """
+    return getattr(_local, 'timing', None)
+
+
+@contextlib.contextmanager
+def transfer_timing(timing):
+    """
+    Makes a timing current in the thread for the duration of the context
+    and times it. Nothing is timed when `timing` is None or when another
+    timing is already current (e.g. a transfer that calls another one).
+    :param timing: TransferTiming or None
+    """
+    if timing is None or current_timing() is not None:
+        yield timing
+        return
+    _local.timing = timing
+    timing.start()
+    try:
+        yield timing
+    except BaseException as e:
+        timing.stop(e)
+        raise
+    else:
+        timing.stop()
+    finally:
+        _local.timing = None
+
+
+@contextlib.contextmanager
+def timing_phase(name):
+    """
+    Attributes the time spent in the context to a phase of the current
+    timing (if any)
+    :param name: name of the phase
+    """
+    timing = current_timing()
+    if timing is None:
+        yield
+    else:
+        with timing.phase(name):
+            yield
@@ -65,6 +65,7 @@
 #
 # ***********************************************************************
 import logging
+import mmap
 import sys
 import inspect
 from argparse import ArgumentParser, RawDescriptionHelpFormatter, SUPPRESS, \
@@ -74,23 +75,29 @@ from urllib.parse import urlparse
 from operator import attrgetter
 import hashlib
 import os
-from packaging.version import Version
+import stat
 import requests
 import time
 import json
+import threading
 import warnings
 from pathlib import Path
 from cadcutils import exceptions
 
 __all__ = ['IVOA_DATE_FORMAT', 'date2ivoa', 'str2ivoa', 'get_url_content',
            'get_logger', 'get_log_level', 'get_base_parser', 'Md5File',
-           'check_version', 'VersionWarning']
+           'Md5MappedFile', 'check_version', 'VersionWarning']
 
 # TODO both these are very bad, implement more sensibly
 IVOA_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
 
 CADC_CACHE_DIR = os.path.join(os.path.expanduser("~"), '.config')
 VERSION_REFRESH_INTERVAL = 24 * 60 * 60  # 24h
+# size of the blocks of memory mapped files returned by Md5MappedFile
+MAPPED_BLOCK_SIZE = 4 * 1024 * 1024
+VERSION_CHECK_TIMEOUT = 2  # how long (sec) the callers wait for the check
+VERSION_REQUEST_TIMEOUT = 30  # timeout of the request to PyPI
+VERSION_CHECK_ENV = 'CADC_VERSION_CHECK'  # set to 0 to turn the check off
 
 DEFAULT_LOG_FORMAT = "%(levelname)s: %(name)s %(message)s"
 DEBUG_LOG_FORMAT = "%(levelname)s: @(%(asctime)s) %(name)s " \
@@ -495,37 +502,141 @@ class Md5File(object):
         return self._md5_checksum.hexdigest()
 
 
-def get_url_content(url, cache_file, refresh_interval, verify=True):
+class Md5MappedFile(object):
+    """
+    A read only alternative to Md5File that memory maps the file (or a
+    segment of it) and iterates over it in blocks. The blocks are
+    memoryview slices of the map so the MD5 sum and the consumer (typically
+    the socket of an HTTP request body) work on the same memory without
+    any intermediate copies. Objects of this class are meant to be used as
+    the data of requests PUT calls: they have a length but, unlike files,
+    they do not have a read method.
+    """
+
+    def __init__(self, f, offset=0, length=None, block_size=None):
+        """
+        :param f: location of the file
+        :param offset: offset to start from
+        :param length: data length to read from
+        :param block_size: size of the blocks returned by the iterator.
+        Default is MAPPED_BLOCK_SIZE
+        """
+        self._end_offset = os.stat(f).st_size
+        if offset > self._end_offset:
+            raise AttributeError(
+                '{} offset greater that file size: {} vs {}'.format(
+                    f, offset, self._end_offset))
+        if length:
+            self._end_offset = min(offset + length, self._end_offset)
+        self._offset = offset
+        self._block_size = block_size or MAPPED_BLOCK_SIZE
+        self._md5_checksum = hashlib.md5()
+        # state of the md5 hash when the iteration first started
+        self._md5_start = None
+        self._map = None
+        self._view = None
+        if self._end_offset > offset:
+            # map offsets must be multiple of the allocation granularity
+            start = offset - offset % mmap.ALLOCATIONGRANULARITY
+            with open(f, 'rb') as file:
+                self._map = mmap.mmap(file.fileno(),
+                                      self._end_offset - start,
+                                      access=mmap.ACCESS_READ,
+                                      offset=start)
+            self._view = memoryview(self._map)[offset - start:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # blocks still referenced. The map is closed when they
+                # are garbage collected
+                pass
+            self._map = None
+
+    def __len__(self):
+        """
+        :return: size meant to be seen by the clients (entire file or just
+        a segment/chunk)
+        """
+        return self._end_offset - self._offset
+
+    def len(self):
+        return self.__len__()
+
+    def __iter__(self):
+        # the content is iterated again when a request is resent, e.g.
+        # after a connection error. The hash starts over every time.
+        if self._md5_start is None:
+            self._md5_start = self._md5_checksum.copy()
+        else:
+            self._md5_checksum = self._md5_start.copy()
+        if self._view is None:
+            return
+        for position in range(0, len(self._view), self._block_size):
+            block = self._view[position:position + self._block_size]
+            self._md5_checksum.update(block)
+            yield block
+            # consumer is done with it
+            block.release()
+
+    @property
+    def md5_checksum(self):
+        return self._md5_checksum.hexdigest()
+
+
+def get_url_content(url, cache_file, refresh_interval, verify=True,
+                    timeout=None):
     """
      Return content of a url from a cache file or directly from source if the
      cache is stale (file is older than refresh_interval). For now, the access
      to the url is anonymous.
+     The validators of the content (ETag and Last-Modified headers) are saved
+     next to the cache file, together with the md5 of the content they
+     belong to, and a stale cache is revalidated with a conditional request.
+     The content is not downloaded again when it has not changed at the
+     source. Validators that do not match the cached content (e.g. the
+     process died between the two writes) are ignored. The cache file is
+     replaced atomically so that concurrent processes never read a partially
+     written file.
      :param url: URL of the source
      :param cache_file: cache file location
      :param refresh_interval: how long (in sec) to consider the cache stale
      :param verify: verify the HTTPS server certificate. This should be
      set to False only for testing purposes
+     :param timeout: timeout (sec) of the request to the source
 
      :returns content of the url from source or cache
     """
     content = None
+    cached_content = None
     if os.path.exists(cache_file):
         last_accessed = os.path.getmtime(cache_file)
+        try:
+            with open(cache_file, 'r') as f:
+                cached_content = f.read()
+        except Exception:
+            # will download it
+            pass
     else:
         last_accessed = None
     if (last_accessed and (time.time() - last_accessed) < refresh_interval):
         # get content from the cached file
         logger.debug(
             'Read cached content of {}'.format(cache_file))
-        try:
-            with open(cache_file, 'r') as f:
-                content = f.read()
-        except Exception:
-            # will download it
-            pass
+        content = cached_content
     # config dirs if they don't exist yet
-    if not os.path.exists(os.path.dirname(cache_file)):
-        os.makedirs(os.path.dirname(cache_file))
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
 
     if not content:
         # get content from source URL
@@ -533,14 +644,25 @@ def get_url_content(url, cache_file, refresh_interval, verify=True):
             session = requests.Session()
             # do not allow requests to use .netrc file
             session.trust_env = False
-            rsp = session.get(url, verify=verify)
+            headers = {}
+            if cached_content:
+                headers = _get_conditional_headers(cache_file,
+                                                   cached_content)
+            rsp = session.get(url, verify=verify, headers=headers,
+                              timeout=timeout)
             rsp.raise_for_status()
-            content = rsp.text
-            if content is None or len(content.strip(' ')) == 0:
-                # workaround for a problem with CADC servers
-                raise exceptions.HttpException('Received empty content')
-            with open(cache_file, 'w') as f:
-                f.write(content)
+            if rsp.status_code == requests.codes.not_modified:
+                logger.debug('Content of {} not modified'.format(url))
+                content = cached_content
+                # bump the freshness of the cache
+                Path(cache_file).touch()
+            else:
+                content = rsp.text
+                if content is None or len(content.strip(' ')) == 0:
+                    # workaround for a problem with CADC servers
+                    raise exceptions.HttpException('Received empty content')
+                _write_file_atomically(cache_file, content)
+                _save_validators(cache_file, content, rsp.headers)
         except Exception as e:
             # problems with the source. Try to use the old
             # local one regardless of how old it is
@@ -556,6 +678,75 @@ def get_url_content(url, cache_file, refresh_interval, verify=True):
     return content
 
 
+def _get_validators_file(cache_file):
+    return '{}.validators'.format(cache_file)
+
+
+def _content_md5(content):
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+
+def _get_conditional_headers(cache_file, cached_content):
+    # returns the headers of a conditional request for the content of
+    # the cache file
+    headers = {}
+    try:
+        with open(_get_validators_file(cache_file), 'r') as f:
+            validators = json.load(f)
+    except Exception:
+        return headers
+    if validators.get('md5', None) != _content_md5(cached_content):
+        # validators of a different version of the content
+        logger.debug('Ignoring stale validators of {}'.format(cache_file))
+        return headers
+    if validators.get('ETag', None):
+        headers['If-None-Match'] = validators['ETag']
+    if validators.get('Last-Modified', None):
+        headers['If-Modified-Since'] = validators['Last-Modified']
+    return headers
+
+
+def _save_validators(cache_file, content, headers):
+    # saves the validators of the content of a cache file
+    validators = {}
+    for name in ['ETag', 'Last-Modified']:
+        value = headers.get(name, None)
+        if isinstance(value, str):
+            validators[name] = value
+    validators_file = _get_validators_file(cache_file)
+    try:
+        if validators:
+            validators['md5'] = _content_md5(content)
+            _write_file_atomically(validators_file, json.dumps(validators))
+        elif os.path.exists(validators_file):
+            os.remove(validators_file)
+    except Exception as e:
+        logger.debug('Cannot save validators of {}: {}'.format(
+            cache_file, str(e)))
+
+
+def _write_file_atomically(file_name, content):
+    # the content is written to a temporary file first and then moved in
+    # place so that readers never see a partially written file. Unlike
+    # mkstemp (0600), the temporary file is created with the umask applied
+    # and takes the mode of the file it replaces.
+    temp_file = os.path.join(os.path.dirname(file_name), '.{}.{}'.format(
+        os.path.basename(file_name), os.urandom(8).hex()))
+    fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        try:
+            os.chmod(temp_file, stat.S_IMODE(os.stat(file_name).st_mode))
+        except FileNotFoundError:
+            pass
+        os.replace(temp_file, file_name)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
 class VersionWarning(Warning):
     # category of warnings when current version falls behind the released version
     pass
@@ -568,6 +759,12 @@ def check_version(version):
     versions of format "major.minor.micro" and ignore the others including pre-releases
     or dev releases.
 
+    The PyPI information is retrieved in a background (daemon) thread and the
+    caller waits for at most VERSION_CHECK_TIMEOUT seconds for it. A check
+    that does not finish in time is abandoned (but it might still refresh
+    the cache for the next time). Setting the CADC_VERSION_CHECK environment
+    variable to "0" (or "false", "no", "off") turns the check off.
+
     Note: Only the first check of a package is performed. Subsequent calls
     for the same package are ignored.
 
@@ -576,21 +773,59 @@ def check_version(version):
 
     :return: raises a VersionWarning when PyPI version is ahead.
     """
-    strict_versions = None
-    current_version = None
+    if os.getenv(VERSION_CHECK_ENV, '').lower() in ['0', 'false', 'no', 'off']:
+        return
+    from packaging.version import Version
     try:
         package, pkg_version = version.split(' ')
-        if package in check_version.checked:
-            return
-        check_version.checked.append(package)
+        current_version = Version(pkg_version)
+    except Exception as e:
+        logger.debug(
+            'Unexpected exception in PyPI version checking: {}'.format(str(e)))
+        return
+    if package in check_version.checked:
+        return
+    check_version.checked.append(package)
+    result = {}
+
+    def get_latest():
+        result['latest'] = _get_latest_version(package)
+
+    checker = threading.Thread(target=get_latest, daemon=True,
+                               name='check_version-{}'.format(package))
+    checker.start()
+    checker.join(VERSION_CHECK_TIMEOUT)
+    latest_version = result.get('latest', None)
+    if latest_version is None:
+        if checker.is_alive():
+            logger.debug('PyPI version check of {} abandoned after {}s'.format(
+                package, VERSION_CHECK_TIMEOUT))
+        return
+    if current_version < latest_version:
+        current_warn_formatting = warnings.formatwarning
+        warnings.formatwarning = lambda message, *ignore: 'WARNING: {}\n'.format(message)
+        warnings.warn('Current version {}. A newer version, {}, '
+                      'is available on PyPI'.format(version,
+                                                    latest_version),
+                      category=VersionWarning)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        warnings.formatwarning = current_warn_formatting
+
+
+def _get_latest_version(package):
+    # returns the latest "major.minor.micro" version of a package on PyPI or
+    # None if it cannot be determined
+    from packaging.version import Version
+    try:
         cache_file = os.path.join(CADC_CACHE_DIR, package, 'caches/.pypi_versions.json')
         content = get_url_content(
             url='https://pypi.org/pypi/{}/json'.format(package),
             cache_file=cache_file,
-            refresh_interval=VERSION_REFRESH_INTERVAL)
+            refresh_interval=VERSION_REFRESH_INTERVAL,
+            timeout=VERSION_REQUEST_TIMEOUT)
         data = json.loads(content)
         versions = list(data['releases'].keys())
-        current_version = Version(pkg_version)
         strict_versions = []
         for v in versions:
             try:
@@ -600,21 +835,12 @@ def check_version(version):
                         Version('{}.{}.{}'.format(tempv.major, tempv.minor, tempv.micro)))
             except ValueError:
                 continue
-        strict_versions.sort()
+        if strict_versions:
+            return max(strict_versions)
     except Exception as e:
         logger.debug(
             'Unexpected exception in PyPI version checking: {}'.format(str(e)))
-        pass
-    if strict_versions and current_version < strict_versions[-1]:
-        current_warn_formatting = warnings.formatwarning
-        warnings.formatwarning = lambda message, *ignore: 'WARNING: {}\n'.format(message)
-        warnings.warn('Current version {}. A newer version, {}, '
-                      'is available on PyPI'.format(version,
-                                                    strict_versions[-1]),
-                      category=VersionWarning)
-        sys.stdout.flush()
-        sys.stderr.flush()
-        warnings.formatwarning = current_warn_formatting
+    return None
 
 
 check_version.checked = []  # packages already checked